@@ -20,10 +20,34 @@ def main():
         default="parsed_outputs",
         help="Root directory where parsed outputs will be stored (default: 'parsed_outputs')"
     )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of parallel parsing processes, each loading the models once (default: 1)"
+    )
+    parser.add_argument(
+        "--threads_per_worker",
+        type=int,
+        default=None,
+        help="CPU threads per worker (default: CPU cores divided evenly between workers)"
+    )
+    parser.add_argument(
+        "--window_pages",
+        type=int,
+        default=0,
+        help="Convert each PDF this many pages at a time, resuming after a crash (default: 0, whole document)"
+    )
     args = parser.parse_args()
 
     # Call the batch_parse function from docling_utils
-    batch_parse(args.input_dir, args.output_root)
+    batch_parse(
+        args.input_dir,
+        args.output_root,
+        workers=args.workers,
+        threads_per_worker=args.threads_per_worker,
+        window_pages=args.window_pages or None,
+    )
     print(f"Finished parsing all PDFs from '{args.input_dir}' into '{args.output_root}'.")
 
 if __name__ == "__main__":
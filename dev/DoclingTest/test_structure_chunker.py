@@ -0,0 +1,23 @@
+import math
+from utils.structure_chunker import _pack
+
+
+def test_pack_balances_chunk_sizes():
+    units = [("x" * 300, [1]) for _ in range(7)]
+    max_chars = 1000
+
+    sizes = [len(text) for text, _ in _pack(units, max_chars)]
+
+    total = 7 * 300 + 6 * 2
+    n = math.ceil(total / max_chars)
+    assert len(sizes) == n
+    assert sum(sizes) == total - 2 * (n - 1)
+    # No part strays from total / n by more than one paragraph
+    assert all(abs(size - total / n) <= 300 for size in sizes)
+    assert max(sizes) - min(sizes) <= 302
+
+
+def test_pack_respects_max_chars():
+    units = [("y" * length, []) for length in (120, 700, 80, 650, 400, 90, 300, 820, 50)]
+    for text, _ in _pack(units, 1000):
+        assert len(text) <= 1000
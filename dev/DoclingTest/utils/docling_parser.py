@@ -1,18 +1,75 @@
 # File: utils/docling_utils.py
 
 import os
+import json
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
+from typing import List, Optional, Tuple
+import sys
 from docling.document_converter import DocumentConverter
+# dev/, for the parse manifest shared with the LlamaParse parser and the ingest daemon
+sys.path.append(os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..")))
+from chemrag_shared.parse_manifest import ParseManifest
+if __name__ == "__main__":
+    from structure_chunker import CHUNKER_SETTINGS, CHUNKS_NAME, StructureChunker, write_chunks
+else:
+    from .structure_chunker import CHUNKER_SETTINGS, CHUNKS_NAME, StructureChunker, write_chunks
 
-def parse_and_store(source: str, output_dir: str):
+# Converter owned by this worker process, built once by _init_worker
+_worker_converter: Optional[DocumentConverter] = None
+
+# Everything that changes the Markdown and chunks produced; part of the parse manifest key
+PARSER_SETTINGS = {"parser": "docling", "output": "markdown", "chunks": CHUNKER_SETTINGS}
+
+# Windowed conversion state, kept beside (not inside) the markdown folder
+PARTIAL_NAME = "document.md.partial"
+CHUNKS_PARTIAL_NAME = CHUNKS_NAME + ".partial"
+CHECKPOINT_NAME = "parse_checkpoint.json"
+WINDOW_SEPARATOR = "\n\n"
+
+
+def build_converter(num_threads: Optional[int] = None) -> DocumentConverter:
+    """
+    Create a DocumentConverter. Loading the layout and table models is the
+    expensive part, so build one and reuse it for many PDFs. `num_threads`
+    caps the threads Docling's models use for each conversion.
+    """
+    if num_threads is None:
+        return DocumentConverter()
+    from docling.datamodel.base_models import InputFormat
+    from docling.datamodel.pipeline_options import AcceleratorOptions, PdfPipelineOptions
+    from docling.document_converter import PdfFormatOption
+
+    pipeline_options = PdfPipelineOptions()
+    pipeline_options.accelerator_options = AcceleratorOptions(num_threads=num_threads)
+    return DocumentConverter(
+        format_options={InputFormat.PDF: PdfFormatOption(pipeline_options=pipeline_options)}
+    )
+
+
+def parse_and_store(
+    source: str,
+    output_dir: str,
+    converter: Optional[DocumentConverter] = None,
+    window_pages: Optional[int] = None,
+):
     """
     Parse a single PDF (local path or URL) using Docling, then save its contents
     as Markdown to <output_dir>/markdown/document.md.
 
     In other words, under each PDF’s output_dir, we now create a "markdown/" folder,
-    and write "document.md" inside it.
+    and write "document.md" inside it. Next to it, "chunks.jsonl" holds the
+    document split along its sections, paragraphs and tables (see
+    structure_chunker.py), ready for indexing. Pass `converter` to reuse loaded models
+    across calls; otherwise a new one is built. With `window_pages`, a local PDF
+    is converted `window_pages` pages at a time (see parse_windowed).
     """
-    converter = DocumentConverter()
+    converter = converter or DocumentConverter()
+    if window_pages and os.path.isfile(source):
+        parse_windowed(source, output_dir, converter, window_pages)
+        return
     try:
         result = converter.convert(source)
     except Exception as e:
@@ -29,34 +86,268 @@ def parse_and_store(source: str, output_dir: str):
     with open(out_path, "w", encoding="utf-8") as f:
         f.write(full_markdown)
 
+    chunks_path = os.path.join(markdown_folder, CHUNKS_NAME)
+    with open(chunks_path + ".tmp", "wb") as f:
+        write_chunks(StructureChunker().chunk(doc), f)
+    os.replace(chunks_path + ".tmp", chunks_path)
+
+
+def _page_count(pdf_path: str) -> int:
+    import pypdfium2  # installed with docling
+    pdf = pypdfium2.PdfDocument(pdf_path)
+    try:
+        return len(pdf)
+    finally:
+        pdf.close()
+
+
+def _convert_pages(converter: DocumentConverter, source: str, first: int, last: int):
+    """Document model of pages first..last (1-based, inclusive)."""
+    return converter.convert(source, page_range=(first, last)).document
+
+
+def _append(f, data: bytes):
+    f.write(data)
+    f.flush()
+    os.fsync(f.fileno())
 
-def batch_parse(input_dir: str, output_root: str):
+
+def _load_checkpoint(path: str, fingerprint: dict) -> Optional[dict]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            checkpoint = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+    # Progress made on a different version of the PDF (or window size) is useless
+    return checkpoint if checkpoint.get("fingerprint") == fingerprint else None
+
+
+def _save_checkpoint(path: str, checkpoint: dict):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(checkpoint, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def parse_windowed(source: str, output_dir: str, converter: DocumentConverter, window_pages: int):
     """
-    For each PDF in input_dir:
-      1) create parsed_outputs/<basename>/
-      2) create parsed_outputs/<basename>/markdown/
-      3) call parse_and_store(pdf_path, parsed_outputs/<basename>)
-      4) inside that folder, the Markdown file is "markdown/document.md"
+    Convert a local PDF `window_pages` pages at a time, appending each window's
+    Markdown to <output_dir>/document.md.partial (and its chunks to chunks.jsonl.partial),
+    so only one window's document model is in memory at once. After every window,
+    <output_dir>/parse_checkpoint.json records the completed page ranges, the length
+    of the partial files and the open headings; a rerun
+    after a crash resumes from the next window. A window that fails is retried page
+    by page, and pages that still fail are replaced by a note in the Markdown.
+    The finished files are moved to <output_dir>/markdown/.
     """
-    os.makedirs(output_root, exist_ok=True)
+    stat = os.stat(source)
+    pages = _page_count(source)
+    fingerprint = {
+        "size": stat.st_size, "mtime": stat.st_mtime, "pages": pages, "window_pages": window_pages,
+        "chunks": CHUNKER_SETTINGS,
+    }
+    partial_path = os.path.join(output_dir, PARTIAL_NAME)
+    chunks_partial_path = os.path.join(output_dir, CHUNKS_PARTIAL_NAME)
+    checkpoint_path = os.path.join(output_dir, CHECKPOINT_NAME)
+    os.makedirs(output_dir, exist_ok=True)
+
+    checkpoint = _load_checkpoint(checkpoint_path, fingerprint) if os.path.exists(partial_path) else None
+    if checkpoint is None:
+        checkpoint = {
+            "fingerprint": fingerprint, "completed": [], "failed_pages": [],
+            "bytes": 0, "chunk_bytes": 0, "headings": [],
+        }
+    else:
+        print(f"Resuming '{os.path.basename(source)}' after page {checkpoint['completed'][-1][1]}.")
+    next_page = checkpoint["completed"][-1][1] + 1 if checkpoint["completed"] else 1
+    # Sections continue across windows
+    chunker = StructureChunker()
+    chunker.headings = [tuple(h) for h in checkpoint["headings"]]
+
+    with open(partial_path, "ab") as out, open(chunks_partial_path, "ab") as chunks_out:
+        # Drop anything written after the last checkpoint (a window cut short by a crash)
+        out.truncate(checkpoint["bytes"])
+        chunks_out.truncate(checkpoint["chunk_bytes"])
+        for first in range(next_page, pages + 1, window_pages):
+            last = min(first + window_pages - 1, pages)
+            try:
+                docs = [_convert_pages(converter, source, first, last)]
+                parts = [doc.export_to_markdown() for doc in docs]
+            except Exception as e:
+                print(f"Pages {first}-{last} of '{os.path.basename(source)}' failed ({e}); retrying page by page.")
+                docs, parts = [], []
+                for page in range(first, last + 1):
+                    try:
+                        doc = _convert_pages(converter, source, page, page)
+                        docs.append(doc)
+                        parts.append(doc.export_to_markdown())
+                    except Exception as page_error:
+                        checkpoint["failed_pages"].append(page)
+                        parts.append(f"<!-- page {page} could not be converted: {page_error} -->")
+            markdown = WINDOW_SEPARATOR.join(parts)
+            if checkpoint["bytes"]:
+                markdown = WINDOW_SEPARATOR + markdown
+            for doc in docs:
+                write_chunks(chunker.chunk(doc), chunks_out)
+            _append(chunks_out, b"")
+            _append(out, markdown.encode("utf-8"))
+            checkpoint["bytes"] = out.tell()
+            checkpoint["chunk_bytes"] = chunks_out.tell()
+            checkpoint["headings"] = chunker.headings
+            checkpoint["completed"].append([first, last])
+            _save_checkpoint(checkpoint_path, checkpoint)
+
+    markdown_folder = os.path.join(output_dir, "markdown")
+    os.makedirs(markdown_folder, exist_ok=True)
+    os.replace(chunks_partial_path, os.path.join(markdown_folder, CHUNKS_NAME))
+    os.replace(partial_path, os.path.join(markdown_folder, "document.md"))
+    os.remove(checkpoint_path)
+    if checkpoint["failed_pages"]:
+        print(f"'{os.path.basename(source)}': pages {checkpoint['failed_pages']} could not be converted.")
+
+
+def _limit_threads(threads: int):
+    # Must be set before torch / onnxruntime / BLAS create their pools
+    for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        os.environ[var] = str(threads)
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+
+
+def _init_worker(threads_per_worker: int, limit_threads: bool = True):
+    """Process pool initializer: limit native thread pools, then load the models once."""
+    global _worker_converter
+    if limit_threads:
+        _limit_threads(threads_per_worker)
+    _worker_converter = build_converter(threads_per_worker)
+
+
+def _parse_job(pdf_path: str, output_dir: str, window_pages: Optional[int] = None) -> Tuple[str, float, Optional[str]]:
+    """Runs in a worker: returns (pdf_path, seconds taken, error message or None)."""
+    start = time.monotonic()
+    try:
+        parse_and_store(pdf_path, output_dir, converter=_worker_converter, window_pages=window_pages)
+        return pdf_path, time.monotonic() - start, None
+    except Exception as e:
+        return pdf_path, time.monotonic() - start, str(e)
+
+
+def _format_duration(seconds: float) -> str:
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours:d}:{minutes:02d}:{seconds:02d}"
+
+
+class _Progress:
+    """Prints done/total, throughput and an ETA as PDFs finish."""
+
+    def __init__(self, total: int):
+        self.total = total
+        self.done = 0
+        self.failed = 0
+        self.start = time.monotonic()
+
+    def update(self, pdf_path: str, seconds: float, error: Optional[str]):
+        self.done += 1
+        name = os.path.basename(pdf_path)
+        if error is None:
+            print(f"Parsed '{name}' in {seconds:.1f}s")
+        else:
+            self.failed += 1
+            print(f"Error parsing '{name}': {error}")
+        elapsed = max(time.monotonic() - self.start, 1e-9)
+        rate = self.done / elapsed
+        eta = (self.total - self.done) / rate
+        print(
+            f"[{self.done}/{self.total}] {rate * 60:.1f} PDFs/min, "
+            f"{_format_duration(elapsed)} elapsed, ETA {_format_duration(eta)}"
+        )
 
-    for filename in os.listdir(input_dir):
+
+def _pending_pdfs(input_dir: str, output_root: str, manifest: ParseManifest) -> List[Tuple[str, str, str, str]]:
+    """(filename, pdf_path, output_dir, content hash) for every PDF whose current content has not been parsed."""
+    pdfs = []
+    for filename in sorted(os.listdir(input_dir)):
         if not filename.lower().endswith(".pdf"):
             continue
-
         name_without_ext = os.path.splitext(filename)[0]
-        output_dir = os.path.join(output_root, name_without_ext)
-        os.makedirs(output_dir, exist_ok=True)
+        pdfs.append((filename, os.path.join(input_dir, filename), os.path.join(output_root, name_without_ext)))
 
-        # If the markdown subfolder already has something inside, skip
-        markdown_folder = os.path.join(output_dir, "markdown")
-        if os.path.isdir(markdown_folder) and os.listdir(markdown_folder):
-            print(f"Skipping '{filename}' (already parsed).")
-            continue
+    scan = manifest.scan(pdfs)
+    print(f"Scanned '{input_dir}': {ParseManifest.summary(scan)}.")
+    jobs = scan["pending"]
+    # Largest first, so a big PDF does not start last and hold up the end of the run
+    jobs.sort(key=lambda job: os.path.getsize(job[1]), reverse=True)
+    return jobs
+
+
+def _finish_job(job: Tuple[str, str, str, str], outcome: Tuple[str, float, Optional[str]],
+                progress: _Progress, manifest: ParseManifest):
+    name, pdf_path, output_dir, file_hash = job
+    if outcome[2] is None:
+        manifest.complete(name, pdf_path, file_hash, output_dir)
+    progress.update(*outcome)
+
+
+def batch_parse(
+    input_dir: str,
+    output_root: str,
+    workers: int = 1,
+    threads_per_worker: Optional[int] = None,
+    window_pages: Optional[int] = None,
+):
+    """
+    For each PDF in input_dir that is new or has changed since it was last parsed
+    (per <output_root>/parse_manifest.json):
+      1) create parsed_outputs/<basename>/
+      2) create parsed_outputs/<basename>/markdown/
+      3) call parse_and_store(pdf_path, parsed_outputs/<basename>)
+      4) inside that folder, the Markdown file is "markdown/document.md"
+    A PDF with the same content as one already parsed is skipped.
+
+    With `workers` > 1, PDFs are converted in that many processes, each loading
+    the Docling models once and limited to `threads_per_worker` threads (default:
+    the CPU cores shared evenly between workers). With one worker, PDFs are
+    converted in this process, whose thread pools are only limited when
+    `threads_per_worker` is given. With `window_pages`, each PDF
+    is converted that many pages at a time and resumes from its checkpoint.
+    """
+    os.makedirs(output_root, exist_ok=True)
+    manifest = ParseManifest(output_root, PARSER_SETTINGS)
+    # Held for the whole run: FlashRank's ingest daemon also updates the manifest
+    with manifest.locked():
+        manifest.load()
+        jobs = _pending_pdfs(input_dir, output_root, manifest)
+        if not jobs:
+            return
+        for _, _, output_dir, _ in jobs:
+            os.makedirs(output_dir, exist_ok=True)
+            manifest.start(output_dir)
+        workers = max(1, min(workers, len(jobs)))
+        explicit_threads = threads_per_worker is not None
+        if threads_per_worker is None:
+            threads_per_worker = max(1, (os.cpu_count() or 1) // workers)
 
-        pdf_path = os.path.join(input_dir, filename)
-        try:
-            parse_and_store(pdf_path, output_dir)
-            print(f"Parsed '{filename}' → '{output_dir}/markdown/document.md'")
-        except Exception as e:
-            print(f"Error parsing '{filename}': {e}")
+        progress = _Progress(len(jobs))
+        print(f"Parsing {len(jobs)} PDFs with {workers} worker(s), {threads_per_worker} thread(s) each.")
+        if workers == 1:
+            # In the caller's own process, thread settings are only changed when asked for
+            _init_worker(threads_per_worker, limit_threads=explicit_threads)
+            for job in jobs:
+                _finish_job(job, _parse_job(job[1], job[2], window_pages), progress, manifest)
+        else:
+            # Spawned rather than forked: the models' thread pools do not survive a fork
+            with ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(threads_per_worker,),
+            ) as pool:
+                futures = {pool.submit(_parse_job, job[1], job[2], window_pages): job for job in jobs}
+                for future in as_completed(futures):
+                    _finish_job(futures[future], future.result(), progress, manifest)
+        if progress.failed:
+            print(f"{progress.failed} of {len(jobs)} PDFs failed to parse.")
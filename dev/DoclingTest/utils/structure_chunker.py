@@ -0,0 +1,226 @@
+# File: utils/structure_chunker.py
+
+import re
+import json
+import math
+from typing import Any, Dict, Iterable, List, Tuple
+
+# Written next to document.md; indexed by FlashRank instead of re-splitting the Markdown
+CHUNKS_NAME = "chunks.jsonl"
+# Chunk sizes in characters. Sections shorter than CHUNK_MIN_CHARS are merged with
+# their neighbours; longer ones are cut into near-equal parts of at most CHUNK_MAX_CHARS.
+CHUNK_MAX_CHARS = 1000
+CHUNK_MIN_CHARS = 200
+CHUNKER_SETTINGS = {"chunker": "structure", "max_chars": CHUNK_MAX_CHARS, "min_chars": CHUNK_MIN_CHARS}
+
+# Docling item labels
+_HEADING_LABELS = {"title", "section_header"}
+_SKIP_LABELS = {"page_header", "page_footer", "picture"}
+_TABLE_LABELS = {"table", "document_index"}
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+
+def _label(item) -> str:
+    label = getattr(item, "label", "")
+    return getattr(label, "value", str(label))
+
+
+def _pages(item) -> List[int]:
+    return sorted({p.page_no for p in getattr(item, "prov", None) or [] if getattr(p, "page_no", None)})
+
+
+def _table_markdown(item, doc) -> str:
+    try:
+        return item.export_to_markdown(doc=doc)
+    except TypeError:
+        # Older docling-core takes no document
+        return item.export_to_markdown()
+
+
+def _split_long(text: str, max_chars: int) -> List[str]:
+    """Cut an over-long paragraph at sentence ends (or spaces) into parts of at most max_chars."""
+    if len(text) <= max_chars:
+        return [text]
+    pieces, current = [], ""
+    for sentence in _SENTENCE_END.split(text):
+        while len(sentence) > max_chars:
+            cut = sentence.rfind(" ", 0, max_chars)
+            cut = cut if cut > 0 else max_chars
+            if current:
+                pieces.append(current)
+                current = ""
+            pieces.append(sentence[:cut])
+            sentence = sentence[cut:].lstrip()
+        if current and len(current) + 1 + len(sentence) > max_chars:
+            pieces.append(current)
+            current = sentence
+        else:
+            current = f"{current} {sentence}" if current else sentence
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def _pack(units: List[Tuple[str, List[int]]], max_chars: int, separator: str = "\n\n") -> List[Tuple[str, List[int]]]:
+    """
+    Group consecutive paragraphs into chunks of balanced size: a section needing
+    n chunks is cut into n parts of about total/n characters, instead of n-1 full
+    chunks and a short remainder. A chunk ends before the paragraph whose middle
+    falls past the next multiple of total/n.
+    """
+    total = sum(len(text) for text, _ in units) + len(separator) * (len(units) - 1)
+    target = total / max(1, math.ceil(total / max_chars))
+    chunks: List[Tuple[str, List[int]]] = []
+    texts: List[str] = []
+    pages: set = set()
+    size = 0
+    # Where the next paragraph starts in the section, and the next cut point
+    pos = 0
+    boundary = target
+    for text, unit_pages in units:
+        middle = pos + len(text) / 2
+        added = len(text) + (len(separator) if texts else 0)
+        if texts and (size + added > max_chars or middle > boundary):
+            chunks.append((separator.join(texts), sorted(pages)))
+            texts, pages, size = [], set(), 0
+            added = len(text)
+            while boundary < middle:
+                boundary += target
+        texts.append(text)
+        pages.update(unit_pages)
+        size += added
+        pos += len(text) + len(separator)
+    if texts:
+        chunks.append((separator.join(texts), sorted(pages)))
+    return chunks
+
+
+def _split_table(markdown: str, max_chars: int) -> List[str]:
+    """Cut a large Markdown table into row groups, each repeating the header rows."""
+    lines = markdown.splitlines()
+    if len(markdown) <= max_chars or len(lines) <= 3:
+        return [markdown]
+    header, rows = lines[:2], lines[2:]
+    parts, current = [], list(header)
+    size = sum(len(line) + 1 for line in header)
+    for row in rows:
+        if len(current) > len(header) and size + len(row) + 1 > max_chars:
+            parts.append("\n".join(current))
+            current, size = list(header), sum(len(line) + 1 for line in header)
+        current.append(row)
+        size += len(row) + 1
+    parts.append("\n".join(current))
+    return parts
+
+
+class StructureChunker:
+    """
+    Chunks a Docling document along its own structure rather than at character
+    offsets in the exported Markdown. Paragraphs and list items are grouped by the
+    section they belong to and packed into size-balanced chunks that never cross a
+    heading; tables become chunks of their own (with their caption, split by rows
+    only if very large); and every chunk records its heading path and pages.
+    Small neighbouring sections are merged so short sections do not become
+    fragments of their own.
+
+    The heading path is carried over between calls, so the windows of a document
+    converted a few pages at a time can be chunked one after another.
+    """
+
+    def __init__(self, max_chars: int = CHUNK_MAX_CHARS, min_chars: int = CHUNK_MIN_CHARS):
+        self.max_chars = max_chars
+        self.min_chars = min_chars
+        # (level, text) of the headings enclosing the current position
+        self.headings: List[Tuple[int, str]] = []
+
+    def _path(self) -> List[str]:
+        return [text for _, text in self.headings]
+
+    def _enter_heading(self, level: int, text: str):
+        while self.headings and self.headings[-1][0] >= level:
+            self.headings.pop()
+        self.headings.append((level, text))
+
+    def chunk(self, doc) -> List[Dict[str, Any]]:
+        """Chunk records {"text", "headings", "type", "pages"} for a DoclingDocument."""
+        chunks: List[Dict[str, Any]] = []
+        units: List[Tuple[str, List[int]]] = []
+        section = self._path()
+        caption_refs = set()
+
+        def flush():
+            if units:
+                for text, pages in _pack(units, self.max_chars):
+                    chunks.append({"text": text, "headings": section, "type": "text", "pages": pages})
+                units.clear()
+
+        for item, _ in doc.iterate_items():
+            label = _label(item)
+            if label in _SKIP_LABELS or getattr(item, "self_ref", None) in caption_refs:
+                continue
+            if label in _HEADING_LABELS:
+                flush()
+                level = 0 if label == "title" else getattr(item, "level", 1)
+                self._enter_heading(level, item.text.strip())
+                section = self._path()
+            elif label in _TABLE_LABELS:
+                flush()
+                caption = ""
+                if hasattr(item, "caption_text"):
+                    caption = item.caption_text(doc).strip()
+                    caption_refs.update(ref.cref for ref in getattr(item, "captions", []) or [])
+                room = self.max_chars - (len(caption) + 2 if caption else 0)
+                for part in _split_table(_table_markdown(item, doc), room):
+                    text = f"{caption}\n\n{part}" if caption else part
+                    chunks.append({"text": text, "headings": section, "type": "table", "pages": _pages(item)})
+            else:
+                text = (getattr(item, "text", "") or "").strip()
+                if not text:
+                    continue
+                if label == "list_item":
+                    marker = getattr(item, "marker", "") or "-"
+                    text = f"{marker} {text}"
+                for piece in _split_long(text, self.max_chars):
+                    units.append((piece, _pages(item)))
+        flush()
+        return self._merge_small(chunks)
+
+    def _merge_small(self, chunks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Fold text chunks under `min_chars` into the preceding text chunk when both fit."""
+        merged: List[Dict[str, Any]] = []
+        for chunk in chunks:
+            prev = merged[-1] if merged else None
+            if (
+                prev is not None
+                and prev["type"] == chunk["type"] == "text"
+                and (len(prev["text"]) < self.min_chars or len(chunk["text"]) < self.min_chars)
+            ):
+                # Headings no longer covered by the shared path go into the text
+                common = _common_prefix(prev["headings"], chunk["headings"])
+                combined = "\n\n".join(
+                    prev["headings"][len(common):] + [prev["text"]]
+                    + chunk["headings"][len(common):] + [chunk["text"]]
+                )
+                if len(combined) <= self.max_chars:
+                    prev.update(
+                        text=combined,
+                        headings=common,
+                        pages=sorted(set(prev["pages"]) | set(chunk["pages"])),
+                    )
+                    continue
+            merged.append(chunk)
+        return merged
+
+
+def _common_prefix(a: List[str], b: List[str]) -> List[str]:
+    common = []
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        common.append(x)
+    return common
+
+
+def write_chunks(chunks: Iterable[Dict[str, Any]], f):
+    for chunk in chunks:
+        f.write((json.dumps(chunk, ensure_ascii=False) + "\n").encode("utf-8"))
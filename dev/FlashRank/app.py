@@ -1,7 +1,15 @@
 import os
-from flask import Flask, request, jsonify
+import json
+import time
+import uuid
+from flask import Flask, Response, g, request, jsonify, stream_with_context
 from dotenv import load_dotenv
 from utils.agentqalangchain import AgentQA
+from utils.agent import AgentQA as PlannerAgentQA
+from utils.session_store import SessionStore
+from utils.index_publisher import IndexWatcher, current_index_dir, read_status
+from utils.metrics import REGISTRY, REQUEST_SECONDS, collect_timings
+from utils.sampling_profiler import SamplingProfiler
 
 # Load environment variables from .env
 load_dotenv()
@@ -21,17 +29,78 @@ AGENT_LLM_MODEL = os.getenv("AGENT_LLM_MODEL", LLM_MODEL)
 K = int(os.getenv("K", "20"))
 CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", "1000"))
 CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "200"))
+# Vector index: flat (exact), ivf_flat, hnsw, ivf_pq or sq8; tunables are optional
+INDEX_TYPE = os.getenv("INDEX_TYPE", "flat")
+INDEX_PARAMS = {
+    name: int(os.environ[var])
+    for name, var in [
+        ("nlist", "NLIST"), ("nprobe", "NPROBE"), ("ef_search", "EF_SEARCH"), ("pq_m", "PQ_M"),
+        ("hnsw_m", "HNSW_M"), ("train_size", "TRAIN_SIZE"),
+    ]
+    if os.getenv(var)
+}
+# Candidate retrieval: dense, hybrid (dense + BM25) or auto
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "auto")
+# "answer" (one RAG answer per tool call) or "retrieve" (batched sub-queries, raw chunks)
+AGENT_TOOL_MODE = os.getenv("AGENT_TOOL_MODE", "answer")
+# Serve with the planner agent (utils/agent.py) in low-latency mode instead of the
+# LangGraph agent: one planning call, retrieval started alongside it, one answer call
+LOW_LATENCY = os.getenv("LOW_LATENCY", "").lower() in ("1", "true", "yes")
+# Serve indexes published by ingest_daemon.py under INDEX_ROOT, swapping in new versions live
+INDEX_ROOT = os.getenv("INDEX_ROOT") or None
+INDEX_POLL_INTERVAL = float(os.getenv("INDEX_POLL_INTERVAL", "2"))
+# Opt-in sampling profiler for hot-path analysis, read at /debug/profile
+PROFILE_SAMPLING = os.getenv("PROFILE_SAMPLING", "").lower() in ("1", "true", "yes")
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "10"))
+# Per-session conversation histories; SESSION_DB persists them to a local SQLite file
+SESSIONS = SessionStore(
+    max_sessions=int(os.getenv("SESSION_MAX", "10000")),
+    idle_timeout=float(os.getenv("SESSION_IDLE_TIMEOUT", "3600")),
+    max_memory_mb=float(os.getenv("SESSION_MAX_MB", "256")),
+    max_messages=int(os.getenv("SESSION_MAX_MESSAGES", "40")),
+    persist_path=os.getenv("SESSION_DB") or None,
+)
+
+if INDEX_ROOT and not current_index_dir(INDEX_ROOT):
+    raise RuntimeError(f"No index published under {INDEX_ROOT} yet; start ingest_daemon.py first")
 
 # Instantiate AgentQA with retrieval and reasoning capabilities
-agent = AgentQA(
+agent_kwargs = dict(
     docs_dir=DOCS_DIR,
     embedding_model=EMBED_MODEL,
     llm_model=LLM_MODEL,
     k=K,
     chunk_size=CHUNK_SIZE,
     chunk_overlap=CHUNK_OVERLAP,
-    agent_llm_model=AGENT_LLM_MODEL
+    agent_llm_model=AGENT_LLM_MODEL,
+    index_type=INDEX_TYPE,
+    index_params=INDEX_PARAMS,
+    retrieval_mode=RETRIEVAL_MODE,
+    session_store=SESSIONS,
+    index_dir=current_index_dir(INDEX_ROOT) if INDEX_ROOT else None,
+    sync_on_load=not INDEX_ROOT,
 )
+if LOW_LATENCY:
+    agent = PlannerAgentQA(low_latency=True, **agent_kwargs)
+else:
+    agent = AgentQA(tool_mode=AGENT_TOOL_MODE, **agent_kwargs)
+index_watcher = IndexWatcher(agent.rag, INDEX_ROOT, interval=INDEX_POLL_INTERVAL).start() if INDEX_ROOT else None
+profiler = SamplingProfiler(interval=PROFILE_INTERVAL_MS / 1000).start() if PROFILE_SAMPLING else None
+
+@app.before_request
+def start_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def observe_latency(response):
+    # For /ask/stream this is the time to the first byte, not to the end of the stream
+    started = g.get("request_started")
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        REQUEST_SECONDS.observe(
+            time.perf_counter() - started, route=route, method=request.method, status=response.status_code
+        )
+    return response
 
 @app.route("/ask", methods=["POST"])
 def ask():
@@ -39,27 +108,132 @@ def ask():
     Ask a question. Expects JSON with:
       - "query": str
       - optional "history": List[{"role": str, "content": str}]
+      - optional "session_id": str, to continue a conversation; a new one is
+        created (and returned) when omitted
+      - optional "timings": true, to include the time spent in each stage
+        (retrieval, reranking, LLM calls, ...) and the tokens used
     Uses AgentQA to decide whether to retrieve or answer directly.
     """
     data = request.get_json() or {}
     query = data.get("query")
     history = data.get("history", [])
+    session_id = data.get("session_id") or uuid.uuid4().hex
     # print(data)
     if not query:
         return jsonify({"error": "Missing 'query' in request body"}), 400
 
     try:
         # Pass history through to the agent
-        answer, sources = agent.ask(query, history=history)
+        with collect_timings() as timings:
+            answer, sources = agent.ask(query, history=history, session_id=session_id)
         print(answer)
         print(sources)
-        return jsonify({
+        result = {
             "answer": answer,
-            "sources": sources
-        })
+            "sources": sources,
+            "session_id": session_id,
+        }
+        if data.get("timings"):
+            result["timings"] = timings.summary()
+        return jsonify(result)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+def sse_event(event: str, data) -> str:
+    """Format one server-sent event with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.route("/ask/stream", methods=["POST"])
+def ask_stream():
+    """
+    Streaming version of /ask. Same request body; responds with server-sent events:
+      - "session":    {"session_id"}, sent first
+      - "tool_call":  retrieval query (or list of sub-queries) issued by the agent
+                      (with LOW_LATENCY: "plan" and "retrieval_query" instead)
+      - "sources":    sources found by retrieval
+      - "token":      a piece of the answer, as soon as the model produces it
+      - "answer":     final {"answer", "sources"}
+      - "timings":    per-stage breakdown as in /ask, last, if requested with "timings": true
+      - "error":      {"error": str} if the pipeline fails mid-stream
+    """
+    data = request.get_json() or {}
+    query = data.get("query")
+    history = data.get("history", [])
+    session_id = data.get("session_id") or uuid.uuid4().hex
+    if not query:
+        return jsonify({"error": "Missing 'query' in request body"}), 400
+
+    def generate():
+        yield sse_event("session", {"session_id": session_id})
+        try:
+            with collect_timings() as timings:
+                for event, payload in agent.ask_stream(query, history=history, session_id=session_id):
+                    yield sse_event(event, payload)
+            if data.get("timings"):
+                yield sse_event("timings", timings.summary())
+        except Exception as e:
+            yield sse_event("error", {"error": str(e)})
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        # Stop proxies from buffering the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.route("/sessions/<session_id>", methods=["DELETE"])
+def clear_session(session_id):
+    """Forget a session's conversation history."""
+    agent.clear_history(session_id)
+    return jsonify({"session_id": session_id, "cleared": True})
+
+@app.route("/sessions/stats", methods=["GET"])
+def session_stats():
+    """Number of sessions held in memory, their estimated size and evictions."""
+    return jsonify(SESSIONS.stats())
+
+@app.route("/cache/stats", methods=["GET"])
+def cache_stats():
+    """Hit rates of the query embedding and answer caches."""
+    return jsonify(agent.rag.cache_stats())
+
+@app.route("/index/stats", methods=["GET"])
+def index_stats():
+    """Served index version and, with INDEX_ROOT, the ingest daemon's queue depth and lag."""
+    return jsonify(index_status())
+
+def index_status() -> dict:
+    status = {"index_version": agent.rag.index_version, "index_dir": agent.rag.index_dir}
+    if index_watcher is not None:
+        status["watcher"] = index_watcher.stats()
+        status["ingest"] = read_status(INDEX_ROOT)
+    return status
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """Stage latency, LLM token and request latency histograms in the Prometheus text format."""
+    return Response(REGISTRY.render(), mimetype="text/plain; version=0.0.4")
+
+@app.route("/debug/profile", methods=["GET"])
+def debug_profile():
+    """
+    Samples collected by the profiler (PROFILE_SAMPLING=1): the hottest functions,
+    or ?format=folded for flame graph input. ?reset=1 starts a new collection.
+    """
+    body, status, mimetype = profile_report(request.args)
+    return Response(body, status=status, mimetype=mimetype)
+
+def profile_report(args) -> tuple:
+    if profiler is None:
+        return json.dumps({"error": "Profiling is disabled; set PROFILE_SAMPLING=1"}), 404, "application/json"
+    if args.get("format") == "folded":
+        body, mimetype = profiler.folded(), "text/plain"
+    else:
+        body, mimetype = json.dumps(profiler.top(int(args.get("limit", 20)))), "application/json"
+    if args.get("reset"):
+        profiler.reset()
+    return body, 200, mimetype
+
 if __name__ == "__main__":
     port = int(os.getenv("PORT", "5000"))
     app.run(host="0.0.0.0", port=port, threaded=True)
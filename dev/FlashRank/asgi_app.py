@@ -0,0 +1,127 @@
+# asgi_app.py
+#
+# Async serving mode for the QA API: the same routes as app.py on an ASGI app
+# (Quart, Flask's async twin). Handlers await the agent, so a question waiting on
+# the LLM or embedding API holds no thread; FAISS search and reranking run on the
+# RagReranker's bounded CPU pool. Configuration is the same as for app.py.
+#
+# Usage:
+#   hypercorn asgi_app:app --bind 0.0.0.0:5000
+#   uvicorn asgi_app:app --host 0.0.0.0 --port 5000
+
+import os
+import time
+import uuid
+from quart import Quart, Response, g, request, jsonify
+# Reuses app.py's configuration and agent instance
+from app import SESSIONS, agent, index_status, profile_report, sse_event
+from utils.metrics import REGISTRY, REQUEST_SECONDS, collect_timings
+
+app = Quart(__name__)
+
+@app.before_request
+async def start_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+async def observe_latency(response):
+    started = g.get("request_started")
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        REQUEST_SECONDS.observe(
+            time.perf_counter() - started, route=route, method=request.method, status=response.status_code
+        )
+    return response
+
+@app.route("/ask", methods=["POST"])
+async def ask():
+    """
+    Ask a question. Expects JSON with:
+      - "query": str
+      - optional "history": List[{"role": str, "content": str}]
+      - optional "session_id": str (a new one is created and returned when omitted)
+      - optional "timings": true, to include the per-stage time breakdown
+    """
+    data = await request.get_json() or {}
+    query = data.get("query")
+    history = data.get("history", [])
+    session_id = data.get("session_id") or uuid.uuid4().hex
+    if not query:
+        return jsonify({"error": "Missing 'query' in request body"}), 400
+
+    try:
+        with collect_timings() as timings:
+            answer, sources = await agent.aask(query, history=history, session_id=session_id)
+        result = {
+            "answer": answer,
+            "sources": sources,
+            "session_id": session_id,
+        }
+        if data.get("timings"):
+            result["timings"] = timings.summary()
+        return jsonify(result)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/ask/stream", methods=["POST"])
+async def ask_stream():
+    """Streaming version of /ask; emits the same server-sent events as app.py."""
+    data = await request.get_json() or {}
+    query = data.get("query")
+    history = data.get("history", [])
+    session_id = data.get("session_id") or uuid.uuid4().hex
+    if not query:
+        return jsonify({"error": "Missing 'query' in request body"}), 400
+
+    async def generate():
+        yield sse_event("session", {"session_id": session_id})
+        try:
+            with collect_timings() as timings:
+                async for event, payload in agent.aask_stream(query, history=history, session_id=session_id):
+                    yield sse_event(event, payload)
+            if data.get("timings"):
+                yield sse_event("timings", timings.summary())
+        except Exception as e:
+            yield sse_event("error", {"error": str(e)})
+
+    response = Response(generate(), mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"
+    response.timeout = None
+    return response
+
+@app.route("/sessions/<session_id>", methods=["DELETE"])
+async def clear_session(session_id):
+    """Forget a session's conversation history."""
+    agent.clear_history(session_id)
+    return jsonify({"session_id": session_id, "cleared": True})
+
+@app.route("/sessions/stats", methods=["GET"])
+async def session_stats():
+    """Number of sessions held in memory, their estimated size and evictions."""
+    return jsonify(SESSIONS.stats())
+
+@app.route("/cache/stats", methods=["GET"])
+async def cache_stats():
+    """Hit rates of the query embedding and answer caches."""
+    return jsonify(agent.rag.cache_stats())
+
+@app.route("/index/stats", methods=["GET"])
+async def index_stats():
+    """Served index version and, with INDEX_ROOT, the ingest daemon's queue depth and lag."""
+    return jsonify(index_status())
+
+@app.route("/metrics", methods=["GET"])
+async def metrics():
+    """Stage latency, LLM token and request latency histograms in the Prometheus text format."""
+    return Response(REGISTRY.render(), mimetype="text/plain; version=0.0.4")
+
+@app.route("/debug/profile", methods=["GET"])
+async def debug_profile():
+    """Samples collected by the profiler (PROFILE_SAMPLING=1); see app.py."""
+    body, status, mimetype = profile_report(request.args)
+    return Response(body, status=status, mimetype=mimetype)
+
+if __name__ == "__main__":
+    port = int(os.getenv("PORT", "5000"))
+    app.run(host="0.0.0.0", port=port)
@@ -0,0 +1,404 @@
+# benchmark.py
+#
+# Offline end-to-end benchmark of the RAG stack. Generates a synthetic Markdown
+# corpus, serves embeddings and chat completions from mock_embedding_server.py
+# (deterministic, no API calls), and measures:
+#   build     index build throughput (chunks/s) and peak RSS
+#   load      time to open the saved index
+#   retrieve  RagReranker.get_reranked latency at several concurrency levels
+#   ask       /ask latency through the Flask app at the same concurrency levels
+# Results are written as JSON; with --baseline the run is compared against an
+# earlier result file and exits with status 1 if any metric regressed by more
+# than --tolerance.
+#
+# FlashRank's reranking model must be in its local cache (it is downloaded on
+# first use); --reranker passthrough skips reranking on machines without it.
+#
+# Usage:
+#   python benchmark.py --docs 200 --output bench.json
+#   python benchmark.py --docs 200 --output bench_new.json --baseline bench.json
+
+import os
+import sys
+import json
+import time
+import random
+import functools
+import socket
+import shutil
+import argparse
+import platform
+import resource
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+STAGES = ("build", "load", "retrieve", "ask")
+RESULTS_VERSION = 1
+
+# Metric name suffixes and which direction is an improvement
+HIGHER_IS_BETTER = ("_per_s", "_qps")
+LOWER_IS_BETTER = ("_ms", "_seconds", "_mb")
+
+_TOPICS = [
+    "polymer", "catalyst", "electrolyte", "zeolite", "perovskite", "ligand", "solvent",
+    "membrane", "nanoparticle", "enzyme", "surfactant", "oxide", "hydrogel", "copolymer",
+]
+_VERBS = [
+    "increases", "reduces", "stabilises", "accelerates", "modulates", "suppresses",
+    "enhances", "controls", "shifts", "limits",
+]
+_OBJECTS = [
+    "the glass transition temperature", "the reaction yield", "ionic conductivity",
+    "thermal stability", "the selectivity towards the trans isomer", "crystallinity",
+    "the activation energy", "the swelling ratio", "the band gap", "the turnover frequency",
+    "surface area", "the degree of polymerisation", "viscosity", "the Faradaic efficiency",
+]
+_CONDITIONS = [
+    "at elevated temperature", "under inert atmosphere", "in aqueous solution",
+    "after annealing at 450 C", "at low pH", "in the presence of a base",
+    "under UV irradiation", "at high pressure", "after ball milling", "in DMF",
+]
+
+
+def _sentence(rng: random.Random) -> str:
+    return (
+        f"The {rng.choice(_TOPICS)} {rng.choice(_VERBS)} {rng.choice(_OBJECTS)} "
+        f"{rng.choice(_CONDITIONS)}, measured as {rng.uniform(0.1, 99.9):.1f} in sample "
+        f"{rng.randint(1, 999)}."
+    )
+
+
+def generate_corpus(root: str, docs: int, sections: int = 4, paragraphs: int = 3,
+                    sentences: int = 6, seed: int = 0) -> Dict[str, int]:
+    """
+    Write `docs` Markdown files laid out like parser output
+    (<root>/doc_NNNNN/markdown/document.md), each with `sections` headed sections
+    of `paragraphs` paragraphs. The same arguments always give the same corpus.
+    """
+    rng = random.Random(seed)
+    total_chars = 0
+    for i in range(docs):
+        topic = rng.choice(_TOPICS)
+        parts = [f"# Study {i}: {topic} systems"]
+        for s in range(sections):
+            parts.append(f"## {s + 1}. {rng.choice(_TOPICS).capitalize()} and {rng.choice(_OBJECTS)}")
+            for _ in range(paragraphs):
+                parts.append(" ".join(_sentence(rng) for _ in range(sentences)))
+        text = "\n\n".join(parts) + "\n"
+        folder = os.path.join(root, f"doc_{i:05d}", "markdown")
+        os.makedirs(folder, exist_ok=True)
+        with open(os.path.join(folder, "document.md"), "w", encoding="utf-8") as f:
+            f.write(text)
+        total_chars += len(text)
+    return {"docs": docs, "chars": total_chars}
+
+
+def make_queries(n: int, seed: int = 1) -> List[str]:
+    """`n` distinct questions, so no run is served from the query or answer caches."""
+    rng = random.Random(seed)
+    return [
+        f"How does the {rng.choice(_TOPICS)} affect {rng.choice(_OBJECTS)} "
+        f"{rng.choice(_CONDITIONS)}? (case {i})"
+        for i in range(n)
+    ]
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_mock_backend(embed_latency_ms: float, chat_latency_ms: float, dim: int) -> subprocess.Popen:
+    """Run mock_embedding_server.py in its own process and point the OpenAI clients at it."""
+    import requests
+
+    port = _free_port()
+    proc = subprocess.Popen(
+        [
+            sys.executable, os.path.join(HERE, "mock_embedding_server.py"),
+            "--port", str(port), "--dim", str(dim),
+            "--latency-ms", str(embed_latency_ms), "--chat-latency-ms", str(chat_latency_ms),
+        ],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    url = f"http://127.0.0.1:{port}"
+    for _ in range(100):
+        try:
+            requests.get(url + "/stats", timeout=1)
+            break
+        except requests.RequestException:
+            time.sleep(0.1)
+    else:
+        proc.terminate()
+        raise RuntimeError("Mock backend did not start")
+    os.environ["OPENAI_BASE_URL"] = url + "/v1"
+    os.environ["OPENAI_API_KEY"] = os.environ.get("OPENAI_API_KEY") or "benchmark"
+    return proc
+
+
+def use_passthrough_reranker():
+    """Replace FlashRank with a compressor that keeps the first candidates unscored."""
+    from langchain_core.documents.compressor import BaseDocumentCompressor
+    from utils import rag_reranker
+
+    class PassthroughRerank(BaseDocumentCompressor):
+        top_n: int = 3
+
+        def compress_documents(self, documents, query, callbacks=None):
+            return list(documents)[:self.top_n]
+
+    rag_reranker.FlashrankRerank = PassthroughRerank
+    rag_reranker.BatchedFlashrankRerank = lambda batcher: PassthroughRerank()
+    rag_reranker.shared_batcher = lambda max_wait_ms: None
+
+
+def use_offline_embeddings():
+    """
+    Send chunks to the embeddings endpoint as plain text. By default OpenAIEmbeddings
+    tokenizes them with tiktoken first, which downloads the cl100k_base encoding.
+    """
+    from utils import rag_reranker
+
+    rag_reranker.OpenAIEmbeddings = functools.partial(
+        rag_reranker.OpenAIEmbeddings, tiktoken_enabled=False, check_embedding_ctx_length=False
+    )
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in KiB on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def _percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def measure_latency(fn: Callable[[str], Any], queries: List[str], concurrency: int) -> Dict[str, float]:
+    """Run `fn` over `queries` from `concurrency` threads; latency percentiles in ms and throughput."""
+    def timed(query: str) -> float:
+        start = time.perf_counter()
+        fn(query)
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        latencies = list(pool.map(timed, queries))
+    wall = time.perf_counter() - start
+    return {
+        "p50_ms": _percentile(latencies, 0.50) * 1000,
+        "p95_ms": _percentile(latencies, 0.95) * 1000,
+        "p99_ms": _percentile(latencies, 0.99) * 1000,
+        "mean_ms": sum(latencies) / len(latencies) * 1000,
+        "qps": len(latencies) / wall,
+    }
+
+
+def _latency_sweep(name: str, fn: Callable[[str], Any], levels: List[int], requests_per_level: int,
+                   warmup: int, metrics: Dict[str, float], seed: int):
+    fn_queries = make_queries(warmup + requests_per_level * len(levels), seed=seed)
+    for query in fn_queries[:warmup]:
+        fn(query)
+    for i, level in enumerate(levels):
+        batch = fn_queries[warmup + i * requests_per_level: warmup + (i + 1) * requests_per_level]
+        result = measure_latency(fn, batch, level)
+        for key, value in result.items():
+            metrics[f"{name}_c{level}_{key}"] = round(value, 3)
+        print(
+            f"{name} @ concurrency {level}: p50 {result['p50_ms']:.1f}ms, p95 {result['p95_ms']:.1f}ms, "
+            f"p99 {result['p99_ms']:.1f}ms, {result['qps']:.1f} req/s"
+        )
+
+
+def run(args) -> Dict[str, Any]:
+    stages = [s for s in args.stages.split(",") if s]
+    for stage in stages:
+        if stage not in STAGES:
+            raise ValueError(f"Unknown stage {stage!r}; expected some of {STAGES}")
+    levels = [int(c) for c in args.concurrency.split(",")]
+    workdir = os.path.abspath(args.workdir)
+    corpus_dir = os.path.join(workdir, "corpus")
+    if os.path.isdir(workdir):
+        shutil.rmtree(workdir)
+    os.makedirs(workdir)
+
+    corpus = generate_corpus(corpus_dir, args.docs, sections=args.sections,
+                             paragraphs=args.paragraphs, seed=args.seed)
+    print(f"Generated {corpus['docs']} documents ({corpus['chars'] / 1e6:.1f}M characters) in {corpus_dir}")
+
+    backend = start_mock_backend(args.embed_latency_ms, args.chat_latency_ms, args.dim)
+    # The app and RagReranker use paths relative to the working directory (./.idx)
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    sys.path.insert(0, HERE)
+    metrics: Dict[str, float] = {}
+    try:
+        if args.reranker == "passthrough":
+            use_passthrough_reranker()
+        use_offline_embeddings()
+        from utils.rag_reranker import RagReranker
+
+        rag_kwargs = dict(
+            docs_dir=corpus_dir,
+            embedding_model=args.embedding_model,
+            llm_model=args.llm_model,
+            chunk_size=args.chunk_size,
+            chunk_overlap=args.chunk_overlap,
+            index_type=args.index_type,
+        )
+
+        # build: every chunk is embedded through the mock backend (no embedding cache)
+        start = time.perf_counter()
+        rag = RagReranker(embedding_cache_path=None, **rag_kwargs)
+        build_seconds = time.perf_counter() - start
+        chunks = len(rag.vectorstore.index_to_docstore_id)
+        metrics["index_chunks"] = chunks
+        if "build" in stages:
+            metrics["build_seconds"] = round(build_seconds, 3)
+            metrics["build_chunks_per_s"] = round(chunks / build_seconds, 3)
+            metrics["build_peak_rss_mb"] = round(peak_rss_mb(), 1)
+            print(f"build: {chunks} chunks in {build_seconds:.2f}s ({chunks / build_seconds:.1f} chunks/s)")
+
+        if "load" in stages:
+            del rag
+            start = time.perf_counter()
+            rag = RagReranker(embedding_cache_path=None, **rag_kwargs)
+            metrics["load_seconds"] = round(time.perf_counter() - start, 3)
+            print(f"load: {metrics['load_seconds']:.3f}s")
+
+        if "retrieve" in stages:
+            _latency_sweep("retrieve", rag.get_reranked, levels, args.requests, args.warmup, metrics, seed=1)
+        del rag
+
+        if "ask" in stages:
+            os.environ.update(
+                DOCS_DIR=corpus_dir,
+                EMBEDDING_MODEL=args.embedding_model,
+                LLM_MODEL=args.llm_model,
+                CHUNK_SIZE=str(args.chunk_size),
+                CHUNK_OVERLAP=str(args.chunk_overlap),
+                INDEX_TYPE=args.index_type,
+            )
+            import app as qa_app
+
+            local = threading.local()
+
+            def ask(query: str):
+                client = getattr(local, "client", None)
+                if client is None:
+                    client = local.client = qa_app.app.test_client()
+                # The question also goes in the history, as the chat frontend sends it
+                resp = client.post("/ask", json={
+                    "query": query,
+                    "history": [{"role": "user", "content": query}],
+                    "session_id": f"bench-{hash(query)}",
+                })
+                if resp.status_code != 200:
+                    raise RuntimeError(f"/ask returned {resp.status_code}: {resp.get_data(as_text=True)[:200]}")
+
+            _latency_sweep("ask", ask, levels, args.requests, args.warmup, metrics, seed=2)
+
+        metrics["peak_rss_mb"] = round(peak_rss_mb(), 1)
+    finally:
+        os.chdir(cwd)
+        backend.terminate()
+        backend.wait()
+
+    return {
+        "version": RESULTS_VERSION,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {
+            "docs": args.docs, "sections": args.sections, "paragraphs": args.paragraphs,
+            "chunk_size": args.chunk_size, "chunk_overlap": args.chunk_overlap,
+            "index_type": args.index_type, "reranker": args.reranker, "dim": args.dim,
+            "embed_latency_ms": args.embed_latency_ms, "chat_latency_ms": args.chat_latency_ms,
+            "concurrency": levels, "requests": args.requests, "stages": stages, "seed": args.seed,
+        },
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "metrics": metrics,
+    }
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[Dict[str, Any]]:
+    """
+    Per-metric change against a baseline result. A metric regresses when it is
+    worse by more than `tolerance` (a fraction) in its direction of improvement.
+    """
+    rows = []
+    for name, value in current["metrics"].items():
+        base = baseline.get("metrics", {}).get(name)
+        if base is None or not base:
+            continue
+        if name.endswith(HIGHER_IS_BETTER):
+            change = value / base - 1
+            regressed = change < -tolerance
+        elif name.endswith(LOWER_IS_BETTER):
+            change = value / base - 1
+            regressed = change > tolerance
+        else:
+            continue
+        rows.append({"metric": name, "baseline": base, "current": value,
+                     "change": round(change, 4), "regressed": regressed})
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline throughput and latency benchmark for the RAG stack")
+    parser.add_argument("--docs", type=int, default=100, help="Synthetic documents to generate")
+    parser.add_argument("--sections", type=int, default=4, help="Sections per document")
+    parser.add_argument("--paragraphs", type=int, default=3, help="Paragraphs per section")
+    parser.add_argument("--seed", type=int, default=0, help="Corpus seed")
+    parser.add_argument("--stages", default=",".join(STAGES), help=f"Comma-separated subset of {STAGES}")
+    parser.add_argument("--concurrency", default="1,4,16", help="Comma-separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=50, help="Requests measured per concurrency level")
+    parser.add_argument("--warmup", type=int, default=5, help="Unmeasured requests before each sweep")
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--chunk-overlap", type=int, default=200)
+    parser.add_argument("--index-type", default="flat")
+    parser.add_argument("--embedding-model", default="text-embedding-ada-002")
+    parser.add_argument("--llm-model", default="gpt-4o")
+    parser.add_argument("--dim", type=int, default=1536, help="Mock embedding dimension")
+    parser.add_argument("--embed-latency-ms", type=float, default=0.0, help="Mock embedding request latency")
+    parser.add_argument("--chat-latency-ms", type=float, default=0.0, help="Mock chat completion latency")
+    parser.add_argument("--reranker", choices=("flashrank", "passthrough"), default="flashrank")
+    parser.add_argument("--workdir", default="./.bench", help="Scratch directory (deleted and recreated)")
+    parser.add_argument("--output", default="bench_results.json", help="Where to write the results")
+    parser.add_argument("--baseline", default=None, help="Earlier results file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="Allowed relative slowdown before a metric counts as regressed (default: 0.2)")
+    args = parser.parse_args()
+
+    results = run(args)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline.get("config") != results["config"]:
+            print("Warning: baseline was run with a different configuration.")
+        rows = compare(results, baseline, args.tolerance)
+        for row in rows:
+            flag = "REGRESSED" if row["regressed"] else ""
+            print(f"{row['metric']:<28} {row['baseline']:>12.3f} -> {row['current']:>12.3f} "
+                  f"({row['change']:+.1%}) {flag}")
+        regressions = [row["metric"] for row in rows if row["regressed"]]
+        if regressions:
+            print(f"{len(regressions)} metric(s) regressed beyond {args.tolerance:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
+        print("No regressions against the baseline.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,497 @@
+# ingest_daemon.py
+#
+# Long-running ingestion service. Watches a directory of PDFs, queues new, changed
+# and deleted files, parses them with the DoclingTest or LlamaParseTest batch parser
+# (bounded by --workers), chunks and embeds what changed, and publishes each updated
+# index as a new version under --index_root. An app.py / asgi_app.py started with
+# INDEX_ROOT set to the same directory swaps each version in while it keeps serving.
+#
+# Queue depth and end-to-end lag (time from a file change being noticed to the index
+# containing it being published) are written to <index_root>/ingest_status.json and
+# served by the API at /index/stats.
+#
+# Usage:
+#   python ingest_daemon.py --input_dir ../DoclingTest/input_pdfs \
+#       --parsed_dir ../DoclingTest/parsed_outputs --index_root ./.index_versions --workers 4
+#   INDEX_ROOT=./.index_versions python app.py
+
+import os
+import sys
+import json
+import time
+import shlex
+import shutil
+import argparse
+import threading
+import subprocess
+from collections import deque
+from typing import Any, Dict, List, Optional, Tuple
+from dotenv import load_dotenv
+from utils.rag_reranker import RagReranker
+from utils.ann_index import INDEX_TYPES
+from utils.index_manifest import MANIFEST_NAME as INDEX_MANIFEST_NAME
+from utils.index_publisher import current_index_dir, current_version, discard, publish, stage_version, write_status
+# dev/, for the parse manifest written by both parsers
+sys.path.append(os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")))
+from chemrag_shared.parse_manifest import ParseManifest
+
+# Load environment variables from .env if present
+load_dotenv()
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+# Parser script and the option that bounds how many PDFs it parses at once
+PARSERS = {
+    "docling": (os.path.join(HERE, "..", "DoclingTest", "main.py"), "--workers"),
+    "llamaparse": (os.path.join(HERE, "..", "LlamaParseTest", "main.py"), "--max_in_flight"),
+}
+# Signature of a PDF in the published index that the parse manifest has lost; never matches a file
+LOST_SIGNATURE = (-1, -1)
+# End-to-end lags kept for the reported percentiles
+LAG_WINDOW = 200
+
+
+def _signature(path: str) -> Optional[Tuple[int, int]]:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_size, st.st_mtime_ns
+
+
+def _env_int(name: str) -> Optional[int]:
+    value = os.getenv(name)
+    return int(value) if value else None
+
+
+def _percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 3)
+
+
+class IngestDaemon:
+    """
+    Keeps the index under `index_root` in step with the PDFs in `input_dir`.
+
+    A scanner thread polls the input directory and queues files whose size or
+    mtime differ from what was last indexed, once they have stayed unchanged for
+    `settle_seconds` (so files still being copied in are not parsed half-written).
+    The main loop takes everything queued, runs the parser over the input
+    directory (its manifest skips PDFs already parsed), builds the next index
+    version from a copy of the current one (only changed files are re-embedded)
+    and publishes it. Files the parser fails on stay queued and are retried up to
+    `max_attempts` times.
+    """
+
+    def __init__(
+        self,
+        input_dir: str,
+        parsed_dir: str,
+        index_root: str,
+        parser: str = "docling",
+        workers: int = 1,
+        parser_args: Optional[List[str]] = None,
+        poll_interval: float = 5.0,
+        settle_seconds: float = 10.0,
+        max_attempts: int = 3,
+        rag_kwargs: Optional[Dict[str, Any]] = None,
+    ):
+        if parser not in PARSERS:
+            raise ValueError(f"parser must be one of {tuple(PARSERS)}, got {parser!r}")
+        self.input_dir = input_dir
+        self.parsed_dir = parsed_dir
+        self.index_root = index_root
+        self.parser = parser
+        self.workers = workers
+        self.parser_args = parser_args or []
+        self.poll_interval = poll_interval
+        self.settle_seconds = settle_seconds
+        self.max_attempts = max_attempts
+        self.rag_kwargs = rag_kwargs or {}
+
+        self._lock = threading.Lock()
+        # The scanner thread and the main loop both write the status file
+        self._status_lock = threading.Lock()
+        self._stop = threading.Event()
+        # Wakes the main loop when the scanner queues something
+        self._wakeup = threading.Event()
+        # filename -> (size, mtime_ns) as of the last published index (None once removed)
+        self.indexed: Dict[str, Tuple[int, int]] = self._initial_signatures()
+        # filename -> {"first_seen", "signature", "stable_since", "attempts"}
+        self.queue: Dict[str, Dict[str, Any]] = {}
+        # Names taken off the queue by the cycle that is running
+        self.in_progress: Dict[str, Dict[str, Any]] = {}
+        self.state = "starting"
+        self.lags = deque(maxlen=LAG_WINDOW)
+        self.counts = {"cycles": 0, "indexed_files": 0, "removed_files": 0, "failed_files": 0}
+        self.last_cycle: Optional[Dict[str, Any]] = None
+
+    def _parse_manifest(self) -> ParseManifest:
+        # The parser is given an absolute --output_root, so its manifest holds absolute paths
+        manifest = ParseManifest(os.path.abspath(self.parsed_dir))
+        manifest.load()
+        return manifest
+
+    def _parsed_signatures(self) -> Dict[str, Tuple[int, int]]:
+        """(size, mtime) of every PDF the parser has recorded, from its manifest."""
+        return {name: (entry["size"], entry["mtime"]) for name, entry in self._parse_manifest().files.items()}
+
+    def _indexed_output_dirs(self) -> List[str]:
+        """Names of the parser output folders with documents in the published index."""
+        index_dir = current_index_dir(self.index_root)
+        if index_dir is None:
+            return []
+        try:
+            with open(os.path.join(index_dir, INDEX_MANIFEST_NAME), "r", encoding="utf-8") as f:
+                paths = json.load(f).get("files", {})
+        except (OSError, ValueError):
+            return []
+        root = os.path.abspath(self.parsed_dir)
+        folders = set()
+        for path in paths:
+            relative = os.path.relpath(os.path.abspath(path), root)
+            if os.sep in relative and not relative.startswith(os.pardir):
+                folders.add(relative.split(os.sep, 1)[0])
+        return sorted(folders)
+
+    def _initial_signatures(self) -> Dict[str, Tuple[int, int]]:
+        """
+        What the published index holds: the PDFs in the parse manifest, plus any whose
+        output is in the index but that the manifest has lost (e.g. it was deleted).
+        Those get a signature no file has, so a PDF still present is parsed again and
+        one that is gone is removed.
+        """
+        manifest = self._parse_manifest()
+        indexed = {name: (entry["size"], entry["mtime"]) for name, entry in manifest.files.items()}
+        recorded = {
+            os.path.basename(os.path.normpath(entry["output_dir"]))
+            for entry in manifest.files.values() if entry.get("output_dir")
+        }
+        lost = [folder for folder in self._indexed_output_dirs() if folder not in recorded]
+        if lost:
+            try:
+                pdfs = [name for name in os.listdir(self.input_dir) if name.lower().endswith(".pdf")]
+            except OSError:
+                pdfs = []
+            for folder in lost:
+                names = [name for name in pdfs if os.path.splitext(name)[0] == folder] or [folder + ".pdf"]
+                for name in names:
+                    indexed.setdefault(name, LOST_SIGNATURE)
+            print(f"{len(lost)} indexed document(s) missing from the parse manifest; queued to re-parse or remove.")
+        return indexed
+
+    # Scanning
+
+    def scan(self):
+        """Queue PDFs that are new, changed or gone since they were last indexed."""
+        now = time.time()
+        present = {}
+        for filename in sorted(os.listdir(self.input_dir)):
+            if filename.lower().endswith(".pdf"):
+                sig = _signature(os.path.join(self.input_dir, filename))
+                if sig is not None:
+                    present[filename] = sig
+        with self._lock:
+            for name in set(present) | set(self.indexed) | set(self.queue):
+                sig = present.get(name)
+                if name in self.in_progress and self.in_progress[name]["signature"] == sig:
+                    continue
+                if sig == self.indexed.get(name):
+                    # Changed back, or already indexed
+                    self.queue.pop(name, None)
+                    continue
+                item = self.queue.get(name)
+                if item is None:
+                    self.queue[name] = {"first_seen": now, "signature": sig, "stable_since": now, "attempts": 0}
+                elif item["signature"] != sig:
+                    item["signature"], item["stable_since"] = sig, now
+            if self._ready(now):
+                self._wakeup.set()
+
+    def _ready(self, now: float) -> bool:
+        return any(now - item["stable_since"] >= self.settle_seconds for item in self.queue.values())
+
+    def _scan_loop(self):
+        while not self._stop.is_set():
+            try:
+                self.scan()
+                self.write_status()
+            except OSError as e:
+                print(f"Warning: failed to scan '{self.input_dir}': {e}")
+            self._stop.wait(self.poll_interval)
+
+    # Processing
+
+    def _take_batch(self) -> Dict[str, Dict[str, Any]]:
+        now = time.time()
+        with self._lock:
+            batch = {
+                name: item for name, item in self.queue.items()
+                if now - item["stable_since"] >= self.settle_seconds
+            }
+            for name in batch:
+                del self.queue[name]
+            self.in_progress = batch
+        return batch
+
+    def _remove_outputs(self, names: List[str]):
+        """
+        Forget PDFs that were removed: drop them from the parse manifest (a cycle with
+        only removals never runs the parser to do it) and delete their parsed output,
+        unless another PDF shares it.
+        """
+        manifest = ParseManifest(os.path.abspath(self.parsed_dir))
+        # A parser started by hand may be writing the manifest too
+        with manifest.locked():
+            loaded = manifest.load()
+            orphaned = manifest.remove(names)
+            if loaded:
+                manifest.save()
+            for output_dir in orphaned:
+                if os.path.isdir(output_dir):
+                    shutil.rmtree(output_dir)
+                    print(f"Removed parsed output '{os.path.basename(output_dir)}' of deleted PDF(s).")
+
+    def _run_parser(self):
+        script, parallel_flag = PARSERS[self.parser]
+        cmd = [
+            sys.executable, os.path.abspath(script),
+            "--input_dir", os.path.abspath(self.input_dir),
+            "--output_root", os.path.abspath(self.parsed_dir),
+            parallel_flag, str(self.workers),
+        ] + self.parser_args
+        result = subprocess.run(cmd, cwd=os.path.dirname(os.path.abspath(script)))
+        if result.returncode != 0:
+            print(f"Parser exited with status {result.returncode}.")
+
+    def _build_index(self) -> str:
+        """Index the parsed documents into a new version and publish it."""
+        staging = stage_version(self.index_root)
+        try:
+            # Starts from the copied version, so only what changed is embedded
+            RagReranker(docs_dir=self.parsed_dir, index_dir=staging, **self.rag_kwargs)
+        except BaseException:
+            discard(staging)
+            raise
+        return publish(self.index_root, staging)
+
+    def run_cycle(self, force_publish: bool = False) -> Optional[Dict[str, Any]]:
+        """Parse, index and publish everything queued and settled. Returns the cycle's stats."""
+        batch = self._take_batch()
+        if not batch and not force_publish:
+            return None
+        started = time.time()
+        removed = [name for name, item in batch.items() if item["signature"] is None]
+        changed = [name for name in batch if name not in removed]
+        try:
+            if removed:
+                self._remove_outputs(removed)
+            if changed:
+                self.state = "parsing"
+                self.write_status()
+                print(f"Parsing {len(changed)} new or changed PDF(s) with {self.parser}...")
+                self._run_parser()
+
+            parsed = self._parsed_signatures()
+            done = removed + [name for name in changed if parsed.get(name) == batch[name]["signature"]]
+            failed = [name for name in changed if name not in done]
+            version = None
+            if done or force_publish:
+                self.state = "indexing"
+                self.write_status()
+                version = os.path.basename(self._build_index())
+        except Exception as e:
+            print(f"Ingest cycle failed: {e}")
+            with self._lock:
+                # Back on the queue unless the file changed again in the meantime
+                for name, item in batch.items():
+                    item["attempts"] += 1
+                    self.queue.setdefault(name, item)
+                self.in_progress = {}
+            self.state = "idle"
+            return None
+
+        finished = time.time()
+        with self._lock:
+            for name in done:
+                self.lags.append(finished - batch[name]["first_seen"])
+                if batch[name]["signature"] is None:
+                    self.indexed.pop(name, None)
+                else:
+                    self.indexed[name] = batch[name]["signature"]
+            for name in failed:
+                item = batch[name]
+                item["attempts"] += 1
+                if item["attempts"] >= self.max_attempts:
+                    # Give up until the file changes again
+                    print(f"Giving up on '{name}' after {item['attempts']} failed parse(s).")
+                    self.indexed[name] = item["signature"]
+                    self.counts["failed_files"] += 1
+                else:
+                    self.queue.setdefault(name, item)
+            self.in_progress = {}
+            self.counts["cycles"] += 1
+            self.counts["indexed_files"] += len(done) - len(removed)
+            self.counts["removed_files"] += len(removed)
+            self.last_cycle = {
+                "version": version,
+                "files": len(done),
+                "failed": len(failed),
+                "seconds": round(finished - started, 3),
+                "finished_at": finished,
+            }
+        self.state = "idle"
+        if version:
+            print(
+                f"Published index version {version}: {len(done)} file(s) in "
+                f"{finished - started:.1f}s, {len(failed)} failed, {self.queue_depth()} still queued."
+            )
+        return self.last_cycle
+
+    # Reporting
+
+    def queue_depth(self) -> int:
+        with self._lock:
+            return len(self.queue) + len(self.in_progress)
+
+    def status(self) -> Dict[str, Any]:
+        now = time.time()
+        with self._lock:
+            waiting = [item["first_seen"] for item in list(self.queue.values()) + list(self.in_progress.values())]
+            lags = list(self.lags)
+            return {
+                "state": self.state,
+                "version": current_version(self.index_root),
+                "queue_depth": len(self.queue) + len(self.in_progress),
+                "queued": len(self.queue),
+                "in_progress": len(self.in_progress),
+                # How long the oldest unpublished change has been waiting so far
+                "oldest_pending_seconds": round(now - min(waiting), 3) if waiting else 0.0,
+                "lag_seconds": {
+                    "last": round(lags[-1], 3) if lags else None,
+                    "p50": _percentile(lags, 0.5),
+                    "p95": _percentile(lags, 0.95),
+                    "max": round(max(lags), 3) if lags else None,
+                },
+                "last_cycle": self.last_cycle,
+                **self.counts,
+                "updated_at": now,
+            }
+
+    def write_status(self):
+        with self._status_lock:
+            write_status(self.index_root, self.status())
+
+    # Main loop
+
+    def run(self):
+        os.makedirs(self.parsed_dir, exist_ok=True)
+        os.makedirs(self.index_root, exist_ok=True)
+        scanner = threading.Thread(target=self._scan_loop, name="ingest-scanner", daemon=True)
+        scanner.start()
+        print(f"Watching '{self.input_dir}' every {self.poll_interval:g}s; publishing to '{self.index_root}'.")
+        try:
+            if current_version(self.index_root) is None and self.indexed:
+                # Nothing published yet: index what is already parsed so the API can start
+                self.run_cycle(force_publish=True)
+            self.state = "idle"
+            while not self._stop.is_set():
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                self.run_cycle()
+                self.write_status()
+        except KeyboardInterrupt:
+            print("Stopping.")
+        finally:
+            self._stop.set()
+            scanner.join()
+            self.state = "stopped"
+            self.write_status()
+
+    def stop(self):
+        self._stop.set()
+        self._wakeup.set()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Watch a PDF directory and keep a published RAG index up to date"
+    )
+    parser.add_argument("--input_dir", required=True, help="Directory of PDFs to watch")
+    parser.add_argument("--parsed_dir", required=True, help="Parser output root, indexed as the docs directory")
+    parser.add_argument(
+        "--index_root",
+        default=os.getenv("INDEX_ROOT", "./.index_versions"),
+        help="Where index versions are published; point the API's INDEX_ROOT here"
+    )
+    parser.add_argument("--parser", choices=tuple(PARSERS), default="docling", help="PDF parser to run")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="PDFs parsed at once (Docling worker processes or LlamaParse jobs in flight)"
+    )
+    parser.add_argument(
+        "--parser_args",
+        default="",
+        help="Extra arguments for the parser's main.py, e.g. \"--window_pages 50\""
+    )
+    parser.add_argument("--poll_interval", type=float, default=5.0, help="Seconds between directory scans")
+    parser.add_argument(
+        "--settle_seconds",
+        type=float,
+        default=10.0,
+        help="A file must be unchanged this long before it is parsed"
+    )
+    parser.add_argument("--max_attempts", type=int, default=3, help="Parse attempts per file version")
+    # Index settings; these must match the API's for it to load the published versions
+    parser.add_argument("--k", type=int, default=int(os.getenv("K", "20")))
+    parser.add_argument("--chunk-size", type=int, default=int(os.getenv("CHUNK_SIZE", "1000")))
+    parser.add_argument("--chunk-overlap", type=int, default=int(os.getenv("CHUNK_OVERLAP", "200")))
+    parser.add_argument(
+        "--embedding-model",
+        type=str,
+        default=os.getenv("EMBEDDING_MODEL", "text-embedding-ada-002")
+    )
+    parser.add_argument("--embed-batch-size", type=int, default=256)
+    parser.add_argument("--embed-concurrency", type=int, default=4)
+    parser.add_argument("--index-type", choices=INDEX_TYPES, default=os.getenv("INDEX_TYPE", "flat"))
+    # Parameters that shape a built ANN index (defaults in utils/ann_index.py)
+    parser.add_argument("--nlist", type=int, default=_env_int("NLIST"))
+    parser.add_argument("--pq-m", type=int, default=_env_int("PQ_M"))
+    parser.add_argument("--hnsw-m", type=int, default=_env_int("HNSW_M"))
+    parser.add_argument("--train-size", type=int, default=_env_int("TRAIN_SIZE"))
+    args = parser.parse_args()
+
+    daemon = IngestDaemon(
+        input_dir=args.input_dir,
+        parsed_dir=args.parsed_dir,
+        index_root=args.index_root,
+        parser=args.parser,
+        workers=args.workers,
+        parser_args=shlex.split(args.parser_args),
+        poll_interval=args.poll_interval,
+        settle_seconds=args.settle_seconds,
+        max_attempts=args.max_attempts,
+        rag_kwargs={
+            "k": args.k,
+            "chunk_size": args.chunk_size,
+            "chunk_overlap": args.chunk_overlap,
+            "embedding_model": args.embedding_model,
+            "embed_batch_size": args.embed_batch_size,
+            "embed_concurrency": args.embed_concurrency,
+            "index_type": args.index_type,
+            "index_params": {
+                "nlist": args.nlist,
+                "pq_m": args.pq_m,
+                "hnsw_m": args.hnsw_m,
+                "train_size": args.train_size,
+            },
+        },
+    )
+    daemon.run()
+
+
+if __name__ == "__main__":
+    main()
@@ -4,6 +4,9 @@ import os
 import argparse
 from dotenv import load_dotenv
 from utils.rag_reranker import RagReranker
+from utils.agent import AgentQA
+from utils.ann_index import INDEX_TYPES
+from utils.hybrid_retriever import RETRIEVAL_MODES
 
 # Load environment variables from .env if present
 load_dotenv()
@@ -21,7 +24,7 @@ def main():
     parser.add_argument(
         "--query",
         type=str,
-        required=True,
+        default=None,
         help="The question you want to answer"
     )
     parser.add_argument(
@@ -54,24 +57,127 @@ def main():
         default="gpt-3.5-turbo",
         help="OpenAI chat model name"
     )
+    parser.add_argument(
+        "--embed-batch-size",
+        type=int,
+        default=256,
+        help="Number of chunks sent per embedding request when building the index"
+    )
+    parser.add_argument(
+        "--embed-concurrency",
+        type=int,
+        default=4,
+        help="Maximum number of embedding requests in flight when building the index"
+    )
+    parser.add_argument(
+        "--index-type",
+        type=str,
+        default="flat",
+        choices=INDEX_TYPES,
+        help="Vector index: exact 'flat', or approximate 'ivf_flat', 'hnsw', 'ivf_pq' or 'sq8'"
+    )
+    parser.add_argument(
+        "--nlist",
+        type=int,
+        default=None,
+        help="Number of IVF cells (default: 4 * sqrt(training vectors))"
+    )
+    parser.add_argument(
+        "--nprobe",
+        type=int,
+        default=None,
+        help="IVF cells visited per query"
+    )
+    parser.add_argument(
+        "--ef-search",
+        type=int,
+        default=None,
+        help="HNSW candidate list size per query"
+    )
+    parser.add_argument(
+        "--pq-m",
+        type=int,
+        default=None,
+        help="Number of PQ sub-quantizers for ivf_pq (must divide the embedding dimension)"
+    )
+    parser.add_argument(
+        "--hnsw-m",
+        type=int,
+        default=None,
+        help="HNSW graph degree (links per node)"
+    )
+    parser.add_argument(
+        "--train-size",
+        type=int,
+        default=None,
+        help="Vectors buffered to train ivf_flat, ivf_pq or sq8 before they are added"
+    )
+    parser.add_argument(
+        "--retrieval-mode",
+        type=str,
+        default="auto",
+        choices=RETRIEVAL_MODES,
+        help="Candidate retrieval: 'dense' (FAISS), 'hybrid' (FAISS + BM25 fused), or 'auto' (hybrid, BM25 only for identifier lookups)"
+    )
+    parser.add_argument(
+        "--low-latency",
+        action="store_true",
+        help="Answer through the low-latency agent: one planning call with retrieval started alongside it"
+    )
+    parser.add_argument(
+        "--recall-report",
+        type=str,
+        nargs="?",
+        const="",
+        default=None,
+        help="Report recall vs flat search; optionally a comma-separated sweep of nprobe/efSearch values"
+    )
     args = parser.parse_args()
+    if args.query is None and args.recall_report is None:
+        parser.error("--query is required unless --recall-report is given")
 
     # Ensure API key is available
     if not os.getenv("OPENAI_API_KEY"):
         parser.error("Please set the OPENAI_API_KEY environment variable or define it in a .env file")
 
     # Initialize RAG reranker (auto-loads or builds index)
-    rag = RagReranker(
+    rag_kwargs = dict(
         docs_dir=args.docs,
         embedding_model=args.embedding_model,
         llm_model=args.llm_model,
         k=args.k,
         chunk_size=args.chunk_size,
         chunk_overlap=args.chunk_overlap,
+        embed_batch_size=args.embed_batch_size,
+        embed_concurrency=args.embed_concurrency,
+        index_type=args.index_type,
+        index_params={
+            "nlist": args.nlist,
+            "nprobe": args.nprobe,
+            "ef_search": args.ef_search,
+            "pq_m": args.pq_m,
+            "hnsw_m": args.hnsw_m,
+            "train_size": args.train_size,
+        },
+        retrieval_mode=args.retrieval_mode,
     )
+    if args.low_latency:
+        agent = AgentQA(agent_llm_model=args.llm_model, low_latency=True, **rag_kwargs)
+        rag = agent.rag
+    else:
+        rag = RagReranker(**rag_kwargs)
+
+    if args.recall_report is not None:
+        sweep = [int(v) for v in args.recall_report.split(",") if v.strip()]
+        rag.recall_report(sweep=sweep or None)
+        if args.query is None:
+            return
 
     print("Retrieving, reranking, and answering…")
-    answer, sources = rag.answer_with_sources(args.query)
+    if args.low_latency:
+        answer, sources = agent.ask(args.query)
+    else:
+        answer, sources = rag.answer_with_sources(args.query)
 
     print("=== ANSWER ===")
     print(answer)
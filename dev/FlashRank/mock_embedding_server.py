@@ -0,0 +1,185 @@
+# mock_embedding_server.py
+#
+# Local stand-in for the OpenAI embeddings endpoint, for exercising the index
+# build pipeline offline. Vectors are deterministic (derived from a hash of each
+# input), and the server can inject latency and 429 rate-limit responses.
+# It also answers chat completions deterministically (calling the first offered
+# tool once, then replying), so the QA API can be run end to end (see benchmark.py).
+#
+# Usage:
+#   python mock_embedding_server.py --latency-ms 200 --rate-limit-prob 0.2
+#   OPENAI_API_KEY=test OPENAI_BASE_URL=http://localhost:8001/v1 python main.py --query "..."
+
+import json
+import time
+import base64
+import random
+import hashlib
+import argparse
+import threading
+from array import array
+from flask import Flask, Response, request, jsonify
+
+app = Flask(__name__)
+
+CONFIG = {
+    "dim": 1536,
+    "latency_ms": 0.0,
+    "rate_limit_prob": 0.0,
+    "max_concurrency": 0,
+    "chat_latency_ms": 0.0,
+}
+STATS = {"requests": 0, "rate_limited": 0, "inputs": 0, "chat_requests": 0}
+_lock = threading.Lock()
+_in_flight = 0
+
+
+def _vector(item) -> list:
+    """Deterministic unit-length vector for one input (a string or a token list)."""
+    seed = hashlib.sha256(json.dumps(item).encode("utf-8")).digest()
+    rng = random.Random(seed)
+    vec = [rng.uniform(-1.0, 1.0) for _ in range(CONFIG["dim"])]
+    norm = sum(v * v for v in vec) ** 0.5 or 1.0
+    return [v / norm for v in vec]
+
+
+def _encode(vec: list, encoding_format: str):
+    # The openai client asks for base64-packed float32 unless told otherwise
+    if encoding_format == "base64":
+        return base64.b64encode(array("f", vec).tobytes()).decode("ascii")
+    return vec
+
+
+def _rate_limited():
+    return jsonify({"error": {
+        "message": "Rate limit reached (mock server)",
+        "type": "requests",
+        "code": "rate_limit_exceeded",
+    }}), 429, {"Retry-After": "1"}
+
+
+@app.route("/v1/embeddings", methods=["POST"])
+def embeddings():
+    global _in_flight
+    data = request.get_json() or {}
+    inputs = data.get("input", [])
+    if not isinstance(inputs, list) or (inputs and isinstance(inputs[0], int)):
+        inputs = [inputs]
+
+    with _lock:
+        STATS["requests"] += 1
+        over_capacity = CONFIG["max_concurrency"] and _in_flight >= CONFIG["max_concurrency"]
+        if over_capacity or random.random() < CONFIG["rate_limit_prob"]:
+            STATS["rate_limited"] += 1
+            return _rate_limited()
+        _in_flight += 1
+    try:
+        if CONFIG["latency_ms"]:
+            time.sleep(CONFIG["latency_ms"] / 1000.0)
+        with _lock:
+            STATS["inputs"] += len(inputs)
+        return jsonify({
+            "object": "list",
+            "model": data.get("model", "mock"),
+            "data": [
+                {"object": "embedding", "index": i,
+                 "embedding": _encode(_vector(item), data.get("encoding_format", "float"))}
+                for i, item in enumerate(inputs)
+            ],
+            "usage": {"prompt_tokens": 0, "total_tokens": 0},
+        })
+    finally:
+        with _lock:
+            _in_flight -= 1
+
+
+def _text(content) -> str:
+    if isinstance(content, list):
+        return " ".join(part.get("text", "") for part in content if isinstance(part, dict))
+    return content or ""
+
+
+def _chat_message(data) -> dict:
+    """
+    The assistant turn: a call to the first offered tool with the user's question
+    if no tool has answered yet, otherwise a fixed answer derived from the question.
+    """
+    messages = data.get("messages", [])
+    question = next((_text(m.get("content")) for m in reversed(messages) if m.get("role") == "user"), "")
+    tools = data.get("tools") or []
+    if tools and not any(m.get("role") == "tool" for m in messages):
+        function = tools[0].get("function", {})
+        properties = function.get("parameters", {}).get("properties", {})
+        arguments = {"queries": [question]} if "queries" in properties else {"query": question}
+        call_id = "call_" + hashlib.sha256(question.encode("utf-8")).hexdigest()[:12]
+        return {"role": "assistant", "content": None, "tool_calls": [{
+            "id": call_id,
+            "type": "function",
+            "function": {"name": function.get("name", "tool"), "arguments": json.dumps(arguments)},
+        }]}
+    digest = hashlib.sha256(json.dumps(messages, sort_keys=True).encode("utf-8")).hexdigest()[:8]
+    return {"role": "assistant", "content": f"Mock answer ({digest}) to: {question[:200]}"}
+
+
+def _usage(data, message) -> dict:
+    prompt = sum(len(_text(m.get("content")).split()) for m in data.get("messages", []))
+    completion = len((message.get("content") or "").split())
+    return {"prompt_tokens": prompt, "completion_tokens": completion, "total_tokens": prompt + completion}
+
+
+@app.route("/v1/chat/completions", methods=["POST"])
+def chat_completions():
+    data = request.get_json() or {}
+    with _lock:
+        STATS["chat_requests"] += 1
+    if CONFIG["chat_latency_ms"]:
+        time.sleep(CONFIG["chat_latency_ms"] / 1000.0)
+    message = _chat_message(data)
+    finish_reason = "tool_calls" if message.get("tool_calls") else "stop"
+    base = {"id": "chatcmpl-mock", "created": int(time.time()), "model": data.get("model", "mock")}
+    if not data.get("stream"):
+        return jsonify({
+            **base,
+            "object": "chat.completion",
+            "choices": [{"index": 0, "message": message, "finish_reason": finish_reason}],
+            "usage": _usage(data, message),
+        })
+
+    def events():
+        delta = dict(message)
+        for i, call in enumerate(delta.get("tool_calls") or []):
+            call["index"] = i
+        chunks = [
+            {"index": 0, "delta": delta, "finish_reason": None},
+            {"index": 0, "delta": {}, "finish_reason": finish_reason},
+        ]
+        for choice in chunks:
+            yield f"data: {json.dumps({**base, 'object': 'chat.completion.chunk', 'choices': [choice]})}\n\n"
+        yield "data: [DONE]\n\n"
+    return Response(events(), mimetype="text/event-stream")
+
+
+@app.route("/stats", methods=["GET"])
+def stats():
+    return jsonify(STATS)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mock OpenAI embeddings/chat server with latency and 429 injection")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--dim", type=int, default=1536, help="Embedding dimension")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Delay added to every request")
+    parser.add_argument("--rate-limit-prob", type=float, default=0.0, help="Probability of answering 429")
+    parser.add_argument("--max-concurrency", type=int, default=0,
+                        help="Answer 429 when more requests than this are in flight (0 = unlimited)")
+    parser.add_argument("--chat-latency-ms", type=float, default=0.0, help="Delay added to every chat completion")
+    args = parser.parse_args()
+
+    CONFIG.update(
+        dim=args.dim,
+        latency_ms=args.latency_ms,
+        rate_limit_prob=args.rate_limit_prob,
+        max_concurrency=args.max_concurrency,
+        chat_latency_ms=args.chat_latency_ms,
+    )
+    app.run(host="127.0.0.1", port=args.port, threaded=True)
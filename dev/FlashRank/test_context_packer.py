@@ -0,0 +1,23 @@
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from utils.context_packer import pack_context
+from utils.token_budget import TokenCounter
+
+
+def _paragraph(i: int) -> str:
+    return f"Paragraph {i}: " + " ".join(f"the polymer sample {i}.{j} was annealed" for j in range(6)) + "."
+
+
+def test_consecutive_chunks_merge_into_one_part():
+    text = "\n\n".join(_paragraph(i) for i in range(12))
+    splitter = RecursiveCharacterTextSplitter(chunk_size=300, chunk_overlap=0, add_start_index=True)
+    chunks = splitter.create_documents([text], metadatas=[{"source": "doc.md"}])
+    run = chunks[2:6]
+    # Reranked out of order, as the reranker returns them
+    docs = [run[2], run[0], run[3], run[1]]
+
+    context, used = pack_context(docs, TokenCounter(), max_tokens=10_000)
+
+    start = run[0].metadata["start_index"]
+    end = run[-1].metadata["start_index"] + len(run[-1].page_content)
+    assert context == text[start:end]
+    assert len(used) == len(docs)
@@ -0,0 +1,15 @@
+from utils.embedding_cache import CachedEmbeddings
+
+
+def _stored_bytes(cache):
+    return cache._conn.execute("SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings").fetchone()[0]
+
+
+def test_size_counts_replaced_vectors_once(tmp_path):
+    cache = CachedEmbeddings(None, str(tmp_path / "cache.sqlite"), model_name="test")
+
+    for _ in range(3):
+        cache.put_many({"a": [1.0] * 8, "b": [2.0] * 8})
+    cache.put_many({"b": [0.0] * 16})
+
+    assert cache.stats()["size_bytes"] == _stored_bytes(cache) == (8 + 16) * 4
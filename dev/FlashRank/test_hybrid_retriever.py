@@ -0,0 +1,61 @@
+from langchain.schema import Document
+from utils.hybrid_retriever import HybridRetriever
+from utils.sparse_index import SparseIndex
+
+CHUNKS = {
+    "water": "Water has CAS number 7732-18-5 and dissolves NaCl readily.",
+    "pmma": "PMMA yellows and loses strength after long UV irradiation.",
+    "photo": "Ultraviolet exposure breaks polymer chains and causes photo-oxidation.",
+}
+
+
+class _Embeddings:
+    def __init__(self):
+        self.calls = 0
+
+    def embed_query(self, text):
+        self.calls += 1
+        return [0.0]
+
+
+class _Docstore:
+    def search(self, chunk_id):
+        return Document(page_content=CHUNKS[chunk_id], metadata={"chunk_id": chunk_id})
+
+
+class _VectorStore:
+    """Dense search that always ranks the chunk without the query's identifiers first."""
+
+    def __init__(self):
+        self.embedding_function = _Embeddings()
+        self.docstore = _Docstore()
+
+    def similarity_search_by_vector(self, vector, k):
+        return [self.docstore.search(chunk_id) for chunk_id in ("photo", "pmma")][:k]
+
+
+def _retriever(tmp_path):
+    sparse = SparseIndex(str(tmp_path / "sparse.db"))
+    sparse.add(Document(page_content=text, metadata={"chunk_id": i}) for i, text in CHUNKS.items())
+    return HybridRetriever(vectorstore=_VectorStore(), sparse=sparse, k=3, mode="auto")
+
+
+def test_identifier_lookup_uses_bm25_alone(tmp_path):
+    retriever = _retriever(tmp_path)
+
+    docs = retriever.retrieve("7732-18-5")
+
+    assert [d.metadata["chunk_id"] for d in docs] == ["water"]
+    assert retriever.vectorstore.embedding_function.calls == 0
+
+
+def test_question_mentioning_identifiers_is_fused_with_dense(tmp_path):
+    retriever = _retriever(tmp_path)
+    query = "How does UV irradiation affect PMMA?"
+
+    assert not retriever.is_lexical(query)
+    docs = retriever.retrieve(query)
+
+    assert retriever.vectorstore.embedding_function.calls == 1
+    # The semantic match shares no words with the query and only comes from the dense side
+    assert "photo" in [d.metadata["chunk_id"] for d in docs]
@@ -0,0 +1,102 @@
+import os
+import json
+from ingest_daemon import LOST_SIGNATURE, IngestDaemon
+from chemrag_shared.parse_manifest import ParseManifest
+
+
+def _daemon(tmp_path, monkeypatch):
+    daemon = IngestDaemon(
+        input_dir=str(tmp_path / "pdfs"),
+        parsed_dir=str(tmp_path / "parsed"),
+        index_root=str(tmp_path / "index"),
+        settle_seconds=0,
+    )
+    daemon.parser_runs = 0
+    daemon.published = 0
+
+    def run_parser():
+        daemon.parser_runs += 1
+
+    def build_index():
+        daemon.published += 1
+        return str(tmp_path / "index" / "versions" / str(daemon.published))
+
+    monkeypatch.setattr(daemon, "_run_parser", run_parser)
+    monkeypatch.setattr(daemon, "_build_index", build_index)
+    return daemon
+
+
+def _parse(tmp_path, name, content, duplicate_of=None):
+    """Record `name` as parsed (or as a copy of `duplicate_of`) the way the parsers do."""
+    pdf_path = tmp_path / "pdfs" / name
+    pdf_path.write_bytes(content)
+    manifest = ParseManifest(str(tmp_path / "parsed"), {"parser": "test"})
+    manifest.load()
+    file_hash = manifest.current_hash(name, str(pdf_path))
+    if duplicate_of:
+        output_dir = manifest.files[duplicate_of]["output_dir"]
+        manifest._record(name, str(pdf_path), file_hash, output_dir, duplicate_of=duplicate_of)
+        manifest.save()
+    else:
+        output_dir = str(tmp_path / "parsed" / os.path.splitext(name)[0])
+        os.makedirs(os.path.join(output_dir, "markdown"))
+        (tmp_path / "parsed" / os.path.splitext(name)[0] / "markdown" / "document.md").write_text("# Doc\n")
+        manifest.complete(name, str(pdf_path), file_hash, output_dir)
+    return output_dir
+
+
+def _manifest(tmp_path):
+    with open(tmp_path / "parsed" / "parse_manifest.json", "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def test_cycle_with_only_removals_updates_manifest_without_parsing(tmp_path, monkeypatch):
+    (tmp_path / "pdfs").mkdir()
+    output_dir = _parse(tmp_path, "a.pdf", b"%PDF a")
+    _parse(tmp_path, "b.pdf", b"%PDF b")
+    daemon = _daemon(tmp_path, monkeypatch)
+    os.remove(tmp_path / "pdfs" / "a.pdf")
+
+    daemon.scan()
+    cycle = daemon.run_cycle()
+
+    assert cycle["files"] == 1 and daemon.parser_runs == 0 and daemon.published == 1
+    assert not os.path.exists(output_dir)
+    manifest = _manifest(tmp_path)
+    assert list(manifest["files"]) == ["b.pdf"]
+    assert [done["name"] for done in manifest["completed"].values()] == ["b.pdf"]
+    assert "a.pdf" not in daemon.indexed
+
+
+def test_deleted_original_keeps_output_shared_with_renamed_copy(tmp_path, monkeypatch):
+    (tmp_path / "pdfs").mkdir()
+    output_dir = _parse(tmp_path, "a.pdf", b"%PDF a")
+    _parse(tmp_path, "copy.pdf", b"%PDF a", duplicate_of="a.pdf")
+    daemon = _daemon(tmp_path, monkeypatch)
+    os.remove(tmp_path / "pdfs" / "a.pdf")
+
+    daemon.scan()
+    daemon.run_cycle()
+
+    assert os.path.isfile(os.path.join(output_dir, "markdown", "document.md"))
+    manifest = _manifest(tmp_path)
+    assert list(manifest["files"]) == ["copy.pdf"]
+    # Still complete, so the copy is not parsed again on the next run
+    assert [done["output_dir"] for done in manifest["completed"].values()] == [output_dir]
+
+
+def test_indexed_pdfs_missing_from_parse_manifest_are_requeued(tmp_path, monkeypatch):
+    (tmp_path / "pdfs").mkdir()
+    (tmp_path / "pdfs" / "kept.pdf").write_bytes(b"%PDF kept")
+    version_dir = tmp_path / "index" / "versions" / "v1"
+    version_dir.mkdir(parents=True)
+    (tmp_path / "index" / "CURRENT").write_text("v1")
+    (version_dir / "manifest.json").write_text(json.dumps({"files": {
+        str(tmp_path / "parsed" / name / "markdown" / "document.md"): {} for name in ("kept", "gone")
+    }}))
+    daemon = _daemon(tmp_path, monkeypatch)
+
+    assert daemon.indexed == {"kept.pdf": LOST_SIGNATURE, "gone.pdf": LOST_SIGNATURE}
+    daemon.scan()
+    assert daemon.queue["kept.pdf"]["signature"] is not None
+    assert daemon.queue["gone.pdf"]["signature"] is None
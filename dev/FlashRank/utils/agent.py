@@ -1,17 +1,52 @@
 import json
-from typing import List, Tuple, Optional
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Dict, Iterator, List, Tuple, Optional
 
 from langchain.chat_models import ChatOpenAI
 from langchain.schema import SystemMessage, HumanMessage, AIMessage
 if __name__=="__main__":
     from rag_reranker import RagReranker  # adjust import as needed
+    from session_store import DEFAULT_SESSION, SessionStore
+    from context_packer import pack_context
+    from hybrid_retriever import chunk_id_of
+    from query_cache import normalize_query
+    from sparse_index import content_tokens, identifier_tokens
+    from metrics import LLMMetricsCallback, bind_context, span, stage_config
 else:
     from .rag_reranker import RagReranker  # adjust import as needed
+    from .session_store import DEFAULT_SESSION, SessionStore
+    from .context_packer import pack_context
+    from .hybrid_retriever import chunk_id_of
+    from .query_cache import normalize_query
+    from .sparse_index import content_tokens, identifier_tokens
+    from .metrics import LLMMetricsCallback, bind_context, span, stage_config
+# A planned rewrite whose content words overlap the question's at least this much
+# (Jaccard) reuses the speculative retrieval instead of retrieving again
+REWRITE_REUSE_SIMILARITY = 0.5
+
+
+def rewrite_is_material(question: str, rewritten: str) -> bool:
+    """True when `rewritten` asks for something the question's retrieval would miss."""
+    if normalize_query(rewritten) == normalize_query(question):
+        return False
+    if set(identifier_tokens(rewritten)) - set(identifier_tokens(question)):
+        # Names a compound or material the question left implicit ("its", "that polymer")
+        return True
+    a, b = set(content_tokens(question)), set(content_tokens(rewritten))
+    if not a or not b:
+        return True
+    return len(a & b) / len(a | b) < REWRITE_REUSE_SIMILARITY
 
 class AgentQA:
     """
     An agentic QA system that uses a core LLM to think and decide when to query the RAG retriever.
     Accepts the same input and returns the same output (answer, sources) as RagReranker.
+
+    With `low_latency=True`, planning and query rewriting are one LLM call, retrieval for
+    the raw question starts while that call runs, and the answer is written in a single
+    generation from the retrieved context (no separate RAG answer and synthesis calls).
     """
 
     def __init__(
@@ -22,9 +57,15 @@ class AgentQA:
         k: int = 20,
         chunk_size: int = 1000,
         chunk_overlap: int = 200,
-        agent_llm_model: str = "gpt-3.5-turbo"
+        agent_llm_model: str = "gpt-3.5-turbo",
+        index_type: str = "flat",
+        index_params: Optional[Dict[str, int]] = None,
+        retrieval_mode: str = "auto",
+        session_store: Optional[SessionStore] = None,
+        low_latency: bool = False,
+        **rag_kwargs: Any,
     ):
-        # Initialize RAG reranker for retrieval
+        # Initialize RAG reranker for retrieval (rag_kwargs: further RagReranker options)
         self.rag = RagReranker(
             docs_dir=docs_dir,
             embedding_model=embedding_model,
@@ -32,26 +73,24 @@ class AgentQA:
             k=k,
             chunk_size=chunk_size,
             chunk_overlap=chunk_overlap,
+            index_type=index_type,
+            index_params=index_params,
+            retrieval_mode=retrieval_mode,
+            session_store=session_store,
+            **rag_kwargs,
         )
         # LLM for planning and synthesis
-        self.agent_llm = ChatOpenAI(model_name=agent_llm_model, temperature=0.0)
-
-    def ask(
-        self,
-        question: str,
-        history: Optional[List[Tuple[str, str]]] = None
-    ) -> Tuple[str, List[str]]:
-        """
-        Agentic QA: think, decide whether to retrieve documents, and answer.
-        - question: the user’s current query.
-        - history: optional list of prior (role, content) pairs.
-        Returns (answer_text, source_paths).
-        """
-        history = history or []
+        self.agent_llm = ChatOpenAI(
+            model_name=agent_llm_model,
+            temperature=0.0,
+            callbacks=[LLMMetricsCallback("agent_answer", self.rag.token_counter)],
+        )
+        self.low_latency = low_latency
+        # Runs speculative retrieval alongside the planning call
+        self._pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="agent-retrieval")
 
-        # 1) Planning step: decide direct vs retrieve
-        print("STEP 1")
-        plan_prompt = [
+    def _plan_prompt(self, question: str, history: List[Tuple[str, str]]) -> List[SystemMessage | HumanMessage]:
+        return [
             SystemMessage(content=(
                 "You are an intelligent agent. Given a user question and conversation history, "
                 "first decide whether you need to retrieve documents. "
@@ -62,28 +101,39 @@ class AgentQA:
                 "history": history
             }))
         ]
-        plan_resp: AIMessage = self.agent_llm(plan_prompt)
+
+    @staticmethod
+    def _parse_plan(content: str) -> str:
         try:
-            plan = json.loads(plan_resp.content)
-            action = plan.get("action", "retrieve")
+            plan = json.loads(content)
+            return plan.get("action", "retrieve")
         except json.JSONDecodeError:
-            action = "retrieve"
+            return "retrieve"
 
-        # 2) Direct answer path
-        print("STEP 2")
-        if action == "direct":
-            direct_resp: AIMessage = self.agent_llm([
-                SystemMessage(content="You are a helpful assistant."),
-                HumanMessage(content=json.dumps({
-                    "question": question,
-                    "history": history
-                }))
-            ])
-            return direct_resp.content, []
+    def _plan(self, question: str, history: List[Tuple[str, str]]) -> str:
+        """Ask the agent LLM whether to retrieve; returns "retrieve" or "direct"."""
+        plan_resp: AIMessage = self.agent_llm.invoke(
+            self._plan_prompt(question, history), config=stage_config("agent_planning")
+        )
+        return self._parse_plan(plan_resp.content)
 
-        # 3) Retrieval path: first form a retrieval query via the LLM.
-        print("STEP 3")
-        query_prompt = [
+    async def _aplan(self, question: str, history: List[Tuple[str, str]]) -> str:
+        plan_resp: AIMessage = await self.agent_llm.ainvoke(
+            self._plan_prompt(question, history), config=stage_config("agent_planning")
+        )
+        return self._parse_plan(plan_resp.content)
+
+    def _direct_prompt(self, question: str, history: List[Tuple[str, str]]) -> List[SystemMessage | HumanMessage]:
+        return [
+            SystemMessage(content="You are a helpful assistant."),
+            HumanMessage(content=json.dumps({
+                "question": question,
+                "history": history
+            }))
+        ]
+
+    def _query_prompt(self, question: str, history: List[Tuple[str, str]]) -> List[SystemMessage | HumanMessage]:
+        return [
             SystemMessage(content=(
                 "You are an agent that crafts precise retrieval queries. "
                 "Given the user's question and conversation history, "
@@ -94,18 +144,22 @@ class AgentQA:
                 "history": history
             }))
         ]
-        query_resp: AIMessage = self.agent_llm(query_prompt)
-        retrieval_query = query_resp.content.strip()
 
-        # 4) Execute RAG with the crafted query
-        print("STEP 4")
-        rag_answer, sources = self.rag.answer_with_sources(
-            retrieval_query,
+    def _retrieval_query(self, question: str, history: List[Tuple[str, str]]) -> str:
+        query_resp: AIMessage = self.agent_llm.invoke(
+            self._query_prompt(question, history), config=stage_config("query_rewrite")
         )
+        return query_resp.content.strip()
 
-        # 5) Synthesis step: refine the final answer
-        print("STEP 5")
-        synth_prompt = [
+    def _synth_prompt(
+        self,
+        question: str,
+        history: List[Tuple[str, str]],
+        retrieval_query: str,
+        rag_answer: str,
+        sources: List[str],
+    ) -> List[SystemMessage | HumanMessage]:
+        return [
             SystemMessage(content=(
                 "You are an expert assistant. Given the user question, the conversation history, "
                 "and the retrieved context, produce a concise, accurate final answer. "
@@ -119,15 +173,305 @@ class AgentQA:
                 "sources": sources
             }))
         ]
-        synth_resp: AIMessage = self.agent_llm(synth_prompt)
+
+    def _fast_plan_prompt(self, question: str, history: List[Tuple[str, str]]) -> List[SystemMessage | HumanMessage]:
+        return [
+            SystemMessage(content=(
+                "You are an intelligent agent. Given a user question and conversation history, "
+                "decide whether you need to retrieve documents and, if so, craft a single, concise "
+                "retrieval query to fetch the most relevant ones. "
+                "Respond *only* with a JSON object: {\"action\": \"retrieve\"|\"direct\", \"query\": \"...\"}"
+            )),
+            HumanMessage(content=json.dumps({
+                "question": question,
+                "history": history
+            }))
+        ]
+
+    @staticmethod
+    def _parse_fast_plan(content: str, question: str) -> Tuple[str, str]:
+        try:
+            plan = json.loads(content)
+            return plan.get("action", "retrieve"), (plan.get("query") or question).strip()
+        except (json.JSONDecodeError, AttributeError):
+            return "retrieve", question
+
+    def _answer_prompt(
+        self,
+        question: str,
+        history: List[Tuple[str, str]],
+        retrieval_query: str,
+        context: str,
+        sources: List[str],
+    ) -> List[SystemMessage | HumanMessage]:
+        return [
+            SystemMessage(content=(
+                "You are an expert assistant. Given the user question, the conversation history, "
+                "and context retrieved from local documents, produce a concise, accurate final answer. "
+                "Use ONLY the retrieved context; if it does not contain the answer, say so. "
+                "Cite sources by path when appropriate."
+            )),
+            HumanMessage(content=json.dumps({
+                "question": question,
+                "history": history,
+                "retrieved_query": retrieval_query,
+                "context": context,
+                "sources": sources
+            }))
+        ]
+
+    def _fast_answer_inputs(
+        self,
+        question: str,
+        history: List[Tuple[str, str]],
+        retrieval_query: str,
+        speculative: List[Any],
+        rewritten: Optional[List[Any]],
+    ) -> Tuple[List[SystemMessage | HumanMessage], List[str]]:
+        # Candidates for the rewritten query first, then the speculative ones
+        docs, seen = [], set()
+        for doc in (rewritten or []) + speculative:
+            if chunk_id_of(doc) not in seen:
+                seen.add(chunk_id_of(doc))
+                docs.append(doc)
+        with span("context_packing"):
+            context, used = pack_context(docs, self.rag.token_counter, self.rag.context_token_budget)
+        sources = [doc.metadata.get("source", "") for doc in used]
+        return self._answer_prompt(question, history, retrieval_query, context, sources), sources
+
+    def _fast_prepare(
+        self, question: str, history: List[Tuple[str, str]]
+    ) -> Tuple[str, Optional[str], List[SystemMessage | HumanMessage], List[str]]:
+        """
+        Low-latency planning: returns (action, retrieval_query, final prompt, sources).
+        Retrieval for the raw question runs while the plan is being written; a second
+        retrieval is made only if the plan rewrites the question materially (see
+        `rewrite_is_material`). A "direct" plan stops
+        the speculative retrieval at its next stage (embedding, search or reranking).
+        """
+        cancelled = threading.Event()
+        speculative = self._pool.submit(bind_context(self.rag.get_reranked), question, cancelled)
+        try:
+            plan_resp: AIMessage = self.agent_llm.invoke(
+                self._fast_plan_prompt(question, history), config=stage_config("agent_planning")
+            )
+        except BaseException:
+            cancelled.set()
+            raise
+        action, retrieval_query = self._parse_fast_plan(plan_resp.content, question)
+        if action == "direct":
+            cancelled.set()
+            return action, None, self._direct_prompt(question, history), []
+        rewritten = None
+        if rewrite_is_material(question, retrieval_query):
+            rewritten = self.rag.get_reranked(retrieval_query)
+        prompt, sources = self._fast_answer_inputs(
+            question, history, retrieval_query, speculative.result(), rewritten
+        )
+        return action, retrieval_query, prompt, sources
+
+    async def _afast_prepare(
+        self, question: str, history: List[Tuple[str, str]]
+    ) -> Tuple[str, Optional[str], List[SystemMessage | HumanMessage], List[str]]:
+        """Async `_fast_prepare`."""
+        # Cancelling the task alone would leave its CPU-pool stage running
+        cancelled = threading.Event()
+        speculative = asyncio.ensure_future(self.rag.aget_reranked(question, cancelled))
+        try:
+            plan_resp: AIMessage = await self.agent_llm.ainvoke(
+                self._fast_plan_prompt(question, history), config=stage_config("agent_planning")
+            )
+        except BaseException:
+            cancelled.set()
+            speculative.cancel()
+            raise
+        action, retrieval_query = self._parse_fast_plan(plan_resp.content, question)
+        if action == "direct":
+            cancelled.set()
+            speculative.cancel()
+            return action, None, self._direct_prompt(question, history), []
+        rewritten = None
+        if rewrite_is_material(question, retrieval_query):
+            rewritten = await self.rag.aget_reranked(retrieval_query)
+        prompt, sources = self._fast_answer_inputs(
+            question, history, retrieval_query, await speculative, rewritten
+        )
+        return action, retrieval_query, prompt, sources
+
+    def _record_turn(self, session_id: str, question: str, answer: str):
+        self.rag.sessions.append(session_id, HumanMessage(content=question), AIMessage(content=answer))
+
+    def ask(
+        self,
+        question: str,
+        history: Optional[List[Tuple[str, str]]] = None,
+        session_id: str = DEFAULT_SESSION,
+    ) -> Tuple[str, List[str]]:
+        """
+        Agentic QA: think, decide whether to retrieve documents, and answer.
+        - question: the user’s current query.
+        - history: optional list of prior (role, content) pairs.
+        - session_id: conversation whose RAG history is used and extended.
+        Returns (answer_text, source_paths).
+        """
+        history = history or []
+
+        if self.low_latency:
+            action, _, prompt, sources = self._fast_prepare(question, history)
+            answer = self.agent_llm.invoke(prompt).content
+            self._record_turn(session_id, question, answer)
+            return answer, sources
+
+        # 1) Planning step: decide direct vs retrieve
+        print("STEP 1")
+        action = self._plan(question, history)
+
+        # 2) Direct answer path
+        print("STEP 2")
+        if action == "direct":
+            direct_resp: AIMessage = self.agent_llm.invoke(self._direct_prompt(question, history))
+            self._record_turn(session_id, question, direct_resp.content)
+            return direct_resp.content, []
+
+        # 3) Retrieval path: first form a retrieval query via the LLM.
+        print("STEP 3")
+        retrieval_query = self._retrieval_query(question, history)
+
+        # 4) Execute RAG with the crafted query
+        print("STEP 4")
+        rag_answer, sources = self.rag.answer_with_sources(
+            retrieval_query,
+            session_id=session_id,
+        )
+
+        # 5) Synthesis step: refine the final answer
+        print("STEP 5")
+        synth_resp: AIMessage = self.agent_llm.invoke(
+            self._synth_prompt(question, history, retrieval_query, rag_answer, sources)
+        )
         final_answer = synth_resp.content
 
         return final_answer, sources
 
+    def ask_stream(
+        self,
+        question: str,
+        history: Optional[List[Tuple[str, str]]] = None,
+        session_id: str = DEFAULT_SESSION,
+    ) -> Iterator[Tuple[str, Any]]:
+        """
+        Streaming form of `ask`. Yields (event, data) pairs: ("plan", action),
+        ("retrieval_query", query) and ("sources", source_paths) on the retrieval
+        path, ("token", text) for each piece of the final answer, and finally
+        ("answer", {"answer": ..., "sources": ...}).
+        """
+        history = history or []
+        sources: List[str] = []
+        if self.low_latency:
+            action, retrieval_query, prompt, sources = self._fast_prepare(question, history)
+            yield "plan", action
+            if action != "direct":
+                yield "retrieval_query", retrieval_query
+                yield "sources", sources
+        elif self._plan(question, history) == "direct":
+            action = "direct"
+            yield "plan", action
+            prompt = self._direct_prompt(question, history)
+        else:
+            action = "retrieve"
+            yield "plan", action
+            retrieval_query = self._retrieval_query(question, history)
+            yield "retrieval_query", retrieval_query
+            rag_answer, sources = self.rag.answer_with_sources(retrieval_query, session_id=session_id)
+            yield "sources", sources
+            prompt = self._synth_prompt(question, history, retrieval_query, rag_answer, sources)
+
+        parts: List[str] = []
+        for chunk in self.agent_llm.stream(prompt):
+            if chunk.content:
+                parts.append(chunk.content)
+                yield "token", chunk.content
+        # The RAG answer already recorded the turn on the standard retrieval path
+        if self.low_latency or action == "direct":
+            self._record_turn(session_id, question, "".join(parts))
+        yield "answer", {"answer": "".join(parts), "sources": sources}
+
+    async def aask(
+        self,
+        question: str,
+        history: Optional[List[Tuple[str, str]]] = None,
+        session_id: str = DEFAULT_SESSION,
+    ) -> Tuple[str, List[str]]:
+        """Async `ask`: every LLM and embedding call is awaited."""
+        history = history or []
+        if self.low_latency:
+            action, _, prompt, sources = await self._afast_prepare(question, history)
+            answer = (await self.agent_llm.ainvoke(prompt)).content
+            self._record_turn(session_id, question, answer)
+            return answer, sources
+
+        plan_resp: AIMessage = await self.agent_llm.ainvoke(
+            self._plan_prompt(question, history), config=stage_config("agent_planning")
+        )
+        if self._parse_plan(plan_resp.content) == "direct":
+            direct_resp: AIMessage = await self.agent_llm.ainvoke(self._direct_prompt(question, history))
+            self._record_turn(session_id, question, direct_resp.content)
+            return direct_resp.content, []
+
+        query_resp: AIMessage = await self.agent_llm.ainvoke(
+            self._query_prompt(question, history), config=stage_config("query_rewrite")
+        )
+        retrieval_query = query_resp.content.strip()
+        rag_answer, sources = await self.rag.aanswer_with_sources(retrieval_query, session_id=session_id)
+        synth_resp: AIMessage = await self.agent_llm.ainvoke(
+            self._synth_prompt(question, history, retrieval_query, rag_answer, sources)
+        )
+        return synth_resp.content, sources
+
+    async def aask_stream(
+        self,
+        question: str,
+        history: Optional[List[Tuple[str, str]]] = None,
+        session_id: str = DEFAULT_SESSION,
+    ) -> AsyncIterator[Tuple[str, Any]]:
+        """Async `ask_stream`, yielding the same (event, data) pairs."""
+        history = history or []
+        sources: List[str] = []
+        if self.low_latency:
+            action, retrieval_query, prompt, sources = await self._afast_prepare(question, history)
+            yield "plan", action
+            if action != "direct":
+                yield "retrieval_query", retrieval_query
+                yield "sources", sources
+        elif await self._aplan(question, history) == "direct":
+            action = "direct"
+            yield "plan", action
+            prompt = self._direct_prompt(question, history)
+        else:
+            action = "retrieve"
+            yield "plan", action
+            query_resp: AIMessage = await self.agent_llm.ainvoke(
+                self._query_prompt(question, history), config=stage_config("query_rewrite")
+            )
+            retrieval_query = query_resp.content.strip()
+            yield "retrieval_query", retrieval_query
+            rag_answer, sources = await self.rag.aanswer_with_sources(retrieval_query, session_id=session_id)
+            yield "sources", sources
+            prompt = self._synth_prompt(question, history, retrieval_query, rag_answer, sources)
+
+        parts: List[str] = []
+        async for chunk in self.agent_llm.astream(prompt):
+            if chunk.content:
+                parts.append(chunk.content)
+                yield "token", chunk.content
+        # The RAG answer already recorded the turn on the standard retrieval path
+        if self.low_latency or action == "direct":
+            self._record_turn(session_id, question, "".join(parts))
+        yield "answer", {"answer": "".join(parts), "sources": sources}
 
-    def clear_history(self):
-        """Clears RAG conversation history."""
-        self.rag.clear_history()
+    def clear_history(self, session_id: str = DEFAULT_SESSION):
+        """Clears RAG conversation history of a session."""
+        self.rag.clear_history(session_id)
 
 
 # Example usage
@@ -1,20 +1,59 @@
 import json
+import asyncio
+import logging
 import argparse
-from typing import Any, Dict, List, Optional, Tuple, Union
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple, Union
 
 from langchain.chat_models import ChatOpenAI
-from langchain.schema import SystemMessage, HumanMessage, AIMessage
+from langchain.schema import Document, SystemMessage, HumanMessage, AIMessage
+from langchain_core.runnables import RunnableConfig
+from langchain_core.tools import StructuredTool
 from langgraph.prebuilt import create_react_agent
 from langchain.chat_models import init_chat_model
 if __name__=='__main__':
     from rag_reranker import RagReranker  # adjust import path if needed
+    from session_store import DEFAULT_SESSION, SessionStore
+    from hybrid_retriever import chunk_id_of
+    from query_cache import LRUCache, normalize_query
+    from metrics import LLMMetricsCallback, bind_context
 else:
     from .rag_reranker import RagReranker  # adjust import path if needed
+    from .session_store import DEFAULT_SESSION, SessionStore
+    from .hybrid_retriever import chunk_id_of
+    from .query_cache import LRUCache, normalize_query
+    from .metrics import LLMMetricsCallback, bind_context
+
+logger = logging.getLogger(__name__)
+
+# "answer": the tool runs a full RAG answer per query.
+# "retrieve": the tool takes several sub-queries at once and returns their reranked chunks.
+TOOL_MODES = ("answer", "retrieve")
+# Sub-queries accepted in one retrieve call
+MAX_SUB_QUERIES = 8
+
+AGENT_PROMPT = "You are a helpful assistant. Your task is to answer user's query. Your response must be a python dict containing keys 'answer' and 'sources'. The value for 'answer' is a text string and the value for the 'sources' is a list. You must include the sources from rag tool in case you use it."
+RETRIEVE_PROMPT = (
+    "You are a helpful assistant. Your task is to answer user's query from the local documents. "
+    "When the question has several parts (e.g. comparing two compounds), split it into self-contained "
+    "sub-queries and pass them all in a single call to the retrieval tool instead of calling it once per part. "
+    "Results of earlier calls in the conversation are remembered, so repeating a query is cheap. "
+    "Answer only from the returned excerpts. Your response must be a python dict containing keys 'answer' and 'sources'. "
+    "The value for 'answer' is a text string and the value for the 'sources' is a list of the sources of the excerpts you used."
+)
 
 class AgentQA:
     """
     An agentic QA system that uses a core LLM to think and decide when to query the RAG retriever.
     Accepts the same input and returns the same output (answer, sources) as RagReranker.
+
+    With `tool_mode="retrieve"` the agent's tool accepts a list of sub-queries, retrieves
+    and reranks them concurrently and returns the ranked chunks instead of an LLM answer,
+    so a multi-part question costs one retrieval round and one generation. Tool results are
+    memoized per session (the last `tool_memo_queries` queries of the last `tool_memo_sessions`
+    sessions) for `tool_memo_ttl` seconds or until the index changes.
     """
 
     def __init__(
@@ -26,7 +65,19 @@ class AgentQA:
         chunk_size: int = 1000,
         chunk_overlap: int = 200,
         agent_llm_model: str = "gpt-4o",
+        index_type: str = "flat",
+        index_params: Optional[Dict[str, int]] = None,
+        retrieval_mode: str = "auto",
+        session_store: Optional[SessionStore] = None,
+        tool_mode: str = "answer",
+        tool_memo_sessions: int = 1000,
+        tool_memo_queries: int = 64,
+        tool_memo_ttl: float = 3600.0,
+        index_dir: Optional[str] = None,
+        sync_on_load: bool = True,
     ):
+        if tool_mode not in TOOL_MODES:
+            raise ValueError(f"Unknown tool_mode {tool_mode!r}; expected one of {TOOL_MODES}")
         # initialize RAG reranker for retrieval
         self.rag = RagReranker(
             docs_dir=docs_dir,
@@ -35,37 +86,182 @@ class AgentQA:
             k=k,
             chunk_size=chunk_size,
             chunk_overlap=chunk_overlap,
+            index_type=index_type,
+            index_params=index_params,
+            retrieval_mode=retrieval_mode,
+            session_store=session_store,
+            index_dir=index_dir,
+            sync_on_load=sync_on_load,
         )
 
         # LLM for agent planning
         self.agent_llm = init_chat_model("openai:gpt-o4-mini")
 
         # wrap rag answer as a tool for the agent
-        def _rag_tool(query: str) -> str:
+        # (the session id arrives through the run config, not from the model)
+        def _rag_tool(query: str, config: RunnableConfig) -> str:
             """Receives a query in form of a question; retrieves and reranks from local documents; returns JSON with 'answer' & 'sources'."""
-            print(query)
-            answer, sources = self.rag.answer_with_sources(query)
+            logger.debug("RAG tool query: %s", query)
+            answer, sources = self.rag.answer_with_sources(query, session_id=self._session_of(config))
             return json.dumps({"answer": answer, "sources": sources})
 
+        async def _arag_tool(query: str, config: RunnableConfig) -> str:
+            answer, sources = await self.rag.aanswer_with_sources(query, session_id=self._session_of(config))
+            return json.dumps({"answer": answer, "sources": sources})
+
+        def _retrieve_tool(queries: List[str], config: RunnableConfig) -> str:
+            """Receives a list of self-contained search queries, one per part of the question; retrieves and reranks local documents for all of them at once; returns JSON with the ranked excerpts per query & 'sources'."""
+            return self._format_results(self._retrieve(queries, self._session_of(config)))
+
+        async def _aretrieve_tool(queries: List[str], config: RunnableConfig) -> str:
+            return self._format_results(await self._aretrieve(queries, self._session_of(config)))
+
+        self.tool_mode = tool_mode
+        # Per-session {normalised query: reranked chunks}, least recently used first,
+        # tagged with the index version
+        self.tool_memo = LRUCache(max_size=tool_memo_sessions, ttl=tool_memo_ttl)
+        self.tool_memo_queries = tool_memo_queries
+        # Concurrent agent runs and tool calls of one session share its memo
+        self._memo_lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=MAX_SUB_QUERIES, thread_name_prefix="agent-retrieval")
+        # Times the agent's own model calls and tool runs (the RAG's calls are timed by the RAG)
+        self._metrics_callback = LLMMetricsCallback(counter=self.rag.token_counter, agent_node="agent")
+
+        # same tool for sync and async runs of the agent
+        if tool_mode == "retrieve":
+            rag_tool = StructuredTool.from_function(func=_retrieve_tool, coroutine=_aretrieve_tool)
+        else:
+            rag_tool = StructuredTool.from_function(func=_rag_tool, coroutine=_arag_tool)
+
         # build the REACT agent with the properly documented tool
         self.agent = create_react_agent(
             model=f"openai:{agent_llm_model}",
-            tools=[_rag_tool],
-            prompt="You are a helpful assistant. Your task is to answer user's query. Your response must be a python dict containing keys 'answer' and 'sources'. The value for 'answer' is a text string and the value for the 'sources' is a list. You must include the sources from rag tool in case you use it."
+            tools=[rag_tool],
+            prompt=RETRIEVE_PROMPT if tool_mode == "retrieve" else AGENT_PROMPT
         )
 
     def ask(
         self,
         question: str,
         history: Optional[List[Union[Dict[str, Any], Tuple[str, str]]]] = None,
+        session_id: str = DEFAULT_SESSION,
     ) -> Tuple[str, List[str]]:
         """
         Ask a question to the agent. Returns a tuple (answer, sources).
 
         :param question: The user question
         :param history: Optional list of dicts or tuples representing past messages
+        :param session_id: Conversation whose RAG history is used and extended
         :return: answer string and list of source identifiers
         """
+        history_msgs = self._history_messages(history)
+
+        # invoke the agent with both question and history keys
+        # history_msgs.append(HumanMessage(content=question))
+        payload = {
+            "messages": history_msgs,
+        }
+        logger.debug("Agent payload: %s", payload)
+        response: Dict = self.agent.invoke(payload, config=self._run_config(session_id))
+
+        # extract tool outputs from response messages
+        msgs = response.get("messages", [])
+        for msg in msgs:
+            logger.debug("%s: %s", type(msg).__name__, msg)
+        final = msgs[-1] if msgs else {"content": ""}
+        content = getattr(final, "content", str(final))
+        logger.debug("Final content: %s", content)
+        return self._parse_final(content)
+
+    def _session_memo(self, session_id: str) -> "OrderedDict[str, List[Document]]":
+        # Called with _memo_lock held
+        entry = self.tool_memo.get(session_id)
+        if entry is None or entry[0] != self.rag.index_version:
+            # Chunks retrieved before a refresh may be stale
+            entry = (self.rag.index_version, OrderedDict())
+            self.tool_memo.put(session_id, entry)
+        return entry[1]
+
+    def _recall(self, queries: List[str], session_id: str) -> Tuple[List[str], Dict[str, List[Document]], Dict[str, str]]:
+        """(keys of `queries`, {key: chunks} remembered for the session, {key: query} still to retrieve)."""
+        queries = [q for q in queries if q and q.strip()][:MAX_SUB_QUERIES]
+        keys = [normalize_query(q) for q in queries]
+        found: Dict[str, List[Document]] = {}
+        with self._memo_lock:
+            memo = self._session_memo(session_id)
+            for key in keys:
+                if key in memo:
+                    memo.move_to_end(key)
+                    found[key] = memo[key]
+        missing = {key: query for key, query in zip(keys, queries) if key not in found}
+        return keys, found, missing
+
+    def _remember(self, session_id: str, results: Dict[str, List[Document]]):
+        with self._memo_lock:
+            memo = self._session_memo(session_id)
+            memo.update(results)
+            for key in results:
+                memo.move_to_end(key)
+            while len(memo) > self.tool_memo_queries:
+                memo.popitem(last=False)
+
+    def _retrieve(self, queries: List[str], session_id: str) -> List[Tuple[str, List[Document]]]:
+        """Reranked chunks for each query, retrieving the ones not yet seen in this session concurrently."""
+        keys, found, missing = self._recall(queries, session_id)
+        futures = [self._pool.submit(bind_context(self.rag.get_reranked), q) for q in missing.values()]
+        fresh = {key: future.result() for key, future in zip(missing, futures)}
+        self._remember(session_id, fresh)
+        found.update(fresh)
+        return [(key, found[key]) for key in keys]
+
+    async def _aretrieve(self, queries: List[str], session_id: str) -> List[Tuple[str, List[Document]]]:
+        """Async `_retrieve`."""
+        keys, found, missing = self._recall(queries, session_id)
+        results = await asyncio.gather(*(self.rag.aget_reranked(q) for q in missing.values()))
+        fresh = dict(zip(missing, results))
+        self._remember(session_id, fresh)
+        found.update(fresh)
+        return [(key, found[key]) for key in keys]
+
+    @staticmethod
+    def _format_results(results: List[Tuple[str, List[Document]]]) -> str:
+        # A chunk found by several sub-queries is returned once, under the first
+        seen = set()
+        sources: List[str] = []
+        payload = []
+        for query, docs in results:
+            excerpts = []
+            for doc in docs:
+                if chunk_id_of(doc) in seen:
+                    continue
+                seen.add(chunk_id_of(doc))
+                source = doc.metadata.get("source", "")
+                score = doc.metadata.get("relevance_score")
+                excerpts.append({
+                    "source": source,
+                    "score": None if score is None else round(float(score), 4),
+                    "content": doc.page_content,
+                })
+                if source not in sources:
+                    sources.append(source)
+            payload.append({"query": query, "excerpts": excerpts})
+        return json.dumps({"results": payload, "sources": sources})
+
+    def clear_history(self, session_id: str = DEFAULT_SESSION):
+        """Clears RAG conversation history and remembered tool results of a session."""
+        self.rag.clear_history(session_id)
+        with self._memo_lock:
+            self.tool_memo.pop(session_id)
+
+    def _run_config(self, session_id: str) -> RunnableConfig:
+        return {"configurable": {"session_id": session_id}, "callbacks": [self._metrics_callback]}
+
+    @staticmethod
+    def _session_of(config: Optional[RunnableConfig]) -> str:
+        return ((config or {}).get("configurable") or {}).get("session_id", DEFAULT_SESSION)
+
+    @staticmethod
+    def _history_messages(history: Optional[List[Union[Dict[str, Any], Tuple[str, str]]]]) -> List[Any]:
         # convert history entries into BaseMessage objects
         history_msgs: List[Any] = []
         if history:
@@ -82,25 +278,10 @@ class AgentQA:
                     history_msgs.append(AIMessage(content=content))
                 else:
                     history_msgs.append(HumanMessage(content=content))
+        return history_msgs
 
-        # invoke the agent with both question and history keys
-        # history_msgs.append(HumanMessage(content=question))
-        payload = {
-            "messages": history_msgs,
-        }
-        print(payload)
-        response: Dict = self.agent.invoke(payload)
-
-        # extract tool outputs from response messages
-        msgs = response.get("messages", [])
-        print(msgs)
-        for msg in msgs:
-            print(type(msg))
-            print(msg,'\n')
-        final = msgs[-1] if msgs else {"content": ""}
-        content = getattr(final, "content", str(final))
-        print('Final Content:')
-        print(content)
+    @staticmethod
+    def _parse_final(content: str) -> Tuple[str, List[str]]:
         # parse JSON answer if possible
         try:
             payload = json.loads(content)
@@ -112,6 +293,89 @@ class AgentQA:
 
         return answer, sources
 
+    @staticmethod
+    def _graph_events(mode: str, data: Any, final: Dict[str, str]) -> List[Tuple[str, Any]]:
+        """Translate one LangGraph stream item into (event, data) pairs; records the reply in `final`."""
+        events: List[Tuple[str, Any]] = []
+        if mode == "messages":
+            chunk, metadata = data
+            # Only the agent's own replies; the RAG tool's LLM runs inside "tools"
+            if metadata.get("langgraph_node") == "agent" and isinstance(chunk.content, str) and chunk.content:
+                events.append(("token", chunk.content))
+            return events
+        for node, update in data.items():
+            for msg in (update or {}).get("messages", []):
+                if node == "agent":
+                    for call in getattr(msg, "tool_calls", None) or []:
+                        args = call.get("args", {})
+                        events.append(("tool_call", args.get("queries", args.get("query", ""))))
+                    if not getattr(msg, "tool_calls", None):
+                        final["content"] = getattr(msg, "content", str(msg))
+                elif node == "tools":
+                    try:
+                        events.append(("sources", json.loads(msg.content).get("sources", [])))
+                    except (json.JSONDecodeError, AttributeError):
+                        pass
+        return events
+
+    def ask_stream(
+        self,
+        question: str,
+        history: Optional[List[Union[Dict[str, Any], Tuple[str, str]]]] = None,
+        session_id: str = DEFAULT_SESSION,
+    ) -> Iterator[Tuple[str, Any]]:
+        """
+        Streaming form of `ask`. Yields (event, data) pairs while the agent runs:
+        ("tool_call", query) when it calls the RAG tool (the list of sub-queries
+        in retrieve mode), ("sources", source_paths)
+        when the tool returns, ("token", text) for each piece of the agent's reply,
+        and finally ("answer", {"answer": ..., "sources": ...}).
+        """
+        payload = {
+            "messages": self._history_messages(history),
+        }
+        final = {"content": ""}
+        for mode, data in self.agent.stream(
+            payload, config=self._run_config(session_id), stream_mode=["updates", "messages"]
+        ):
+            yield from self._graph_events(mode, data, final)
+        answer, sources = self._parse_final(final["content"])
+        yield "answer", {"answer": answer, "sources": sources}
+
+    async def aask(
+        self,
+        question: str,
+        history: Optional[List[Union[Dict[str, Any], Tuple[str, str]]]] = None,
+        session_id: str = DEFAULT_SESSION,
+    ) -> Tuple[str, List[str]]:
+        """Async `ask`: the agent and RAG tool await their LLM and embedding calls."""
+        payload = {
+            "messages": self._history_messages(history),
+        }
+        response: Dict = await self.agent.ainvoke(payload, config=self._run_config(session_id))
+        msgs = response.get("messages", [])
+        final = msgs[-1] if msgs else {"content": ""}
+        return self._parse_final(getattr(final, "content", str(final)))
+
+    async def aask_stream(
+        self,
+        question: str,
+        history: Optional[List[Union[Dict[str, Any], Tuple[str, str]]]] = None,
+        session_id: str = DEFAULT_SESSION,
+    ) -> AsyncIterator[Tuple[str, Any]]:
+        """Async `ask_stream`, yielding the same (event, data) pairs."""
+        payload = {
+            "messages": self._history_messages(history),
+        }
+        final = {"content": ""}
+        async for mode, data in self.agent.astream(
+            payload, config=self._run_config(session_id), stream_mode=["updates", "messages"]
+        ):
+            for event in self._graph_events(mode, data, final):
+                yield event
+        answer, sources = self._parse_final(final["content"])
+        yield "answer", {"answer": answer, "sources": sources}
+
 
 def main():
     import dotenv
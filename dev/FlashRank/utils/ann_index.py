@@ -0,0 +1,214 @@
+# ann_index.py
+
+import math
+import time
+import random
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import faiss
+import numpy as np
+from langchain.vectorstores import FAISS
+from langchain.docstore.in_memory import InMemoryDocstore
+from langchain.schema import Document
+
+
+INDEX_TYPES = ("flat", "ivf_flat", "hnsw", "ivf_pq", "sq8")
+
+DEFAULT_INDEX_PARAMS: Dict[str, int] = {
+    "nlist": 0,         # IVF cells; 0 = 4 * sqrt(training vectors)
+    "nprobe": 16,       # IVF cells visited per query
+    "pq_m": 0,          # PQ sub-quantizers; 0 = largest divisor of dim <= 64
+    "hnsw_m": 32,       # HNSW graph degree
+    "ef_search": 64,    # HNSW candidate list size per query
+    "train_size": 20000,  # vectors buffered to train IVF/PQ/SQ before adding
+}
+
+
+def resolve_index_params(index_params: Optional[Dict[str, int]]) -> Dict[str, int]:
+    params = dict(DEFAULT_INDEX_PARAMS)
+    params.update({k: v for k, v in (index_params or {}).items() if v is not None})
+    unknown = set(params) - set(DEFAULT_INDEX_PARAMS)
+    if unknown:
+        raise ValueError(f"Unknown index parameters: {sorted(unknown)}")
+    return params
+
+
+def needs_training(index_type: str) -> bool:
+    return index_type in ("ivf_flat", "ivf_pq", "sq8")
+
+
+def _pq_m(dim: int, requested: int) -> int:
+    if requested:
+        if dim % requested:
+            raise ValueError(f"pq_m={requested} must divide the embedding dimension {dim}")
+        return requested
+    return max(m for m in range(1, min(dim, 64) + 1) if dim % m == 0)
+
+
+def factory_string(index_type: str, dim: int, n_train: int, params: Dict[str, int]) -> str:
+    """FAISS index_factory description for `index_type`, sized for `n_train` vectors."""
+    nlist = params["nlist"] or max(1, int(4 * math.sqrt(n_train)))
+    # k-means wants roughly 39 training points per centroid
+    nlist = max(1, min(nlist, n_train // 39 or 1))
+    if index_type == "ivf_flat":
+        return f"IVF{nlist},Flat"
+    if index_type == "ivf_pq":
+        return f"IVF{nlist},PQ{_pq_m(dim, params['pq_m'])}"
+    if index_type == "hnsw":
+        return f"HNSW{params['hnsw_m']}"
+    if index_type == "sq8":
+        return "SQ8"
+    return "Flat"
+
+
+def build_index(index_type: str, train_vectors: np.ndarray, params: Dict[str, int]) -> Any:
+    """
+    Create (and train, if needed) an empty FAISS index of `index_type` using
+    `train_vectors` as the training sample. Types whose vectors carry no native
+    ids are wrapped in IndexIDMap2 so chunk ids stay stable across deletions.
+    """
+    n, dim = train_vectors.shape
+    if index_type == "ivf_pq" and n < 256:
+        # 8-bit PQ codebooks need at least 256 training points
+        print(f"Warning: only {n} vectors to train ivf_pq; using ivf_flat instead.")
+        index_type = "ivf_flat"
+    index = faiss.index_factory(dim, factory_string(index_type, dim, n, params), faiss.METRIC_L2)
+    if needs_training(index_type):
+        index.train(train_vectors)
+    if faiss.try_extract_index_ivf(index) is None:
+        index = faiss.IndexIDMap2(index)
+    set_search_params(index, params)
+    return index
+
+
+def set_search_params(index: Any, params: Dict[str, int]):
+    """Apply query-time knobs (nprobe for IVF, efSearch for HNSW)."""
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.nprobe = min(params["nprobe"], ivf.nlist)
+    inner = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap) else index
+    if isinstance(inner, faiss.IndexHNSW):
+        inner.hnsw.efSearch = params["ef_search"]
+
+
+class AnnFAISS(FAISS):
+    """
+    LangChain FAISS store for approximate indexes.
+
+    The stock wrapper assumes vector positions are contiguous and renumbers them
+    after a delete, which is wrong for IVF and ID-mapped indexes. Here every chunk
+    gets a stable int64 FAISS id and `index_to_docstore_id` maps those ids, so adds
+    and deletes stay consistent. HNSW graphs cannot remove vectors, so deleting from
+    one rebuilds the graph from the remaining vectors.
+    """
+
+    def add_embeddings(
+        self,
+        text_embeddings: Iterable[Tuple[str, List[float]]],
+        metadatas: Optional[List[dict]] = None,
+        ids: Optional[List[str]] = None,
+        **kwargs: Any,
+    ) -> List[str]:
+        texts, embeddings = zip(*text_embeddings)
+        metadatas = metadatas or [{} for _ in texts]
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        start = max(self.index_to_docstore_id, default=-1) + 1
+        faiss_ids = np.arange(start, start + len(texts), dtype=np.int64)
+        self.index.add_with_ids(vectors, faiss_ids)
+        self.docstore.add({
+            id_: Document(id=id_, page_content=t, metadata=m)
+            for id_, t, m in zip(ids, texts, metadatas)
+        })
+        self.index_to_docstore_id.update({int(i): id_ for i, id_ in zip(faiss_ids, ids)})
+        return list(ids)
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs: Any) -> Optional[bool]:
+        if ids is None:
+            raise ValueError("No ids provided to delete.")
+        targets = set(ids)
+        faiss_ids = [i for i, id_ in self.index_to_docstore_id.items() if id_ in targets]
+        try:
+            self.index.remove_ids(np.asarray(faiss_ids, dtype=np.int64))
+        except RuntimeError:
+            self._rebuild_without(set(faiss_ids))
+        self.docstore.delete(list(targets))
+        for i in faiss_ids:
+            del self.index_to_docstore_id[i]
+        return True
+
+    def _rebuild_without(self, removed: set):
+        print(f"Rebuilding {type(faiss.downcast_index(self.index.index)).__name__} without {len(removed)} vectors")
+        inner = faiss.downcast_index(self.index.index)
+        all_ids = faiss.vector_to_array(self.index.id_map)
+        vectors = inner.reconstruct_n(0, inner.ntotal)
+        keep = np.array([i not in removed for i in all_ids], dtype=bool)
+        graph = faiss.index_factory(inner.d, f"HNSW{inner.hnsw.nb_neighbors(1)}", faiss.METRIC_L2)
+        graph.hnsw.efSearch = inner.hnsw.efSearch
+        fresh = faiss.IndexIDMap2(graph)
+        fresh.add_with_ids(vectors[keep], all_ids[keep])
+        self.index = fresh
+
+    @classmethod
+    def from_index(cls, embedding: Any, index: Any) -> "AnnFAISS":
+        return cls(embedding, index, InMemoryDocstore(), {})
+
+
+def recall_report(
+    vectorstore: FAISS,
+    vectors: np.ndarray,
+    n_queries: int = 200,
+    k: int = 20,
+    sweep: Optional[List[int]] = None,
+) -> List[Dict[str, float]]:
+    """
+    Measure recall@k and per-query latency of `vectorstore.index` against exact
+    flat search over `vectors` (all indexed vectors, in FAISS id order). Queries are
+    indexed vectors sampled at random. `sweep` lists nprobe (IVF) or efSearch (HNSW)
+    values to try; the index's current setting is restored afterwards.
+    """
+    index = vectorstore.index
+    ids = np.asarray(sorted(vectorstore.index_to_docstore_id), dtype=np.int64)
+    exact = faiss.IndexFlatL2(vectors.shape[1])
+    exact.add(vectors)
+    sample = random.Random(0).sample(range(len(vectors)), min(n_queries, len(vectors)))
+    queries = vectors[sample]
+    k = min(k, len(vectors))
+
+    start = time.perf_counter()
+    _, truth = exact.search(queries, k)
+    flat_ms = (time.perf_counter() - start) * 1000 / len(queries)
+    truth_ids = ids[truth]
+
+    ivf = faiss.try_extract_index_ivf(index)
+    inner = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap) else index
+    hnsw = inner if isinstance(inner, faiss.IndexHNSW) else None
+    if ivf is not None:
+        knob, original = "nprobe", ivf.nprobe
+    elif hnsw is not None:
+        knob, original = "ef_search", hnsw.hnsw.efSearch
+    else:
+        knob, original = None, None
+
+    rows = []
+    for value in (sweep if knob and sweep else [original]):
+        if knob == "nprobe":
+            ivf.nprobe = min(value, ivf.nlist)
+        elif knob == "ef_search":
+            hnsw.hnsw.efSearch = value
+        start = time.perf_counter()
+        _, found = index.search(queries, k)
+        ann_ms = (time.perf_counter() - start) * 1000 / len(queries)
+        hits = sum(len(set(f) & set(t)) for f, t in zip(found, truth_ids))
+        rows.append({
+            "param": knob or "-",
+            "value": value if knob else 0,
+            "recall": hits / (len(queries) * k),
+            "ann_ms": ann_ms,
+            "flat_ms": flat_ms,
+        })
+
+    if knob == "nprobe":
+        ivf.nprobe = original
+    elif knob == "ef_search":
+        hnsw.hnsw.efSearch = original
+    return rows
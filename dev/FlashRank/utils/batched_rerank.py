@@ -0,0 +1,172 @@
+# batched_rerank.py
+
+import time
+import queue
+import threading
+from typing import Any, Dict, List, Optional, Sequence
+import numpy as np
+from pydantic import ConfigDict
+from langchain_core.callbacks.manager import Callbacks
+from langchain_core.documents import BaseDocumentCompressor
+from langchain.schema import Document
+
+
+DEFAULT_RERANK_MODEL = "ms-marco-MultiBERT-L-12"
+
+
+class _Pending:
+    __slots__ = ("query", "texts", "scores", "error", "done")
+
+    def __init__(self, query: str, texts: List[str]):
+        self.query = query
+        self.texts = texts
+        self.scores: Optional[np.ndarray] = None
+        self.error: Optional[BaseException] = None
+        self.done = threading.Event()
+
+
+class RerankBatcher:
+    """
+    Shared cross-encoder scoring service for one FlashRank model.
+
+    Callers on any thread submit (query, passages) and block until scored. A single
+    worker thread gathers whatever requests are pending, waiting up to `max_wait_ms`
+    for callers that are already on their way, and scores all their pairs in one
+    ONNX call. A lone caller is scored immediately, so light traffic pays no delay.
+    """
+
+    def __init__(self, ranker: Any, max_wait_ms: float = 5.0, max_batch_pairs: int = 256):
+        self.ranker = ranker
+        self.max_wait = max_wait_ms / 1000.0
+        self.max_batch_pairs = max_batch_pairs
+        self.batches = 0
+        self.requests = 0
+        self._queue: "queue.Queue[_Pending]" = queue.Queue()
+        self._callers = 0
+        self._callers_lock = threading.Lock()
+        self._worker = threading.Thread(target=self._run, name="rerank-batcher", daemon=True)
+        self._worker.start()
+
+    def score(self, query: str, texts: List[str]) -> np.ndarray:
+        """Relevance scores of `texts` for `query`, in input order."""
+        if not texts:
+            return np.zeros(0, dtype=np.float32)
+        pending = _Pending(query, texts)
+        with self._callers_lock:
+            self._callers += 1
+        try:
+            self._queue.put(pending)
+            pending.done.wait()
+        finally:
+            with self._callers_lock:
+                self._callers -= 1
+        if pending.error is not None:
+            raise pending.error
+        return pending.scores
+
+    def _collect(self) -> List[_Pending]:
+        batch = [self._queue.get()]
+        pairs = len(batch[0].texts)
+        deadline = time.monotonic() + self.max_wait
+        # Every caller in score() is either in this batch or about to be queued
+        while pairs < self.max_batch_pairs and len(batch) < self._callers:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            batch.append(item)
+            pairs += len(item.texts)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            try:
+                scores = self._score_pairs([(p.query, t) for p in batch for t in p.texts])
+                start = 0
+                for p in batch:
+                    p.scores = scores[start:start + len(p.texts)]
+                    start += len(p.texts)
+            except Exception as e:
+                for p in batch:
+                    p.error = e
+            self.batches += 1
+            self.requests += len(batch)
+            for p in batch:
+                p.done.set()
+
+    def _score_pairs(self, pairs: List[tuple]) -> np.ndarray:
+        # Same pre/post-processing as flashrank's pairwise Ranker.rerank
+        encoded = self.ranker.tokenizer.encode_batch([list(p) for p in pairs])
+        input_ids = np.array([e.ids for e in encoded], dtype=np.int64)
+        token_type_ids = np.array([e.type_ids for e in encoded], dtype=np.int64)
+        attention_mask = np.array([e.attention_mask for e in encoded], dtype=np.int64)
+        onnx_input = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if not np.all(token_type_ids == 0):
+            onnx_input["token_type_ids"] = token_type_ids
+        logits = self.ranker.session.run(None, onnx_input)[0]
+        if logits.shape[1] == 1:
+            return 1 / (1 + np.exp(-logits.flatten()))
+        exp_logits = np.exp(logits)
+        return exp_logits[:, 1] / np.sum(exp_logits, axis=1)
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "batches": self.batches,
+            "requests": self.requests,
+            "requests_per_batch": self.requests / self.batches if self.batches else 0.0,
+        }
+
+
+_batchers: Dict[str, RerankBatcher] = {}
+_batchers_lock = threading.Lock()
+
+
+def shared_batcher(model_name: str = DEFAULT_RERANK_MODEL, max_wait_ms: float = 5.0) -> RerankBatcher:
+    """The process-wide batcher for `model_name`, loading the model on first use."""
+    with _batchers_lock:
+        if model_name not in _batchers:
+            from flashrank import Ranker
+            ranker = Ranker(model_name=model_name)
+            if getattr(ranker, "session", None) is None:
+                raise ValueError(f"{model_name} is a listwise model; only pairwise cross-encoders can be batched")
+            _batchers[model_name] = RerankBatcher(ranker, max_wait_ms=max_wait_ms)
+        return _batchers[model_name]
+
+
+class BatchedFlashrankRerank(BaseDocumentCompressor):
+    """
+    Drop-in replacement for FlashrankRerank that scores through a shared
+    RerankBatcher, so concurrent retrievals are reranked together.
+    """
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    batcher: Any
+    top_n: int = 3
+    score_threshold: float = 0.0
+    prefix_metadata: str = ""
+
+    def compress_documents(
+        self,
+        documents: Sequence[Document],
+        query: str,
+        callbacks: Optional[Callbacks] = None,
+    ) -> Sequence[Document]:
+        scores = self.batcher.score(query, [d.page_content for d in documents])
+        order = sorted(range(len(documents)), key=lambda i: scores[i], reverse=True)[:self.top_n]
+        results = []
+        for i in order:
+            if scores[i] >= self.score_threshold:
+                results.append(Document(
+                    page_content=documents[i].page_content,
+                    metadata={
+                        self.prefix_metadata + "id": i,
+                        self.prefix_metadata + "relevance_score": scores[i],
+                        **documents[i].metadata,
+                    },
+                ))
+        return results
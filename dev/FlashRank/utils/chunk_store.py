@@ -0,0 +1,224 @@
+# chunk_store.py
+
+import os
+import json
+import mmap
+from collections.abc import MutableMapping
+from typing import Any, Dict, Iterator, List, Optional, Set, Union
+
+import faiss
+import numpy as np
+from langchain.docstore.base import AddableMixin, Docstore
+from langchain.schema import Document
+
+
+# Files that make up a chunk store, all inside the index directory:
+#   chunks.meta.json  record count and id width (written last)
+#   chunks.dat        one UTF-8 JSON record {"page_content", "metadata"} per chunk
+#   chunks.off        uint64[count + 1] byte offsets of each record in chunks.dat
+#   chunks.fid        int64[count] FAISS id of each record, ascending
+#   chunks.rid        S<width>[count] docstore id of each record
+#   chunks.sid        S<width>[count] docstore ids sorted, for binary search
+#   chunks.srow       int64[count] record number of each entry in chunks.sid
+META_NAME = "chunks.meta.json"
+STORE_VERSION = 1
+
+
+def has_chunk_store(index_dir: str) -> bool:
+    return os.path.isfile(os.path.join(index_dir, META_NAME))
+
+
+class _Segment:
+    """Read-only, memory-mapped view of a chunk store written by `write_chunk_store`."""
+
+    def __init__(self, index_dir: str):
+        with open(os.path.join(index_dir, META_NAME), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("version") != STORE_VERSION:
+            raise ValueError(f"Unsupported chunk store version {meta.get('version')} in {index_dir}")
+        self.count = meta["count"]
+        id_dtype = f"S{meta['id_width']}"
+
+        def array(name, dtype, length):
+            if length == 0:
+                return np.zeros(0, dtype=dtype)
+            return np.memmap(os.path.join(index_dir, name), dtype=dtype, mode="r", shape=(length,))
+
+        self.offsets = array("chunks.off", np.uint64, self.count + 1)
+        self.faiss_ids = array("chunks.fid", np.int64, self.count)
+        self.row_ids = array("chunks.rid", id_dtype, self.count)
+        self.sorted_ids = array("chunks.sid", id_dtype, self.count)
+        self.sorted_rows = array("chunks.srow", np.int64, self.count)
+        self._data = None
+        data_path = os.path.join(index_dir, "chunks.dat")
+        if self.count and os.path.getsize(data_path):
+            with open(data_path, "rb") as f:
+                self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def row_of_faiss_id(self, fid: int) -> Optional[int]:
+        pos = int(np.searchsorted(self.faiss_ids, fid))
+        if pos < self.count and self.faiss_ids[pos] == fid:
+            return pos
+        return None
+
+    def row_of_id(self, doc_id: str) -> Optional[int]:
+        key = doc_id.encode("utf-8")
+        pos = int(np.searchsorted(self.sorted_ids, key))
+        if pos < self.count and self.sorted_ids[pos] == key:
+            return int(self.sorted_rows[pos])
+        return None
+
+    def doc_id(self, row: int) -> str:
+        return self.row_ids[row].decode("utf-8")
+
+    def document(self, row: int) -> Document:
+        start, end = int(self.offsets[row]), int(self.offsets[row + 1])
+        record = json.loads(self._data[start:end])
+        return Document(id=self.doc_id(row), page_content=record["page_content"], metadata=record["metadata"])
+
+
+class ChunkStore(Docstore, AddableMixin):
+    """
+    Docstore backed by the memory-mapped files of a chunk store, replacing the
+    pickled InMemoryDocstore. Chunk text is read from disk on lookup, so opening a
+    store costs almost nothing and processes share the page cache. Additions and
+    deletions are kept in memory until the store is rewritten.
+    """
+
+    def __init__(self, segment: Optional[_Segment] = None):
+        self._segment = segment
+        self._added: Dict[str, Document] = {}
+        self._deleted: Set[str] = set()
+
+    def add(self, texts: Dict[str, Document]) -> None:
+        for doc_id, doc in texts.items():
+            self._added[doc_id] = doc
+            self._deleted.discard(doc_id)
+
+    def delete(self, ids: List) -> None:
+        for doc_id in ids:
+            self._added.pop(doc_id, None)
+            self._deleted.add(doc_id)
+
+    def search(self, search: str) -> Union[str, Document]:
+        if search in self._added:
+            return self._added[search]
+        if search not in self._deleted and self._segment is not None:
+            row = self._segment.row_of_id(search)
+            if row is not None:
+                return self._segment.document(row)
+        return f"ID {search} not found."
+
+
+class RowIdMap(MutableMapping):
+    """
+    FAISS id -> docstore id mapping over a chunk store's id arrays, with an
+    in-memory overlay for changes. Stands in for the `index_to_docstore_id` dict.
+    """
+
+    def __init__(self, segment: Optional[_Segment] = None):
+        self._segment = segment
+        self._set: Dict[int, str] = {}
+        self._deleted: Set[int] = set()
+        self._len = segment.count if segment is not None else 0
+
+    def _base_get(self, fid: int) -> Optional[str]:
+        if self._segment is None or fid in self._deleted:
+            return None
+        row = self._segment.row_of_faiss_id(fid)
+        return self._segment.doc_id(row) if row is not None else None
+
+    def __getitem__(self, fid: int) -> str:
+        fid = int(fid)
+        if fid in self._set:
+            return self._set[fid]
+        value = self._base_get(fid)
+        if value is None:
+            raise KeyError(fid)
+        return value
+
+    def __setitem__(self, fid: int, doc_id: str) -> None:
+        fid = int(fid)
+        if fid not in self:
+            self._len += 1
+        self._set[fid] = doc_id
+
+    def __delitem__(self, fid: int) -> None:
+        fid = int(fid)
+        if fid not in self:
+            raise KeyError(fid)
+        self._set.pop(fid, None)
+        if self._segment is not None and self._segment.row_of_faiss_id(fid) is not None:
+            self._deleted.add(fid)
+        self._len -= 1
+
+    def __contains__(self, fid: Any) -> bool:
+        try:
+            self[fid]
+            return True
+        except (KeyError, TypeError, ValueError):
+            return False
+
+    def __iter__(self) -> Iterator[int]:
+        if self._segment is not None:
+            for fid in self._segment.faiss_ids:
+                fid = int(fid)
+                if fid not in self._deleted and fid not in self._set:
+                    yield fid
+        yield from list(self._set)
+
+    def __len__(self) -> int:
+        return self._len
+
+
+def open_chunk_store(index_dir: str):
+    """Return (docstore, index_to_docstore_id) backed by the chunk store in `index_dir`."""
+    segment = _Segment(index_dir)
+    return ChunkStore(segment), RowIdMap(segment)
+
+
+def write_chunk_store(index_dir: str, docstore: Docstore, index_to_docstore_id: MutableMapping):
+    """
+    Write every chunk referenced by `index_to_docstore_id` to a new chunk store in
+    `index_dir`, ordered by FAISS id. Files are written under temporary names and
+    swapped in afterwards, with the metadata file last.
+    """
+    os.makedirs(index_dir, exist_ok=True)
+    fids = sorted(int(i) for i in index_to_docstore_id)
+    ids = [index_to_docstore_id[i] for i in fids]
+    width = max((len(i.encode("utf-8")) for i in ids), default=1)
+
+    def tmp(name):
+        return os.path.join(index_dir, name + ".tmp")
+
+    offsets = np.zeros(len(ids) + 1, dtype=np.uint64)
+    with open(tmp("chunks.dat"), "wb") as f:
+        for n, doc_id in enumerate(ids):
+            doc = docstore.search(doc_id)
+            if not isinstance(doc, Document):
+                raise ValueError(f"Chunk {doc_id} is missing from the docstore")
+            f.write(json.dumps(
+                {"page_content": doc.page_content, "metadata": doc.metadata},
+                ensure_ascii=False,
+            ).encode("utf-8"))
+            offsets[n + 1] = f.tell()
+
+    row_ids = np.array([i.encode("utf-8") for i in ids], dtype=f"S{width}")
+    order = np.argsort(row_ids, kind="stable")
+    offsets.tofile(tmp("chunks.off"))
+    np.asarray(fids, dtype=np.int64).tofile(tmp("chunks.fid"))
+    row_ids.tofile(tmp("chunks.rid"))
+    row_ids[order].tofile(tmp("chunks.sid"))
+    order.astype(np.int64).tofile(tmp("chunks.srow"))
+    with open(tmp(META_NAME), "w", encoding="utf-8") as f:
+        json.dump({"version": STORE_VERSION, "count": len(ids), "id_width": width}, f)
+
+    for name in ["chunks.dat", "chunks.off", "chunks.fid", "chunks.rid", "chunks.sid", "chunks.srow", META_NAME]:
+        os.replace(tmp(name), os.path.join(index_dir, name))
+
+
+def mmap_flags(index_type: str) -> int:
+    """faiss.read_index flags that memory-map the vectors of `index_type`."""
+    if index_type.startswith("ivf"):
+        return faiss.IO_FLAG_MMAP
+    return faiss.IO_FLAG_MMAP_IFC
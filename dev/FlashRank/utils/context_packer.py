@@ -0,0 +1,164 @@
+# context_packer.py
+
+import re
+from typing import Dict, List, Optional, Tuple
+from langchain.schema import Document
+if __name__ == "__main__":
+    from token_budget import TokenCounter
+else:
+    from .token_budget import TokenCounter
+
+
+# Shortest shared run of text accepted as evidence that two chunks overlap
+MIN_OVERLAP_CHARS = 20
+# Paragraphs shorter than this (headings, "Table 1") may legitimately repeat
+MIN_DEDUP_CHARS = 40
+# Segments cut to fit the budget must keep at least this many tokens
+MIN_TRUNCATED_TOKENS = 50
+
+
+class _Segment:
+    """A run of contiguous text from one source, built from one or more chunks."""
+
+    def __init__(self, doc: Document, rank: int):
+        self.text = doc.page_content
+        self.start: Optional[int] = doc.metadata.get("start_index")
+        self.rank = rank
+        self.members: List[Tuple[int, Document]] = [(rank, doc)]
+
+    @property
+    def end(self) -> Optional[int]:
+        return None if self.start is None else self.start + len(self.text)
+
+    def _merge_positions(self, other: "_Segment") -> Optional[Tuple[str, int]]:
+        first, second = (self, other) if self.start <= other.start else (other, self)
+        gap = second.start - first.end
+        if gap > 2:
+            return None
+        if gap > 0:
+            # Only whitespace between them was stripped by the splitter; pad with as
+            # many characters so the text keeps spanning [start, end)
+            return first.text + "\n" * gap + second.text, first.start
+        shared = first.text[second.start - first.start:]
+        if second.text.startswith(shared):
+            return first.text + second.text[len(shared):], first.start
+        if shared.startswith(second.text):
+            return first.text, first.start
+        return None
+
+    def merge(self, other: "_Segment") -> bool:
+        """Absorb `other` if the two overlap, touch, or one contains the other."""
+        merged = None
+        if self.start is not None and other.start is not None:
+            merged = self._merge_positions(other)
+        if merged is None:
+            # No positions (older indexes): look for the overlap in the text itself
+            text = _merge_text(self.text, other.text)
+            if text is not None:
+                merged = text, self.start
+            else:
+                text = _merge_text(other.text, self.text)
+                if text is not None:
+                    merged = text, other.start
+        if merged is None:
+            return False
+        self.text, self.start = merged
+        self.rank = min(self.rank, other.rank)
+        self.members.extend(other.members)
+        return True
+
+
+def _merge_text(a: str, b: str) -> Optional[str]:
+    """`a` extended by `b` if `b` is inside `a` or starts with a suffix of `a`."""
+    if b in a:
+        return a
+    probe = b[:MIN_OVERLAP_CHARS]
+    if len(probe) < MIN_OVERLAP_CHARS:
+        return None
+    pos = a.find(probe)
+    while pos != -1:
+        if b.startswith(a[pos:]):
+            return a + b[len(a) - pos:]
+        pos = a.find(probe, pos + 1)
+    return None
+
+
+def _merge_source(segments: List[_Segment]) -> List[_Segment]:
+    merged: List[_Segment] = []
+    for seg in sorted(segments, key=lambda s: (s.start is None, s.start or 0, s.rank)):
+        if not any(m.merge(seg) for m in merged):
+            merged.append(seg)
+    # A merge can make two earlier segments touch; repeat until stable
+    changed = True
+    while changed and len(merged) > 1:
+        changed = False
+        for i in range(len(merged)):
+            for j in range(i + 1, len(merged)):
+                if merged[i].merge(merged[j]):
+                    del merged[j]
+                    changed = True
+                    break
+            if changed:
+                break
+    return merged
+
+
+def _dedup_paragraphs(text: str, seen: set) -> str:
+    kept = []
+    for para in re.split(r"\n\s*\n", text):
+        key = " ".join(para.split())
+        if len(key) >= MIN_DEDUP_CHARS:
+            if key in seen:
+                continue
+            seen.add(key)
+        kept.append(para)
+    return "\n\n".join(kept)
+
+
+def pack_context(
+    docs: List[Document],
+    counter: TokenCounter,
+    max_tokens: int,
+    separator: str = "\n\n",
+) -> Tuple[str, List[Document]]:
+    """
+    Assemble the LLM context from reranked `docs` (best first). Chunks from the
+    same source that overlap or are adjacent are merged into one passage, repeated
+    paragraphs are kept once, and passages are added in order of their best-ranked
+    chunk until `max_tokens` is reached (the last one may be truncated).
+    Returns the context and the docs whose text made it in, in rerank order.
+    """
+    by_source: Dict[str, List[_Segment]] = {}
+    for rank, doc in enumerate(docs):
+        by_source.setdefault(doc.metadata.get("source", ""), []).append(_Segment(doc, rank))
+    segments = sorted(
+        (seg for group in by_source.values() for seg in _merge_source(group)),
+        key=lambda s: s.rank,
+    )
+
+    parts: List[str] = []
+    used: List[Tuple[int, Document]] = []
+    seen: set = set()
+    emitted: List[str] = []
+    remaining = max_tokens
+    for seg in segments:
+        text = _dedup_paragraphs(seg.text, seen).strip()
+        flat = " ".join(text.split())
+        if not text or any(flat in p for p in emitted):
+            # Same text already included from another source
+            continue
+        cost = counter.count(text) + counter.count(separator)
+        if cost > remaining:
+            if remaining - counter.count(separator) < MIN_TRUNCATED_TOKENS:
+                break
+            text = counter.truncate(text, remaining - counter.count(separator))
+            cost = remaining
+        parts.append(text)
+        emitted.append(flat)
+        used.extend(seg.members)
+        remaining -= cost
+        if remaining <= 0:
+            break
+
+    used.sort(key=lambda member: member[0])
+    return separator.join(parts), [doc for _, doc in used]
@@ -0,0 +1,179 @@
+# embedding_cache.py
+
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+from array import array
+from typing import Dict, List, Optional
+from langchain_core.embeddings import Embeddings
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Wraps an Embeddings object with a persistent, content-addressed cache.
+
+    Vectors are stored in a single SQLite file keyed by (model, sha256(text)), so the
+    same chunk text is only ever sent to the embedding API once per model, whatever
+    index directory or chunking settings it was produced under. When the stored
+    vectors exceed `max_size_mb`, the least recently used entries are evicted.
+    """
+
+    def __init__(
+        self,
+        embedding: Embeddings,
+        path: str,
+        model_name: str,
+        max_size_mb: int = 2048,
+    ):
+        self.embedding = embedding
+        self.path = path
+        self.model_name = model_name
+        self.max_bytes = max_size_mb * 1024 * 1024
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        parent = os.path.dirname(os.path.abspath(path))
+        os.makedirs(parent, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " model TEXT NOT NULL,"
+            " text_hash TEXT NOT NULL,"
+            " vector BLOB NOT NULL,"
+            " last_used REAL NOT NULL,"
+            " PRIMARY KEY (model, text_hash))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self._conn.commit()
+        self._size = self._conn.execute(
+            "SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings"
+        ).fetchone()[0]
+
+    def get_many(self, hashes: List[str]) -> Dict[str, List[float]]:
+        """Return cached vectors for the given text hashes (missing ones are omitted)."""
+        found: Dict[str, List[float]] = {}
+        now = time.time()
+        with self._lock:
+            # Stay well below SQLite's host-parameter limit
+            for start in range(0, len(hashes), 500):
+                batch = hashes[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE model = ? "
+                    f"AND text_hash IN ({','.join('?' * len(batch))})",
+                    [self.model_name, *batch],
+                ).fetchall()
+                for h, blob in rows:
+                    vec = array("f")
+                    vec.frombytes(blob)
+                    found[h] = vec.tolist()
+            if found:
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE model = ? AND text_hash = ?",
+                    [(now, self.model_name, h) for h in found],
+                )
+                self._conn.commit()
+        return found
+
+    def put_many(self, items: Dict[str, List[float]]):
+        """Store vectors keyed by text hash, evicting old entries if over budget."""
+        if not items:
+            return
+        now = time.time()
+        rows = [(self.model_name, h, array("f", vec).tobytes(), now) for h, vec in items.items()]
+        hashes = list(items)
+        with self._lock:
+            # Rows already stored are replaced, so their old size no longer counts
+            replaced = 0
+            for start in range(0, len(hashes), 500):
+                batch = hashes[start:start + 500]
+                replaced += self._conn.execute(
+                    f"SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings WHERE model = ? "
+                    f"AND text_hash IN ({','.join('?' * len(batch))})",
+                    [self.model_name, *batch],
+                ).fetchone()[0]
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, text_hash, vector, last_used) VALUES (?, ?, ?, ?)",
+                rows,
+            )
+            self._size += sum(len(r[2]) for r in rows) - replaced
+            if self._size > self.max_bytes:
+                self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        # Trim to 90% of the budget so eviction does not run on every insert
+        count, total = self._conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings"
+        ).fetchone()
+        if not count:
+            self._size = 0
+            return
+        excess = total - int(self.max_bytes * 0.9)
+        if excess > 0:
+            n = min(count, -(-excess * count // total))
+            self._conn.execute(
+                "DELETE FROM embeddings WHERE rowid IN "
+                "(SELECT rowid FROM embeddings ORDER BY last_used LIMIT ?)",
+                (n,),
+            )
+        self._size = self._conn.execute(
+            "SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings"
+        ).fetchone()[0]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        hashes = [text_hash(t) for t in texts]
+        cached = self.get_many(list(set(hashes)))
+
+        # Embed each distinct missing text once
+        missing: Dict[str, str] = {}
+        for h, t in zip(hashes, texts):
+            if h not in cached and h not in missing:
+                missing[h] = t
+        self.hits += len(texts) - len(missing)
+        self.misses += len(missing)
+        if missing:
+            vectors = self.embedding.embed_documents(list(missing.values()))
+            fresh = dict(zip(missing.keys(), vectors))
+            self.put_many(fresh)
+            cached.update(fresh)
+        return [cached[h] for h in hashes]
+
+    def embed_query(self, text: str) -> List[float]:
+        h = text_hash("query:" + text)
+        cached = self.get_many([h])
+        if h in cached:
+            self.hits += 1
+            return cached[h]
+        self.misses += 1
+        vector = self.embedding.embed_query(text)
+        self.put_many({h: vector})
+        return vector
+
+    async def aembed_query(self, text: str) -> List[float]:
+        # SQLite lookups are local and short; only the API call is awaited
+        h = text_hash("query:" + text)
+        cached = self.get_many([h])
+        if h in cached:
+            self.hits += 1
+            return cached[h]
+        self.misses += 1
+        vector = await self.embedding.aembed_query(text)
+        self.put_many({h: vector})
+        return vector
+
+    def stats(self) -> Dict[str, Optional[float]]:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else None,
+            "size_bytes": self._size,
+        }
@@ -0,0 +1,205 @@
+# embedding_pipeline.py
+
+import os
+import json
+import time
+import random
+import hashlib
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Deque, Dict, Iterable, Iterator, List, Optional, Tuple
+from langchain_core.embeddings import Embeddings
+
+
+def is_rate_limit_error(e: Exception) -> bool:
+    """True if `e` looks like an HTTP 429 from the embedding provider."""
+    if getattr(e, "status_code", None) == 429:
+        return True
+    response = getattr(e, "response", None)
+    if getattr(response, "status_code", None) == 429:
+        return True
+    return type(e).__name__ == "RateLimitError" or "429" in str(e)
+
+
+def retry_after_seconds(e: Exception) -> Optional[float]:
+    """The server's Retry-After hint, if the error carries one."""
+    headers = getattr(getattr(e, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class AdaptiveLimiter:
+    """
+    Concurrency limit that adapts to rate limiting (additive increase,
+    multiplicative decrease): every 429 halves the number of requests allowed
+    in flight, and each run of successes lets it grow back by one up to `maximum`.
+    """
+
+    def __init__(self, maximum: int, increase_after: int = 10):
+        self.maximum = max(1, maximum)
+        self.limit = self.maximum
+        self.increase_after = increase_after
+        self._in_flight = 0
+        self._successes = 0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while self._in_flight >= self.limit:
+                self._cond.wait()
+            self._in_flight += 1
+
+    def release(self, rate_limited: bool = False):
+        with self._cond:
+            self._in_flight -= 1
+            if rate_limited:
+                self.limit = max(1, self.limit // 2)
+                self._successes = 0
+            else:
+                self._successes += 1
+                if self._successes >= self.increase_after and self.limit < self.maximum:
+                    self.limit += 1
+                    self._successes = 0
+            self._cond.notify_all()
+
+
+class BatchEmbedder:
+    """
+    Embeds texts in fixed-size batches with a bounded number of concurrent requests.
+
+    Rate-limited batches are retried with exponential backoff and jitter (honouring
+    Retry-After when present) while the AdaptiveLimiter lowers concurrency. If
+    `checkpoint_path` is set, each finished batch is appended to a JSONL checkpoint
+    so an interrupted build resumes without re-embedding finished batches; call
+    `clear_checkpoint()` once the results have been persisted elsewhere.
+    """
+
+    def __init__(
+        self,
+        embedding: Embeddings,
+        batch_size: int = 256,
+        max_concurrency: int = 4,
+        max_retries: int = 8,
+        base_delay: float = 1.0,
+        max_delay: float = 60.0,
+        checkpoint_path: Optional[str] = None,
+    ):
+        self.embedding = embedding
+        self.batch_size = max(1, batch_size)
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.checkpoint_path = checkpoint_path
+        self.limiter = AdaptiveLimiter(self.max_concurrency)
+        self._checkpoint_lock = threading.Lock()
+
+    @staticmethod
+    def _batch_key(texts: List[str]) -> str:
+        h = hashlib.sha256()
+        for t in texts:
+            h.update(hashlib.sha256(t.encode("utf-8")).digest())
+        return h.hexdigest()
+
+    def _load_checkpoint(self) -> Dict[str, List[List[float]]]:
+        done: Dict[str, List[List[float]]] = {}
+        if not self.checkpoint_path or not os.path.isfile(self.checkpoint_path):
+            return done
+        with open(self.checkpoint_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Torn last line from an interrupted write
+                    continue
+                done[record["key"]] = record["vectors"]
+        return done
+
+    def _append_checkpoint(self, key: str, vectors: List[List[float]]):
+        if not self.checkpoint_path or not key:
+            return
+        line = json.dumps({"key": key, "vectors": vectors}) + "\n"
+        with self._checkpoint_lock:
+            os.makedirs(os.path.dirname(os.path.abspath(self.checkpoint_path)), exist_ok=True)
+            with open(self.checkpoint_path, "a", encoding="utf-8") as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+
+    def clear_checkpoint(self):
+        if self.checkpoint_path and os.path.isfile(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+
+    def _embed_batch(self, texts: List[str]) -> List[List[float]]:
+        attempt = 0
+        while True:
+            self.limiter.acquire()
+            try:
+                vectors = self.embedding.embed_documents(texts)
+            except Exception as e:
+                rate_limited = is_rate_limit_error(e)
+                self.limiter.release(rate_limited=rate_limited)
+                attempt += 1
+                if not rate_limited or attempt > self.max_retries:
+                    raise
+                delay = retry_after_seconds(e)
+                if delay is None:
+                    delay = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+                    delay *= random.uniform(0.5, 1.0)
+                print(f"Rate limited; retrying batch in {delay:.1f}s (attempt {attempt}/{self.max_retries})")
+                time.sleep(delay)
+                continue
+            self.limiter.release()
+            return vectors
+
+    def iter_embed(self, batches: Iterable[Tuple[List[str], Any]]) -> Iterator[Tuple[List[List[float]], Any]]:
+        """
+        Stream (texts, payload) batches through the embedder, yielding
+        (vectors, payload) in input order. At most `max_concurrency + 1` batches
+        are pulled from `batches` ahead of the consumer, so memory stays bounded
+        however long the input is.
+        """
+        done = self._load_checkpoint()
+        resumed = 0
+        window: Deque[Tuple[Future, str, Any]] = deque()
+
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as pool:
+            def drain():
+                future, key, payload = window.popleft()
+                try:
+                    vectors = future.result()
+                except Exception:
+                    # Checkpoint whatever is still in flight before giving up
+                    for f, k, _ in window:
+                        try:
+                            self._append_checkpoint(k, f.result())
+                        except Exception:
+                            pass
+                    raise
+                self._append_checkpoint(key, vectors)
+                return vectors, payload
+
+            for texts, payload in batches:
+                key = self._batch_key(texts)
+                if not texts or key in done:
+                    resumed += 1 if texts else 0
+                    future: Future = Future()
+                    future.set_result(done.pop(key) if texts else [])
+                    window.append((future, "", payload))
+                else:
+                    window.append((pool.submit(self._embed_batch, texts), key, payload))
+                if len(window) > self.max_concurrency:
+                    yield drain()
+            while window:
+                yield drain()
+
+        if resumed:
+            print(f"Reused {resumed} embedding batches from checkpoint")
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Embed `texts`, returning vectors in input order."""
+        batches = ((texts[i:i + self.batch_size], None) for i in range(0, len(texts), self.batch_size))
+        return [v for vectors, _ in self.iter_embed(batches) for v in vectors]
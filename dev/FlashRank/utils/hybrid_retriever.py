@@ -0,0 +1,127 @@
+# hybrid_retriever.py
+
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+from pydantic import ConfigDict
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.retrievers import BaseRetriever
+from langchain.schema import Document
+if __name__ == "__main__":
+    from sparse_index import SparseIndex, content_tokens, identifier_tokens, reciprocal_rank_fusion
+    from metrics import span
+else:
+    from .sparse_index import SparseIndex, content_tokens, identifier_tokens, reciprocal_rank_fusion
+    from .metrics import span
+
+
+RETRIEVAL_MODES = ("dense", "hybrid", "auto")
+# In "auto" mode a query skips the dense search only when identifiers make up more
+# than this share of its content words; questions that merely mention one are fused
+LEXICAL_MIN_SHARE = 0.5
+
+
+def chunk_id_of(doc: Document) -> str:
+    return doc.metadata.get("chunk_id") or doc.id
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    Candidate retrieval for the reranker, combining FAISS and BM25.
+
+    - "dense":  FAISS similarity search only (the original behaviour).
+    - "hybrid": FAISS and BM25 top-k fused with reciprocal rank fusion.
+    - "auto":   like "hybrid", except that queries made up mostly of exact
+                identifiers (CAS numbers, formulas, abbreviations) that all occur in
+                the sparse index are answered from BM25 alone, skipping the query
+                embedding.
+    """
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    vectorstore: Any
+    sparse: SparseIndex
+    k: int = 20
+    mode: str = "auto"
+    rrf_k: int = 60
+
+    def is_lexical(self, query: str) -> bool:
+        """
+        True for identifier lookups such as "7732-18-5" or "CAS number of NaCl", but
+        not for questions that mention one, such as "How does UV irradiation affect PMMA?".
+        """
+        identifiers = identifier_tokens(query)
+        if not identifiers:
+            return False
+        words = content_tokens(query)
+        share = sum(word in identifiers for word in words) / max(1, len(words))
+        return share > LEXICAL_MIN_SHARE and all(self.sparse.document_frequency(t) for t in identifiers)
+
+    def search_sparse(self, query: str) -> Optional[List[Tuple[str, float]]]:
+        """BM25 hits for `query` (None in dense mode), to hand to `retrieve` as `sparse_hits`."""
+        if self.mode == "dense":
+            return None
+        with span("sparse_search"):
+            return self.sparse.search(query, self.k)
+
+    def needs_query_embedding(self, query: str, sparse_hits: Optional[List[Tuple[str, float]]]) -> bool:
+        """False when `retrieve` would answer `query` from these BM25 hits alone."""
+        if self.mode != "auto":
+            return True
+        return not (sparse_hits and self.is_lexical(query))
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        return self.retrieve(query)
+
+    def retrieve(
+        self,
+        query: str,
+        query_vector: Optional[List[float]] = None,
+        cancelled: Optional[threading.Event] = None,
+        sparse_hits: Optional[List[Tuple[str, float]]] = None,
+    ) -> List[Document]:
+        """
+        Candidates for `query`. A precomputed `query_vector` is used for the dense
+        search when given; otherwise the query is embedded only if needed. Likewise
+        `sparse_hits` from `search_sparse` saves searching BM25 again. Once
+        `cancelled` is set, no query embedding is started and no documents are returned.
+        """
+        def stopped() -> bool:
+            return cancelled is not None and cancelled.is_set()
+
+        def dense() -> List[Document]:
+            vector = query_vector
+            if vector is None:
+                with span("query_embedding"):
+                    vector = self.vectorstore.embedding_function.embed_query(query)
+            with span("vector_search"):
+                return self.vectorstore.similarity_search_by_vector(vector, k=self.k)
+
+        if self.mode == "dense":
+            return [] if stopped() else dense()
+
+        if sparse_hits is None:
+            sparse_hits = self.search_sparse(query)
+        if not self.needs_query_embedding(query, sparse_hits):
+            return self._lookup([chunk_id for chunk_id, _ in sparse_hits])
+
+        if stopped():
+            return []
+        dense_docs = dense()
+        by_id: Dict[str, Document] = {chunk_id_of(d): d for d in dense_docs}
+        fused = reciprocal_rank_fusion(
+            [list(by_id), [chunk_id for chunk_id, _ in sparse_hits]],
+            k=self.rrf_k,
+        )[:self.k]
+        missing = [i for i in fused if i not in by_id]
+        by_id.update({chunk_id_of(d): d for d in self._lookup(missing)})
+        return [by_id[i] for i in fused if i in by_id]
+
+    def _lookup(self, chunk_ids: List[str]) -> List[Document]:
+        docs = []
+        for chunk_id in chunk_ids:
+            doc = self.vectorstore.docstore.search(chunk_id)
+            if isinstance(doc, Document):
+                docs.append(doc)
+        return docs
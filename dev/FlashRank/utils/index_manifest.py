@@ -0,0 +1,119 @@
+# index_manifest.py
+
+import os
+import json
+import hashlib
+from typing import Dict, List, Any
+
+
+MANIFEST_NAME = "manifest.json"
+MANIFEST_VERSION = 1
+
+
+def file_sha256(path: str, block_size: int = 1 << 20) -> str:
+    """
+    Return the hex SHA-256 of a file's contents, reading it in blocks.
+    """
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+class IndexManifest:
+    """
+    Per-file bookkeeping stored beside the FAISS index as `<index_dir>/manifest.json`.
+
+    For every indexed Markdown file it records the content hash, the (size, mtime)
+    seen when the hash was taken, and the docstore ids of the chunks it produced.
+    The settings that shape the chunks (embedding model, chunk size/overlap) are
+    recorded too; if they change, every file counts as changed.
+    """
+
+    def __init__(self, index_dir: str, settings: Dict[str, Any]):
+        self.path = os.path.join(index_dir, MANIFEST_NAME)
+        self.settings = settings
+        self.files: Dict[str, Dict[str, Any]] = {}
+
+    def exists(self) -> bool:
+        return os.path.isfile(self.path)
+
+    def load(self) -> bool:
+        """
+        Load the manifest from disk.
+        Returns False (and leaves the manifest empty) if it is missing, unreadable,
+        or was written with different chunking/embedding settings.
+        """
+        self.files = {}
+        if not self.exists():
+            return False
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Warning: ignoring unreadable manifest {self.path}: {e}")
+            return False
+        if data.get("version") != MANIFEST_VERSION or data.get("settings") != self.settings:
+            return False
+        self.files = data.get("files", {})
+        return True
+
+    def save(self):
+        """Atomically write the manifest next to the index."""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({
+                "version": MANIFEST_VERSION,
+                "settings": self.settings,
+                "files": self.files,
+            }, f)
+        os.replace(tmp_path, self.path)
+
+    def current_hash(self, path: str) -> str:
+        """
+        Hash of `path` as it is on disk now. Reuses the recorded hash when the
+        file's size and mtime are unchanged, so a no-op refresh does not re-read
+        the whole corpus.
+        """
+        st = os.stat(path)
+        entry = self.files.get(path)
+        if entry and entry.get("size") == st.st_size and entry.get("mtime") == st.st_mtime_ns:
+            return entry["hash"]
+        return file_sha256(path)
+
+    def record(self, path: str, file_hash: str, chunk_ids: List[str]):
+        st = os.stat(path)
+        self.files[path] = {
+            "hash": file_hash,
+            "size": st.st_size,
+            "mtime": st.st_mtime_ns,
+            "chunk_ids": chunk_ids,
+        }
+
+    def forget(self, path: str) -> List[str]:
+        """Drop `path` from the manifest and return the chunk ids it owned."""
+        entry = self.files.pop(path, None)
+        return entry["chunk_ids"] if entry else []
+
+    def diff(self, current_paths: List[str]) -> Dict[str, Any]:
+        """
+        Compare the manifest with the files currently on disk.
+        Returns {"added": [...], "changed": [...], "removed": [...], "hashes": {path: hash}}.
+        """
+        hashes: Dict[str, str] = {}
+        added, changed = [], []
+        for path in current_paths:
+            try:
+                hashes[path] = self.current_hash(path)
+            except OSError as e:
+                print(f"Warning: failed to hash {path}: {e}")
+                continue
+            entry = self.files.get(path)
+            if entry is None:
+                added.append(path)
+            elif entry["hash"] != hashes[path]:
+                changed.append(path)
+        removed = [p for p in self.files if p not in hashes]
+        return {"added": added, "changed": changed, "removed": removed, "hashes": hashes}
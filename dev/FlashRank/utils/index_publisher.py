@@ -0,0 +1,180 @@
+# index_publisher.py
+
+import os
+import json
+import time
+import shutil
+import threading
+from typing import Any, Dict, List, Optional
+
+
+# Layout under an index root:
+#   versions/<version>/   complete index directories, never modified once published
+#   CURRENT               name of the version the API should serve
+#   ingest_status.json    queue depth and lag reported by ingest_daemon.py
+VERSIONS_DIR = "versions"
+CURRENT_NAME = "CURRENT"
+STATUS_NAME = "ingest_status.json"
+# Published versions kept on disk, so an API still on an older one can finish its requests
+KEEP_VERSIONS = 3
+
+
+def _write_atomic(path: str, text: str):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def versions(index_root: str) -> List[str]:
+    """Names of the version directories under `index_root`, oldest first."""
+    root = os.path.join(index_root, VERSIONS_DIR)
+    if not os.path.isdir(root):
+        return []
+    return sorted(name for name in os.listdir(root) if not name.endswith(".staging"))
+
+
+def current_version(index_root: str) -> Optional[str]:
+    try:
+        with open(os.path.join(index_root, CURRENT_NAME), "r", encoding="utf-8") as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def current_index_dir(index_root: str) -> Optional[str]:
+    """Directory of the published index, or None if nothing has been published yet."""
+    version = current_version(index_root)
+    return os.path.join(index_root, VERSIONS_DIR, version) if version else None
+
+
+def stage_version(index_root: str) -> str:
+    """
+    Create the directory for the next version, starting from a copy of the current
+    one so that building it only has to index what changed since.
+    """
+    version = time.strftime("%Y%m%d-%H%M%S")
+    existing = set(versions(index_root))
+    suffix = 1
+    name = version
+    while name in existing:
+        suffix += 1
+        name = f"{version}-{suffix}"
+    staging = os.path.join(index_root, VERSIONS_DIR, name + ".staging")
+    if os.path.isdir(staging):
+        shutil.rmtree(staging)
+    current = current_index_dir(index_root)
+    if current and os.path.isdir(current):
+        shutil.copytree(current, staging)
+    else:
+        os.makedirs(staging)
+    return staging
+
+
+def publish(index_root: str, staging: str) -> str:
+    """
+    Make a staged version the current one. The version directory is renamed
+    into place before CURRENT is replaced, so readers only ever see complete
+    versions. Returns the published directory.
+    """
+    version_dir = staging[:-len(".staging")] if staging.endswith(".staging") else staging
+    if version_dir != staging:
+        os.replace(staging, version_dir)
+    _write_atomic(os.path.join(index_root, CURRENT_NAME), os.path.basename(version_dir) + "\n")
+    prune(index_root)
+    return version_dir
+
+
+def discard(staging: str):
+    """Remove a staged version that will not be published."""
+    shutil.rmtree(staging, ignore_errors=True)
+
+
+def prune(index_root: str, keep: int = KEEP_VERSIONS):
+    current = current_version(index_root)
+    old = [v for v in versions(index_root) if v != current]
+    for version in old[:max(0, len(old) - (keep - 1))]:
+        shutil.rmtree(os.path.join(index_root, VERSIONS_DIR, version), ignore_errors=True)
+
+
+def write_status(index_root: str, status: Dict[str, Any]):
+    os.makedirs(index_root, exist_ok=True)
+    _write_atomic(os.path.join(index_root, STATUS_NAME), json.dumps(status, indent=2))
+
+
+def read_status(index_root: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(os.path.join(index_root, STATUS_NAME), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+class IndexWatcher:
+    """
+    Background thread that follows CURRENT under `index_root` and hot-swaps each
+    newly published version into a running RagReranker (see `RagReranker.swap_index`).
+    """
+
+    def __init__(self, rag, index_root: str, interval: float = 2.0):
+        self.rag = rag
+        self.index_root = index_root
+        self.interval = interval
+        self.version = None
+        if rag.index_dir and os.path.dirname(os.path.abspath(rag.index_dir)) == os.path.abspath(
+            os.path.join(index_root, VERSIONS_DIR)
+        ):
+            self.version = os.path.basename(os.path.normpath(rag.index_dir))
+        self.swaps = 0
+        self.last_swap_at: Optional[float] = None
+        self.last_swap_seconds: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> "IndexWatcher":
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="index-watcher", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def check(self) -> bool:
+        """Swap in the current version if it changed; True if a swap happened."""
+        version = current_version(self.index_root)
+        if not version or version == self.version:
+            return False
+        started = time.perf_counter()
+        try:
+            self.rag.swap_index(os.path.join(self.index_root, VERSIONS_DIR, version))
+        except Exception as e:
+            self.last_error = f"{version}: {e}"
+            print(f"Failed to load index version {version}: {e}")
+            return False
+        self.version = version
+        self.swaps += 1
+        self.last_swap_at = time.time()
+        self.last_swap_seconds = time.perf_counter() - started
+        self.last_error = None
+        print(f"Now serving index version {version} (loaded in {self.last_swap_seconds:.2f}s)")
+        return True
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.check()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "version": self.version,
+            "swaps": self.swaps,
+            "last_swap_at": self.last_swap_at,
+            "last_swap_seconds": self.last_swap_seconds,
+            "last_error": self.last_error,
+        }
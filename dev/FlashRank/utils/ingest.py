@@ -0,0 +1,78 @@
+# ingest.py
+
+import time
+import uuid
+from typing import Callable, Dict, Iterable, Iterator, List, Tuple
+from langchain.schema import Document
+
+
+# (path, content hash, chunks) for one source file
+FileChunks = Tuple[str, str, List[Document]]
+# (chunks in this batch, files whose last chunk is in or before this batch)
+ChunkBatch = Tuple[List[Document], List[Tuple[str, str, List[str]]]]
+
+
+def iter_file_chunks(
+    paths: Iterable[str],
+    hashes: Dict[str, str],
+    load_and_split: Callable[[str], List[Document]],
+) -> Iterator[FileChunks]:
+    """
+    Lazily load and split one file at a time, tagging every chunk with a fresh
+    `chunk_id`. Files that fail to load are reported and skipped.
+    """
+    for path in paths:
+        try:
+            chunks = load_and_split(path)
+        except Exception as e:
+            print(f"Warning: failed to load {path}: {e}")
+            continue
+        for chunk in chunks:
+            chunk.metadata["chunk_id"] = str(uuid.uuid4())
+        yield path, hashes[path], chunks
+
+
+def iter_batches(files: Iterable[FileChunks], batch_size: int) -> Iterator[ChunkBatch]:
+    """
+    Regroup per-file chunks into fixed-size batches. Each batch also carries the
+    files that are complete once it has been stored, i.e. whose last chunk is in
+    this batch or an earlier one, so callers can record them only when safe.
+    """
+    batch: List[Document] = []
+    completed: List[Tuple[str, str, List[str]]] = []
+    for path, file_hash, chunks in files:
+        for chunk in chunks:
+            batch.append(chunk)
+            if len(batch) >= batch_size:
+                yield batch, completed
+                batch, completed = [], []
+        completed.append((path, file_hash, [c.metadata["chunk_id"] for c in chunks]))
+    if batch or completed:
+        yield batch, completed
+
+
+class ProgressReporter:
+    """Prints file/chunk throughput at most once every `interval` seconds."""
+
+    def __init__(self, total_files: int, interval: float = 10.0):
+        self.total_files = total_files
+        self.interval = interval
+        self.files = 0
+        self.chunks = 0
+        self.start = time.monotonic()
+        self._last = self.start
+
+    def update(self, files: int, chunks: int):
+        self.files += files
+        self.chunks += chunks
+        now = time.monotonic()
+        if now - self._last >= self.interval:
+            self._last = now
+            self.report()
+
+    def report(self):
+        elapsed = max(time.monotonic() - self.start, 1e-9)
+        print(
+            f"Indexed {self.files}/{self.total_files} files, {self.chunks} chunks "
+            f"({self.chunks / elapsed:.1f} chunks/s, {elapsed:.0f}s elapsed)"
+        )
@@ -0,0 +1,285 @@
+# metrics.py
+
+import time
+import bisect
+import functools
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+from uuid import UUID
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+
+
+# Histogram bucket upper bounds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+TOKEN_BUCKETS = (16, 64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768)
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+def _format_labels(pairs: Sequence[Tuple[str, str]]) -> str:
+    if not pairs:
+        return ""
+    escaped = (
+        f'{k}="{str(v).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34)).replace(chr(10), " ")}"'
+        for k, v in pairs
+    )
+    return "{" + ",".join(escaped) + "}"
+
+
+class Histogram:
+    """A labelled Prometheus-style histogram (cumulative buckets, sum and count)."""
+
+    def __init__(self, name: str, help: str, labels: Sequence[str], buckets: Sequence[float]):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        # label values -> [per-bucket counts (+Inf last), sum, count]
+        self._series: Dict[Tuple[str, ...], List[Any]] = {}
+
+    def observe(self, value: float, **labels: str):
+        key = tuple(str(labels.get(name, "")) for name in self.labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {key: (list(counts), total, count) for key, (counts, total, count) in self._series.items()}
+        for key in sorted(series):
+            counts, total, count = series[key]
+            pairs = list(zip(self.labels, key))
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                labels = _format_labels(pairs + [("le", _format_value(bound))])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(pairs)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(pairs)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: List[Histogram] = []
+
+    def histogram(self, name: str, help: str, labels: Sequence[str], buckets: Sequence[float]) -> Histogram:
+        metric = Histogram(name, help, labels, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format."""
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+STAGE_SECONDS = REGISTRY.histogram(
+    "rag_stage_seconds", "Time spent in each stage of answering a question.", ("stage",), LATENCY_BUCKETS
+)
+LLM_TOKENS = REGISTRY.histogram(
+    "rag_llm_tokens", "Prompt and completion tokens per LLM call, by stage.", ("stage", "kind"), TOKEN_BUCKETS
+)
+REQUEST_SECONDS = REGISTRY.histogram(
+    "rag_http_request_seconds", "HTTP request latency.", ("route", "method", "status"), LATENCY_BUCKETS
+)
+
+
+class RequestTimings:
+    """Stages timed while serving one request, for a per-request breakdown."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self._lock = threading.Lock()
+        # (stage, offset from request start, seconds)
+        self.spans: List[Tuple[str, float, float]] = []
+        self.tokens: Dict[str, Dict[str, int]] = {}
+
+    def add(self, stage: str, started: float, seconds: float):
+        with self._lock:
+            self.spans.append((stage, started - self.start, seconds))
+
+    def add_tokens(self, stage: str, prompt: int, completion: int):
+        with self._lock:
+            counts = self.tokens.setdefault(stage, {"calls": 0, "prompt": 0, "completion": 0})
+            counts["calls"] += 1
+            counts["prompt"] += prompt
+            counts["completion"] += completion
+
+    def summary(self) -> Dict[str, Any]:
+        """
+        Total time, per-stage totals and the individual spans in start order, in ms.
+        Stages nest (e.g. query_embedding runs inside retrieve), so totals overlap.
+        """
+        with self._lock:
+            spans = sorted(self.spans, key=lambda s: s[1])
+            tokens = {stage: dict(counts) for stage, counts in self.tokens.items()}
+        stages: Dict[str, Dict[str, float]] = {}
+        for stage, _, seconds in spans:
+            entry = stages.setdefault(stage, {"ms": 0.0, "count": 0})
+            entry["ms"] += seconds * 1000
+            entry["count"] += 1
+        for entry in stages.values():
+            entry["ms"] = round(entry["ms"], 3)
+        return {
+            "total_ms": round((time.perf_counter() - self.start) * 1000, 3),
+            "stages": stages,
+            "spans": [
+                {"stage": stage, "start_ms": round(offset * 1000, 3), "ms": round(seconds * 1000, 3)}
+                for stage, offset, seconds in spans
+            ],
+            "tokens": tokens,
+        }
+
+
+_current_timings: contextvars.ContextVar = contextvars.ContextVar("rag_request_timings", default=None)
+
+
+@contextmanager
+def collect_timings() -> Iterator[RequestTimings]:
+    """Collect the stages timed in this context (and work bound to it) into a RequestTimings."""
+    timings = RequestTimings()
+    token = _current_timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _current_timings.reset(token)
+
+
+def record(stage: str, started: float, seconds: float):
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    timings = _current_timings.get()
+    if timings is not None:
+        timings.add(stage, started, seconds)
+
+
+def record_tokens(stage: str, prompt: int, completion: int):
+    LLM_TOKENS.observe(prompt, stage=stage, kind="prompt")
+    LLM_TOKENS.observe(completion, stage=stage, kind="completion")
+    timings = _current_timings.get()
+    if timings is not None:
+        timings.add_tokens(stage, prompt, completion)
+
+
+@contextmanager
+def span(stage: str):
+    """Time the enclosed block as `stage`."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, started, time.perf_counter() - started)
+
+
+def bind_context(fn: Callable) -> Callable:
+    """
+    `fn` bound to a copy of the caller's context, so stages it times on a pool
+    thread are added to the caller's request. Bind once per submitted call.
+    """
+    return functools.partial(contextvars.copy_context().run, fn)
+
+
+def stage_config(stage: str) -> Dict[str, Any]:
+    """Run config naming the stage an LLM call belongs to (see LLMMetricsCallback)."""
+    return {"metadata": {"stage": stage}}
+
+
+def _usage(response: LLMResult) -> Optional[Tuple[int, int]]:
+    """(prompt, completion) tokens reported by the API for a call, if any."""
+    for generations in response.generations:
+        for generation in generations:
+            message = getattr(generation, "message", None)
+            usage = getattr(message, "usage_metadata", None)
+            if usage:
+                return usage.get("input_tokens", 0), usage.get("output_tokens", 0)
+    usage = (response.llm_output or {}).get("token_usage")
+    if usage:
+        return usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0)
+    return None
+
+
+class LLMMetricsCallback(BaseCallbackHandler):
+    """
+    Times every call of the chat model it is attached to and records its token
+    counts. The stage comes from the call's `metadata["stage"]` (see stage_config),
+    else `stage`. Token counts fall back to `counter` estimates when the API does
+    not report usage (e.g. while streaming).
+
+    With `agent_node` set, only calls made by that LangGraph node are recorded,
+    as "agent_planning" when the model asked for tools and "agent_answer"
+    otherwise; tool runs are timed as "agent_tool".
+    """
+
+    def __init__(self, stage: str = "llm_generation", counter=None, agent_node: Optional[str] = None):
+        self.stage = stage
+        self.counter = counter
+        self.agent_node = agent_node
+        # run id -> (stage, start time, prompt token estimate)
+        self._runs: Dict[UUID, Tuple[Optional[str], float, int]] = {}
+
+    def _estimate(self, text: str) -> int:
+        return self.counter.count(text) if self.counter is not None and text else 0
+
+    def on_chat_model_start(self, serialized, messages, *, run_id: UUID, metadata=None, **kwargs):
+        metadata = metadata or {}
+        if self.agent_node is not None:
+            if metadata.get("langgraph_node") != self.agent_node:
+                return
+            stage = None  # decided by the response
+        else:
+            stage = metadata.get("stage", self.stage)
+        prompt = sum(
+            self._estimate(m.content) for batch in messages for m in batch if isinstance(m.content, str)
+        )
+        self._runs[run_id] = (stage, time.perf_counter(), prompt)
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs):
+        run = self._runs.pop(run_id, None)
+        if run is None:
+            return
+        stage, started, prompt_estimate = run
+        text = ""
+        calls_tools = False
+        for generations in response.generations:
+            for generation in generations:
+                text += generation.text or ""
+                message = getattr(generation, "message", None)
+                calls_tools = calls_tools or bool(getattr(message, "tool_calls", None))
+        if stage is None:
+            stage = "agent_planning" if calls_tools else "agent_answer"
+        record(stage, started, time.perf_counter() - started)
+        usage = _usage(response)
+        prompt, completion = usage if usage else (prompt_estimate, self._estimate(text))
+        record_tokens(stage, prompt, completion)
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs):
+        self._runs.pop(run_id, None)
+
+    def on_tool_start(self, serialized, input_str, *, run_id: UUID, **kwargs):
+        if self.agent_node is not None:
+            self._runs[run_id] = ("agent_tool", time.perf_counter(), 0)
+
+    def on_tool_end(self, output, *, run_id: UUID, **kwargs):
+        run = self._runs.pop(run_id, None)
+        if run is not None:
+            record(run[0], run[1], time.perf_counter() - run[1])
+
+    def on_tool_error(self, error: BaseException, *, run_id: UUID, **kwargs):
+        self._runs.pop(run_id, None)
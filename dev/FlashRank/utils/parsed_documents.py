@@ -0,0 +1,66 @@
+# parsed_documents.py
+
+import os
+import json
+from typing import Any, Dict, Iterator, List, Tuple
+
+
+# Consolidated parser output: one JSON record per page plus a byte-offset index
+PARSED_JSONL_NAME = "document.jsonl"
+PARSED_INDEX_NAME = "document.index.json"
+PAGE_SEPARATOR = "\n\n"
+# Structure-aware chunks written by the Docling parser beside document.md
+# (see DoclingTest/utils/structure_chunker.py); indexed as-is instead of the Markdown
+STRUCTURED_CHUNKS_NAME = "chunks.jsonl"
+
+
+def index_path(jsonl_path: str) -> str:
+    return os.path.join(os.path.dirname(jsonl_path), PARSED_INDEX_NAME)
+
+
+def read_index(jsonl_path: str) -> Dict[str, Any]:
+    with open(index_path(jsonl_path), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def read_page(jsonl_path: str, page: int) -> Dict[str, Any]:
+    """The record of one page, read directly at its offset from the index."""
+    for entry in read_index(jsonl_path)["pages"]:
+        if entry["page"] == page:
+            with open(jsonl_path, "rb") as f:
+                f.seek(entry["offset"])
+                return json.loads(f.read(entry["length"]))
+    raise KeyError(f"No page {page} in {jsonl_path}")
+
+
+def iter_pages(jsonl_path: str) -> Iterator[Dict[str, Any]]:
+    with open(jsonl_path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def document_text(jsonl_path: str) -> Tuple[str, List[Tuple[int, int]]]:
+    """
+    The document's Markdown (each page's `md`, or its `text` when there is no
+    Markdown) joined into one string, and (start offset, page number) for each page.
+    """
+    parts: List[str] = []
+    starts: List[Tuple[int, int]] = []
+    offset = 0
+    for record in iter_pages(jsonl_path):
+        content = record.get("md") or record.get("text") or ""
+        if parts:
+            offset += len(PAGE_SEPARATOR)
+        starts.append((offset, record.get("page")))
+        parts.append(content)
+        offset += len(content)
+    return PAGE_SEPARATOR.join(parts), starts
+
+
+def iter_structured_chunks(path: str) -> Iterator[Dict[str, Any]]:
+    """Chunk records {"text", "headings", "type", "pages"} from a parser's chunks.jsonl."""
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
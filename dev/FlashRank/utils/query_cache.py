@@ -0,0 +1,108 @@
+# query_cache.py
+
+import re
+import time
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional
+from langchain_core.embeddings import Embeddings
+
+
+def normalize_query(query: str) -> str:
+    """
+    Cache key form of a query: Unicode-normalised, whitespace collapsed and
+    trailing punctuation dropped. Case is kept, since it is meaningful in
+    formulas and element symbols (CO vs Co).
+    """
+    text = unicodedata.normalize("NFKC", query)
+    text = re.sub(r"\s+", " ", text).strip()
+    return text.rstrip("?!. ")
+
+
+class LRUCache:
+    """
+    Thread-safe in-memory cache with LRU eviction beyond `max_size` entries and an
+    optional time-to-live in seconds. Counts hits and misses for `stats()`.
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: Optional[float] = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and self.ttl and time.monotonic() - entry[1] > self.ttl:
+                del self._data[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: Hashable, value: Any):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._data[key] = (value, time.monotonic())
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def pop(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._data.pop(key, None)
+            return None if entry is None else entry[0]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict[str, Optional[float]]:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else None,
+            "entries": len(self._data),
+        }
+
+
+class QueryEmbeddingCache(Embeddings):
+    """
+    Keeps recent query embeddings in memory, keyed by normalised query text, in
+    front of another Embeddings object. Document embeddings pass straight through.
+    """
+
+    def __init__(self, embedding: Embeddings, cache: LRUCache):
+        self.embedding = embedding
+        self.cache = cache
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embedding.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        key = normalize_query(text)
+        vector = self.cache.get(key)
+        if vector is None:
+            vector = self.embedding.embed_query(text)
+            self.cache.put(key, vector)
+        return vector
+
+    async def aembed_query(self, text: str) -> List[float]:
+        key = normalize_query(text)
+        vector = self.cache.get(key)
+        if vector is None:
+            vector = await self.embedding.aembed_query(text)
+            self.cache.put(key, vector)
+        return vector
@@ -1,8 +1,17 @@
 # rag_reranker.py
 
 import os
+import json
+import asyncio
+import hashlib
+import functools
+import threading
+from bisect import bisect_right
 from glob import glob
-from typing import List, Tuple
+from concurrent.futures import ThreadPoolExecutor
+import faiss
+import numpy as np
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple
 from langchain.document_loaders import TextLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain.vectorstores import FAISS
@@ -10,16 +19,73 @@ from langchain.vectorstores import FAISS
 from langchain_openai import OpenAIEmbeddings
 from langchain.retrievers import ContextualCompressionRetriever
 from langchain.chat_models import ChatOpenAI
-from langchain.schema import Document, SystemMessage, HumanMessage, AIMessage
+from langchain.schema import BaseMessage, Document, SystemMessage, HumanMessage, AIMessage
 from langchain_community.document_compressors import FlashrankRerank
+if __name__ == "__main__":
+    from index_manifest import IndexManifest
+    from embedding_cache import CachedEmbeddings
+    from embedding_pipeline import BatchEmbedder
+    from ingest import iter_file_chunks, iter_batches, ProgressReporter
+    from ann_index import (
+        INDEX_TYPES, AnnFAISS, build_index, needs_training,
+        recall_report, resolve_index_params, set_search_params,
+    )
+    from chunk_store import has_chunk_store, mmap_flags, open_chunk_store, write_chunk_store
+    from sparse_index import SparseIndex
+    from hybrid_retriever import RETRIEVAL_MODES, HybridRetriever, chunk_id_of
+    from query_cache import LRUCache, QueryEmbeddingCache, normalize_query
+    from batched_rerank import BatchedFlashrankRerank, shared_batcher
+    from session_store import DEFAULT_SESSION, SessionStore
+    from token_budget import TokenCounter, split_history, summary_message, summary_prompt
+    from context_packer import pack_context
+    from parsed_documents import PARSED_JSONL_NAME, STRUCTURED_CHUNKS_NAME, document_text, iter_structured_chunks
+    from metrics import LLMMetricsCallback, bind_context, span, stage_config
+else:
+    from .index_manifest import IndexManifest
+    from .embedding_cache import CachedEmbeddings
+    from .embedding_pipeline import BatchEmbedder
+    from .ingest import iter_file_chunks, iter_batches, ProgressReporter
+    from .ann_index import (
+        INDEX_TYPES, AnnFAISS, build_index, needs_training,
+        recall_report, resolve_index_params, set_search_params,
+    )
+    from .chunk_store import has_chunk_store, mmap_flags, open_chunk_store, write_chunk_store
+    from .sparse_index import SparseIndex
+    from .hybrid_retriever import RETRIEVAL_MODES, HybridRetriever, chunk_id_of
+    from .query_cache import LRUCache, QueryEmbeddingCache, normalize_query
+    from .batched_rerank import BatchedFlashrankRerank, shared_batcher
+    from .session_store import DEFAULT_SESSION, SessionStore
+    from .token_budget import TokenCounter, split_history, summary_message, summary_prompt
+    from .context_packer import pack_context
+    from .parsed_documents import PARSED_JSONL_NAME, STRUCTURED_CHUNKS_NAME, document_text, iter_structured_chunks
+    from .metrics import LLMMetricsCallback, bind_context, span, stage_config
 
 
 class RagReranker:
     """
     A RAG wrapper with FlashRank reranking over Markdown files.
-    Automatically loads an existing FAISS index from `<docs_dir>/.idx` if valid;
-    otherwise builds the index from all `.md` files under `docs_dir`.
-    Maintains conversation history and provides methods to answer queries and share source documents.
+    Automatically loads an existing FAISS index from `./.idx` if valid, then
+    incrementally syncs it with the `.md` files under `docs_dir` (and parser output
+    consolidated into `document.jsonl` files, whose chunks carry a `page`): a manifest of
+    per-file content hashes kept beside the index decides which files are embedded
+    again (new/changed) and which files' chunks are removed (changed/deleted).
+    Call `refresh()` to pick up later changes without restarting.
+    `index_type` selects exact ("flat") or approximate (IVF/HNSW/PQ/SQ) search;
+    see `ann_index.py` for the tunables accepted in `index_params`.
+    A BM25 index over the same chunks is kept beside the FAISS index; `retrieval_mode`
+    picks dense, fused (reciprocal rank fusion) or "auto" candidate retrieval, where
+    identifier-heavy queries skip the query embedding call entirely.
+    Query embeddings and final answers are cached in memory (LRU, answers also
+    expire after `query_cache_ttl` seconds); answers are dropped whenever the index changes.
+    With `rerank_batching`, FlashRank scoring goes through a process-wide batcher
+    that merges the candidates of concurrent requests into one inference call.
+    The `a*` methods are async versions for ASGI serving: LLM and embedding calls are
+    awaited and index search/reranking run on a pool of `cpu_workers` threads.
+    Maintains per-session conversation history (see `session_store.py`) and provides methods
+    to answer queries and share source documents. History keeps only the question text of
+    past turns (not their retrieved context), and once it exceeds `history_token_budget`
+    tokens the older turns are replaced by an LLM-written summary. Reranked chunks are
+    packed into at most `context_token_budget` tokens of context (see `context_packer.py`).
     """
 
     def __init__(
@@ -30,91 +96,460 @@ class RagReranker:
         k: int = 20,
         chunk_size: int = 1000,
         chunk_overlap: int = 200,
+        embedding_cache_path: Optional[str] = "./.embedding_cache.sqlite",
+        embed_batch_size: int = 256,
+        embed_concurrency: int = 4,
+        index_type: str = "flat",
+        index_params: Optional[Dict[str, int]] = None,
+        retrieval_mode: str = "auto",
+        query_cache_size: int = 1024,
+        query_cache_ttl: Optional[float] = 3600.0,
+        rerank_batching: bool = True,
+        rerank_batch_wait_ms: float = 5.0,
+        cpu_workers: Optional[int] = None,
+        session_store: Optional[SessionStore] = None,
+        history_token_budget: int = 2000,
+        context_token_budget: int = 3000,
+        index_dir: Optional[str] = None,
+        sync_on_load: bool = True,
     ):
         self.docs_dir = docs_dir
-        self.index_dir = os.path.join('./', ".idx")
+        self.index_dir = index_dir or os.path.join('./', ".idx")
         self.embedding_model = embedding_model
         self.llm_model = llm_model
         self.k = k
         self.chunk_size = chunk_size
         self.chunk_overlap = chunk_overlap
-        # Initialize history as list of Messages
-        self.history: List[HumanMessage | AIMessage] = []
+        if index_type not in INDEX_TYPES:
+            raise ValueError(f"index_type must be one of {INDEX_TYPES}, got {index_type!r}")
+        self.index_type = index_type
+        self.index_params = resolve_index_params(index_params)
+        if retrieval_mode not in RETRIEVAL_MODES:
+            raise ValueError(f"retrieval_mode must be one of {RETRIEVAL_MODES}, got {retrieval_mode!r}")
+        self.retrieval_mode = retrieval_mode
+        # Embedded batches held back until there are enough vectors to train an ANN index
+        self._train_buffer: List[Tuple[List[Document], np.ndarray]] = []
+        # Conversation histories, one per session id
+        self.sessions = session_store or SessionStore()
+        # History sent with each question is kept under this many tokens
+        self.history_token_budget = history_token_budget
+        self.token_counter = TokenCounter(llm_model)
+        # Retrieved context is merged, deduplicated and packed into this many tokens
+        self.context_token_budget = context_token_budget
 
-        # Prepare embeddings
+        # Prepare embeddings, consulting the on-disk cache before calling the API
         self.embedding = OpenAIEmbeddings(model=embedding_model)
+        if embedding_cache_path:
+            self.embedding = CachedEmbeddings(
+                self.embedding,
+                embedding_cache_path,
+                model_name=embedding_model,
+            )
+        # Recent query embeddings, keyed by normalised query text
+        self.query_embedding_cache = LRUCache(max_size=query_cache_size)
+        self.embedding = QueryEmbeddingCache(self.embedding, self.query_embedding_cache)
+        # (answer, sources) keyed by normalised query, retrieved chunk ids and history
+        self.answer_cache = LRUCache(max_size=query_cache_size, ttl=query_cache_ttl)
+        # Bumped whenever refresh() changes the indexed chunks
+        self.index_version = 0
+        # Batched, concurrent, rate-limit-aware embedding for index builds.
+        # The embedding cache already persists every finished batch, so the
+        # pipeline only keeps its own checkpoint when the cache is disabled.
+        self.embedder = BatchEmbedder(
+            self.embedding,
+            batch_size=embed_batch_size,
+            max_concurrency=embed_concurrency,
+            checkpoint_path=None if embedding_cache_path else os.path.join(self.index_dir, "embedding_checkpoint.jsonl"),
+        )
+        self.splitter = RecursiveCharacterTextSplitter(
+            chunk_size=self.chunk_size,
+            chunk_overlap=self.chunk_overlap,
+            # Chunk offsets let the context packer merge neighbouring chunks
+            add_start_index=True,
+        )
+        if rerank_batching:
+            # One cross-encoder per process; concurrent requests are scored together
+            self.reranker = BatchedFlashrankRerank(batcher=shared_batcher(max_wait_ms=rerank_batch_wait_ms))
+        else:
+            self.reranker = FlashrankRerank()
+
+        # Bounded pool for the blocking search/rerank steps of the async methods.
+        # Rerank calls mostly wait on the shared batcher, so allow two per core.
+        self._cpu_pool = ThreadPoolExecutor(
+            max_workers=cpu_workers or 2 * (os.cpu_count() or 2),
+            thread_name_prefix="rag-cpu",
+        )
+
+        # Per-file content hashes and chunk ids, stored beside the index
+        self.manifest = IndexManifest(self.index_dir, {
+            "embedding_model": self.embedding_model,
+            "chunk_size": self.chunk_size,
+            "chunk_overlap": self.chunk_overlap,
+            "index_type": self.index_type,
+        })
+        self.vectorstore = None
+        # BM25 index over the same chunks, kept in sync by refresh()
+        os.makedirs(self.index_dir, exist_ok=True)
+        self.sparse = SparseIndex(os.path.join(self.index_dir, "sparse.sqlite"))
 
         # Paths for index files
-        faiss_path = os.path.join(self.index_dir, "index.faiss")
-        pkl_path = os.path.join(self.index_dir, "index.pkl")
-        has_valid_index = os.path.isdir(self.index_dir) and os.path.isfile(faiss_path) and os.path.isfile(pkl_path)
+        self.faiss_path = os.path.join(self.index_dir, "index.faiss")
+        self.pkl_path = os.path.join(self.index_dir, "index.pkl")
+        has_valid_index = os.path.isdir(self.index_dir) and os.path.isfile(self.faiss_path) and (
+            has_chunk_store(self.index_dir) or os.path.isfile(self.pkl_path)
+        )
+        # True while the FAISS index is a read-only memory map of index.faiss
+        self._index_mmapped = False
 
         if has_valid_index:
-            # Load existing index
-            self.vectorstore = FAISS.load_local(
-                self.index_dir,
+            if self.manifest.load():
+                # Load existing index; refresh() below only touches what changed
+                self.vectorstore = self._load_vectorstore()
+            elif not self.manifest.exists() and self.index_type == "flat":
+                # Index from before manifests existed: adopt it as-is
+                self.vectorstore = self._load_vectorstore()
+                self._adopt_legacy_index()
+            else:
+                print("Index was built with different settings; rebuilding.")
+
+        if has_valid_index and self.vectorstore is not None and not sync_on_load:
+            # Serve the index as saved; it is kept current by whoever publishes it
+            self.retriever = self._build_retriever(self.vectorstore, self.sparse)
+        else:
+            # Bring the index up to date with the Markdown files on disk
+            self.refresh()
+
+        # LLM; every call is timed and its tokens counted (see metrics.py)
+        self.llm = ChatOpenAI(
+            model_name=llm_model,
+            temperature=0.0,
+            callbacks=[LLMMetricsCallback("llm_generation", self.token_counter)],
+        )
+
+    def _load_vectorstore(self, index_dir: Optional[str] = None) -> FAISS:
+        """
+        Open the saved index. Vectors are memory-mapped and chunk text is read
+        lazily from the chunk store, so loading is cheap and worker processes share
+        pages. Indexes saved in the old pickle format are loaded in full and
+        rewritten in the new format by the next save.
+        """
+        index_dir = index_dir or self.index_dir
+        store_cls = FAISS if self.index_type == "flat" else AnnFAISS
+        if has_chunk_store(index_dir):
+            index = faiss.read_index(os.path.join(index_dir, "index.faiss"), mmap_flags(self.index_type))
+            docstore, index_to_docstore_id = open_chunk_store(index_dir)
+            vectorstore = store_cls(self.embedding, index, docstore, index_to_docstore_id)
+            self._index_mmapped = True
+        else:
+            vectorstore = store_cls.load_local(
+                index_dir,
                 self.embedding,
                 allow_dangerous_deserialization=True
             )
+            self._index_mmapped = False
+        set_search_params(vectorstore.index, self.index_params)
+        return vectorstore
+
+    def _make_writable(self):
+        """Swap a memory-mapped index for an in-memory copy before modifying it."""
+        if self.vectorstore is not None and self._index_mmapped:
+            self.vectorstore.index = faiss.read_index(self.faiss_path)
+            set_search_params(self.vectorstore.index, self.index_params)
+            self._index_mmapped = False
+
+    def _save_index(self):
+        """Write the FAISS index and chunk store, then reopen them memory-mapped."""
+        os.makedirs(self.index_dir, exist_ok=True)
+        tmp_path = self.faiss_path + ".tmp"
+        faiss.write_index(self.vectorstore.index, tmp_path)
+        os.replace(tmp_path, self.faiss_path)
+        write_chunk_store(self.index_dir, self.vectorstore.docstore, self.vectorstore.index_to_docstore_id)
+        if os.path.isfile(self.pkl_path):
+            os.remove(self.pkl_path)
+        self.vectorstore = self._load_vectorstore()
+
+    def _adopt_legacy_index(self):
+        """
+        Build a manifest for an index saved without one, assuming (as the old
+        load-if-present behaviour did) that it reflects the files currently on disk.
+        """
+        by_source: Dict[str, List[str]] = {}
+        for doc_id in self.vectorstore.index_to_docstore_id.values():
+            doc = self.vectorstore.docstore.search(doc_id)
+            source = doc.metadata.get("source", "") if isinstance(doc, Document) else ""
+            by_source.setdefault(source, []).append(doc_id)
+        for path, chunk_ids in by_source.items():
+            if os.path.isfile(path):
+                self.manifest.record(path, self.manifest.current_hash(path), chunk_ids)
+            else:
+                # Owner is gone; leave an entry so refresh() removes its chunks
+                self.manifest.files[path] = {"hash": "", "chunk_ids": chunk_ids}
+
+    def _markdown_paths(self) -> List[str]:
+        paths = []
+        for name in ("*.md", PARSED_JSONL_NAME, STRUCTURED_CHUNKS_NAME):
+            paths.extend(glob(os.path.join(self.docs_dir, "**", name), recursive=True))
+        # Where the parser left structured chunks, they replace the Markdown beside them
+        chunked_dirs = {os.path.dirname(p) for p in paths if os.path.basename(p) == STRUCTURED_CHUNKS_NAME}
+        return sorted(
+            p for p in paths
+            if os.path.isfile(p) and not (p.endswith(".md") and os.path.dirname(p) in chunked_dirs)
+        )
+
+    def _load_and_split(self, path: str) -> List[Document]:
+        if os.path.basename(path) == PARSED_JSONL_NAME:
+            return self._load_and_split_pages(path)
+        if os.path.basename(path) == STRUCTURED_CHUNKS_NAME:
+            return self._load_structured_chunks(path)
+        loader = TextLoader(path, encoding="utf-8")
+        loaded = loader.load()
+        for doc in loaded:
+            doc.metadata["source"] = path
+        return self.splitter.split_documents(loaded)
+
+    def _load_and_split_pages(self, path: str) -> List[Document]:
+        # Split the whole document, so chunks may span pages; each is tagged with the page it starts on
+        text, page_starts = document_text(path)
+        chunks = self.splitter.split_documents([Document(page_content=text, metadata={"source": path})])
+        offsets = [start for start, _ in page_starts]
+        for chunk in chunks:
+            i = bisect_right(offsets, chunk.metadata.get("start_index", 0)) - 1
+            chunk.metadata["page"] = page_starts[max(i, 0)][1]
+        return chunks
+
+    def _load_structured_chunks(self, path: str) -> List[Document]:
+        # Already split along sections and tables; the heading path is kept in the text
+        # so that both the embedding and the reranker see which section a chunk is from
+        chunks = []
+        for record in iter_structured_chunks(path):
+            section = " > ".join(record.get("headings") or [])
+            metadata = {"source": path, "section": section, "chunk_type": record.get("type", "text")}
+            if record.get("pages"):
+                metadata["page"] = record["pages"][0]
+            text = f"{section}\n\n{record['text']}" if section else record["text"]
+            chunks.append(Document(page_content=text, metadata=metadata))
+        return chunks
+
+    def _add_embeddings(self, chunks: List[Document], vectors: List[List[float]]):
+        if self.vectorstore is None and self.index_type != "flat":
+            # ANN indexes are created (and trained) from the first embedded batches
+            self._train_buffer.append((chunks, np.asarray(vectors, dtype=np.float32)))
+            buffered = sum(len(v) for _, v in self._train_buffer)
+            if buffered >= self.index_params["train_size"] or not needs_training(self.index_type):
+                self._flush_train_buffer()
+            return
+        text_embeddings = zip([c.page_content for c in chunks], vectors)
+        metadatas = [c.metadata for c in chunks]
+        ids = [c.metadata["chunk_id"] for c in chunks]
+        if self.vectorstore is None:
+            self.vectorstore = FAISS.from_embeddings(text_embeddings, self.embedding, metadatas=metadatas, ids=ids)
         else:
-            # Build index from Markdown files
-            docs: List[Document] = []
-            pattern = os.path.join(docs_dir, "**", "*.md")
-            for path in glob(pattern, recursive=True):
-                if os.path.isfile(path):
-                    try:
-                        loader = TextLoader(path, encoding="utf-8")
-                        loaded = loader.load()
-                        for doc in loaded:
-                            doc.metadata["source"] = path
-                        docs.extend(loaded)
-                    except Exception as e:
-                        print(f"Warning: failed to load {path}: {e}")
-
-            if not docs:
-                raise ValueError(f"No Markdown documents found under {docs_dir}")
-
-            splitter = RecursiveCharacterTextSplitter(
-                chunk_size=self.chunk_size,
-                chunk_overlap=self.chunk_overlap
-            )
-            texts = splitter.split_documents(docs)
+            self.vectorstore.add_embeddings(text_embeddings, metadatas=metadatas, ids=ids)
+        self.sparse.add(chunks)
+
+    def _flush_train_buffer(self):
+        buffered, self._train_buffer = self._train_buffer, []
+        if not buffered:
+            return
+        train_vectors = np.concatenate([v for _, v in buffered])
+        index = build_index(self.index_type, train_vectors, self.index_params)
+        self.vectorstore = AnnFAISS.from_index(self.embedding, index)
+        for chunks, vectors in buffered:
+            self._add_embeddings(chunks, vectors)
+
+    def _rebuild_sparse(self, batch_size: int = 1000):
+        """(Re)build the BM25 index from every chunk in the vector store."""
+        print("Building sparse index from the vector store")
+        self.sparse.clear()
+        batch: List[Document] = []
+        for chunk_id in list(self.vectorstore.index_to_docstore_id.values()):
+            doc = self.vectorstore.docstore.search(chunk_id)
+            if not isinstance(doc, Document):
+                continue
+            batch.append(Document(page_content=doc.page_content, metadata={**doc.metadata, "chunk_id": chunk_id}))
+            if len(batch) >= batch_size:
+                self.sparse.add(batch)
+                batch = []
+        self.sparse.add(batch)
+
+    def refresh(self) -> Dict[str, int]:
+        """
+        Synchronise the index with the Markdown files under `docs_dir`.
+        Only new or changed files are chunked and embedded; chunks from changed or
+        deleted files are removed. The index and manifest are saved if anything changed.
+        Returns counts of added/changed/removed files and added/removed chunks.
+        """
+        diff = self.manifest.diff(self._markdown_paths())
+        added, changed, removed = diff["added"], diff["changed"], diff["removed"]
 
-            if not texts:
-                raise ValueError("No text chunks created; check chunk_size and chunk_overlap values.")
+        if (added or changed or removed) and self.vectorstore is not None:
+            self._make_writable()
 
-            self.vectorstore = FAISS.from_documents(texts, self.embedding)
-            os.makedirs(self.index_dir, exist_ok=True)
-            self.vectorstore.save_local(self.index_dir)
+        # Drop chunks owned by files that changed or disappeared
+        stale_ids: List[str] = []
+        for path in changed + removed:
+            stale_ids.extend(self.manifest.forget(path))
+        if stale_ids and self.vectorstore is not None:
+            present = set(self.vectorstore.index_to_docstore_id.values())
+            stale_ids = [i for i in stale_ids if i in present]
+            if stale_ids:
+                self.vectorstore.delete(stale_ids)
+                self.sparse.delete(stale_ids)
+        if self.vectorstore is None:
+            self.sparse.clear()
 
-        # Setup retriever + reranker
-        base_retriever = self.vectorstore.as_retriever(search_kwargs={"k": self.k})
-        reranker = FlashrankRerank()
-        self.retriever = ContextualCompressionRetriever(
+        # Stream new or changed files through load -> split -> embed -> add,
+        # holding only a bounded number of chunk batches in memory at a time
+        to_index = added + changed
+        progress = ProgressReporter(len(to_index))
+        batches = iter_batches(
+            iter_file_chunks(to_index, diff["hashes"], self._load_and_split),
+            self.embedder.batch_size,
+        )
+        embedded = self.embedder.iter_embed(
+            ([c.page_content for c in chunks], (chunks, completed)) for chunks, completed in batches
+        )
+        added_chunks = 0
+        for vectors, (chunks, completed) in embedded:
+            if chunks:
+                self._add_embeddings(chunks, vectors)
+                added_chunks += len(chunks)
+            for path, file_hash, chunk_ids in completed:
+                self.manifest.record(path, file_hash, chunk_ids)
+            progress.update(len(completed), len(chunks))
+        self._flush_train_buffer()
+        if to_index:
+            progress.report()
+
+        if self.vectorstore is None:
+            if not self.manifest.files:
+                raise ValueError(f"No Markdown documents found under {self.docs_dir}")
+            raise ValueError("No text chunks created; check chunk_size and chunk_overlap values.")
+
+        if len(self.sparse) != len(self.vectorstore.index_to_docstore_id):
+            self._rebuild_sparse()
+
+        if to_index or stale_ids or not self.manifest.exists() or not has_chunk_store(self.index_dir):
+            self._save_index()
+            self.manifest.save()
+        self.embedder.clear_checkpoint()
+
+        self.retriever = self._build_retriever(self.vectorstore, self.sparse)
+
+        if added or changed or removed:
+            # Cached answers may cite chunks that no longer exist
+            self.answer_cache.clear()
+            self.index_version += 1
+
+        stats = {
+            "added_files": len(added),
+            "changed_files": len(changed),
+            "removed_files": len(removed),
+            "added_chunks": added_chunks,
+            "removed_chunks": len(stale_ids),
+        }
+        if added or changed or removed:
+            print(f"Index refreshed: {stats}")
+        return stats
+
+    def _build_retriever(self, vectorstore: FAISS, sparse: SparseIndex) -> ContextualCompressionRetriever:
+        """Retriever (dense, sparse or fused) + reranker over the given indexes."""
+        base_retriever = HybridRetriever(
+            vectorstore=vectorstore,
+            sparse=sparse,
+            k=self.k,
+            mode=self.retrieval_mode,
+        )
+        return ContextualCompressionRetriever(
             base_retriever=base_retriever,
-            base_compressor=reranker
+            base_compressor=self.reranker
         )
 
-        # LLM
-        self.llm = ChatOpenAI(model_name=llm_model, temperature=0.0)
+    def swap_index(self, index_dir: str):
+        """
+        Start serving the index saved in `index_dir` (see `index_publisher.py`).
+        The new index is opened next to the current one and the retriever is
+        replaced by a single assignment, so requests already running finish on
+        the old index and no request waits for the load.
+        """
+        manifest = IndexManifest(index_dir, self.manifest.settings)
+        if not manifest.load() or not has_chunk_store(index_dir):
+            raise ValueError(f"No index built with the current settings in {index_dir}")
+        vectorstore = self._load_vectorstore(index_dir)
+        sparse = SparseIndex(os.path.join(index_dir, "sparse.sqlite"))
+        retriever = self._build_retriever(vectorstore, sparse)
+
+        self.index_dir = index_dir
+        self.faiss_path = os.path.join(index_dir, "index.faiss")
+        self.pkl_path = os.path.join(index_dir, "index.pkl")
+        self.manifest, self.vectorstore, self.sparse = manifest, vectorstore, sparse
+        self._index_mmapped = True
+        self.retriever = retriever
+        # Cached answers may cite chunks that no longer exist
+        self.answer_cache.clear()
+        self.index_version += 1
 
-    def get_reranked(self, query: str) -> List[Document]:
+    def recall_report(self, n_queries: int = 200, sweep: Optional[List[int]] = None) -> List[Dict[str, float]]:
         """
-        Retrieve and rerank top-k documents for the query.
-        Returns a list of Document objects.
+        Compare the configured index against exact flat search over the same chunks,
+        reporting recall@k and per-query latency for each nprobe/efSearch in `sweep`.
+        Chunk vectors come from the embedding cache, so this costs no API calls
+        for an index built with the cache enabled.
         """
-        return self.retriever.invoke(query)
+        order = sorted(self.vectorstore.index_to_docstore_id)
+        texts = [
+            self.vectorstore.docstore.search(self.vectorstore.index_to_docstore_id[i]).page_content
+            for i in order
+        ]
+        vectors = np.asarray(self.embedder.embed_documents(texts), dtype=np.float32)
+        rows = recall_report(self.vectorstore, vectors, n_queries=n_queries, k=self.k, sweep=sweep)
+        print(f"Recall@{self.k} of {self.index_type} vs flat over {len(texts)} chunks:")
+        for row in rows:
+            setting = f"{row['param']}={row['value']}: " if row["param"] != "-" else ""
+            print(
+                f"  {setting}recall={row['recall']:.3f} "
+                f"ann={row['ann_ms']:.3f}ms/query flat={row['flat_ms']:.3f}ms/query"
+            )
+        return rows
 
-    def answer_with_sources(self, query: str) -> Tuple[str, List[str]]:
+    def get_reranked(self, query: str, cancelled: Optional[threading.Event] = None) -> List[Document]:
         """
-        Answer the query by retrieving, reranking, and passing context to the LLM.
-        Includes conversation history so that follow-up questions retain context.
-        Returns a tuple of (answer_text, list_of_source_paths).
+        Retrieve and rerank top-k documents for the query.
+        Returns a list of Document objects.
+
+        `cancelled` lets a caller abandon a retrieval already running on another
+        thread: once it is set, the remaining stages (query embedding, search,
+        reranking) are skipped and [] is returned.
         """
-        # Retrieve docs
-        docs = self.get_reranked(query)
-        context = "\n\n".join(d.page_content for d in docs)
+        retriever = self.retriever
+        if cancelled is None:
+            with span("retrieve"):
+                docs = retriever.base_retriever.invoke(query)
+        else:
+            if cancelled.is_set():
+                return []
+            with span("retrieve"):
+                docs = retriever.base_retriever.retrieve(query, cancelled=cancelled)
+            if cancelled.is_set():
+                return []
+        with span("rerank"):
+            return retriever.base_compressor.compress_documents(docs, query)
+
+    def _prepare_answer(
+        self, query: str, docs: List[Document], history: List[BaseMessage]
+    ) -> Tuple[HumanMessage, List[str], tuple]:
+        """Returns (user message, sources, answer cache key) for the query and its reranked docs."""
+        # Merge overlapping neighbours, drop repeats and fit the token budget
+        with span("context_packing"):
+            context, docs = pack_context(docs, self.token_counter, self.context_token_budget)
+
+        user_msg = HumanMessage(content=f"Context:\n{context}\n\nQuestion: {query}")
+        sources = [doc.metadata.get("source", "") for doc in docs]
+        # Same question over the same chunks and history can reuse the earlier answer
+        cache_key = (normalize_query(query), tuple(chunk_id_of(d) for d in docs), self._history_key(history))
+        return user_msg, sources, cache_key
 
+    def _answer_messages(self, user_msg: HumanMessage, history: List[BaseMessage]) -> List[BaseMessage]:
         # Build message sequence: system prompt, history, new query
         messages = [
             SystemMessage(
@@ -126,24 +561,173 @@ class RagReranker:
             )
         ]
         # Append conversation history
-        messages.extend(self.history)
+        messages.extend(history)
         # User's new question
-        user_msg = HumanMessage(content=f"Context:\n{context}\n\nQuestion: {query}")
         messages.append(user_msg)
+        return messages
+
+    def answer_with_sources(self, query: str, session_id: str = DEFAULT_SESSION) -> Tuple[str, List[str]]:
+        """
+        Answer the query by retrieving, reranking, and passing context to the LLM.
+        Includes the session's conversation history so that follow-up questions retain context.
+        Returns a tuple of (answer_text, list_of_source_paths).
+        """
+        history = self._session_history(session_id)
+        user_msg, sources, cache_key = self._prepare_answer(query, self.get_reranked(query), history)
+        cached = self.answer_cache.get(cache_key)
+        if cached is not None:
+            answer = cached[0]
+            self.sessions.append(session_id, HumanMessage(content=query), AIMessage(content=answer))
+            return answer, sources
 
         # Call LLM
-        ai_resp: AIMessage = self.llm(messages)
+        ai_resp: AIMessage = self.llm(self._answer_messages(user_msg, history))
 
-        # Update history: user and assistant
-        self.history.append(user_msg)
-        self.history.append(ai_resp)
+        # Update history: question (without its context) and answer
+        self.sessions.append(session_id, HumanMessage(content=query), ai_resp)
 
-        # Extract sources
-        sources = [doc.metadata.get("source", "") for doc in docs]
+        self.answer_cache.put(cache_key, (ai_resp.content, tuple(sources)))
         return ai_resp.content, sources
 
-    def clear_history(self):
+    def stream_answer(self, query: str, session_id: str = DEFAULT_SESSION) -> Iterator[Tuple[str, Any]]:
+        """
+        Streaming form of `answer_with_sources`. Yields (event, data) pairs:
+        ("sources", list_of_source_paths) once retrieval and reranking are done,
+        ("token", text) for each piece of the answer as the LLM produces it, and
+        finally ("answer", {"answer": ..., "sources": ...}).
+        """
+        history = self._session_history(session_id)
+        user_msg, sources, cache_key = self._prepare_answer(query, self.get_reranked(query), history)
+        yield "sources", sources
+
+        cached = self.answer_cache.get(cache_key)
+        if cached is not None:
+            answer = cached[0]
+            yield "token", answer
+        else:
+            parts: List[str] = []
+            for chunk in self.llm.stream(self._answer_messages(user_msg, history)):
+                if chunk.content:
+                    parts.append(chunk.content)
+                    yield "token", chunk.content
+            answer = "".join(parts)
+            self.answer_cache.put(cache_key, (answer, tuple(sources)))
+
+        self.sessions.append(session_id, HumanMessage(content=query), AIMessage(content=answer))
+        yield "answer", {"answer": answer, "sources": sources}
+
+    async def _run_cpu(self, fn, *args):
+        """Run blocking FAISS/BM25/rerank work on the bounded CPU pool."""
+        return await asyncio.get_running_loop().run_in_executor(self._cpu_pool, bind_context(fn), *args)
+
+    async def aget_reranked(self, query: str, cancelled: Optional[threading.Event] = None) -> List[Document]:
+        """
+        Async `get_reranked`: the query embedding is awaited, while the index
+        search and reranking run on the bounded CPU pool. `cancelled` works as
+        in `get_reranked`, also for a stage already handed to the pool.
+        """
+        def stopped() -> bool:
+            return cancelled is not None and cancelled.is_set()
+
+        retriever, reranker = self.retriever.base_retriever, self.reranker
+        query_vector = None
+        with span("retrieve"):
+            # BM25 runs once; its hits decide whether the query needs embedding at all
+            sparse_hits = await self._run_cpu(retriever.search_sparse, query)
+            if stopped():
+                return []
+            if retriever.needs_query_embedding(query, sparse_hits):
+                with span("query_embedding"):
+                    query_vector = await self.embedding.aembed_query(query)
+            docs = await self._run_cpu(functools.partial(
+                retriever.retrieve, query, query_vector, cancelled=cancelled, sparse_hits=sparse_hits
+            ))
+        if stopped():
+            return []
+        with span("rerank"):
+            return await self._run_cpu(reranker.compress_documents, docs, query)
+
+    async def aanswer_with_sources(self, query: str, session_id: str = DEFAULT_SESSION) -> Tuple[str, List[str]]:
+        """Async `answer_with_sources`; the LLM call is awaited rather than blocking a thread."""
+        history = await self._asession_history(session_id)
+        user_msg, sources, cache_key = self._prepare_answer(query, await self.aget_reranked(query), history)
+        cached = self.answer_cache.get(cache_key)
+        if cached is not None:
+            answer = cached[0]
+        else:
+            ai_resp: AIMessage = await self.llm.ainvoke(self._answer_messages(user_msg, history))
+            answer = ai_resp.content
+            self.answer_cache.put(cache_key, (answer, tuple(sources)))
+        self.sessions.append(session_id, HumanMessage(content=query), AIMessage(content=answer))
+        return answer, sources
+
+    async def astream_answer(self, query: str, session_id: str = DEFAULT_SESSION) -> AsyncIterator[Tuple[str, Any]]:
+        """Async `stream_answer`, yielding the same (event, data) pairs."""
+        history = await self._asession_history(session_id)
+        user_msg, sources, cache_key = self._prepare_answer(query, await self.aget_reranked(query), history)
+        yield "sources", sources
+
+        cached = self.answer_cache.get(cache_key)
+        if cached is not None:
+            answer = cached[0]
+            yield "token", answer
+        else:
+            parts: List[str] = []
+            async for chunk in self.llm.astream(self._answer_messages(user_msg, history)):
+                if chunk.content:
+                    parts.append(chunk.content)
+                    yield "token", chunk.content
+            answer = "".join(parts)
+            self.answer_cache.put(cache_key, (answer, tuple(sources)))
+
+        self.sessions.append(session_id, HumanMessage(content=query), AIMessage(content=answer))
+        yield "answer", {"answer": answer, "sources": sources}
+
+    def _session_history(self, session_id: str) -> List[BaseMessage]:
+        """The session's history, first compacted to fit the token budget if needed."""
+        history = self.sessions.get(session_id)
+        split = split_history(history, self.history_token_budget, self.token_counter)
+        if split is None:
+            return history
+        older, recent = split
+        half = self.history_token_budget // 2
+        summary = self.llm.invoke(summary_prompt(older, half), config=stage_config("history_summary")).content
+        history = [summary_message(summary, self.token_counter, half), *recent]
+        self.sessions.replace(session_id, history)
+        return history
+
+    async def _asession_history(self, session_id: str) -> List[BaseMessage]:
+        history = self.sessions.get(session_id)
+        split = split_history(history, self.history_token_budget, self.token_counter)
+        if split is None:
+            return history
+        older, recent = split
+        half = self.history_token_budget // 2
+        summary = (await self.llm.ainvoke(summary_prompt(older, half), config=stage_config("history_summary"))).content
+        history = [summary_message(summary, self.token_counter, half), *recent]
+        self.sessions.replace(session_id, history)
+        return history
+
+    @staticmethod
+    def _history_key(history: List[BaseMessage]) -> str:
+        if not history:
+            return ""
+        turns = [(m.type, m.content) for m in history]
+        return hashlib.sha256(json.dumps(turns).encode("utf-8")).hexdigest()
+
+    def cache_stats(self) -> Dict[str, Dict[str, Optional[float]]]:
+        """Hit/miss counts and hit rates of the query embedding and answer caches."""
+        stats = {
+            "query_embeddings": self.query_embedding_cache.stats(),
+            "answers": self.answer_cache.stats(),
+        }
+        inner = self.embedding.embedding
+        if isinstance(inner, CachedEmbeddings):
+            stats["embedding_store"] = inner.stats()
+        return stats
+
+    def clear_history(self, session_id: str = DEFAULT_SESSION):
         """
-        Clear the conversation history.
+        Clear the conversation history of a session.
         """
-        self.history = []
\ No newline at end of file
+        self.sessions.clear(session_id)
\ No newline at end of file
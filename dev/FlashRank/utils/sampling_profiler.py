@@ -0,0 +1,117 @@
+# sampling_profiler.py
+
+import sys
+import time
+import threading
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+
+# Leaf frames of threads that are waiting rather than working; their samples are dropped
+_IDLE_FRAMES = {
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("selectors.py", "select"),
+    ("queue.py", "get"),
+    ("socketserver.py", "serve_forever"),
+    ("socket.py", "accept"),
+    ("socket.py", "readinto"),
+    ("thread.py", "_worker"),
+    ("base_events.py", "_run_once"),
+}
+
+
+def _filename(path: str) -> str:
+    return path.replace("\\", "/").rsplit("/", 1)[-1]
+
+
+class SamplingProfiler:
+    """
+    Low-overhead statistical profiler for a running server. A background thread
+    records the stack of every other thread each `interval` seconds; stacks with
+    the same frames are counted together. Nothing is added to the profiled code,
+    so it can stay on in production at a coarse interval.
+
+    `folded()` returns the counts in the folded format read by flamegraph.pl and
+    speedscope; `top()` the functions most often at the leaf (working or blocked on I/O).
+    """
+
+    def __init__(self, interval: float = 0.01, max_depth: int = 64):
+        self.interval = interval
+        self.max_depth = max_depth
+        self.samples = 0
+        self.started_at: Optional[float] = None
+        self._stacks: Counter = Counter()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> "SamplingProfiler":
+        if self._thread is None:
+            self._stop.clear()
+            self.started_at = time.time()
+            self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def reset(self):
+        with self._lock:
+            self._stacks.clear()
+            self.samples = 0
+            self.started_at = time.time()
+
+    def _stack(self, frame) -> Optional[Tuple[str, ...]]:
+        code = frame.f_code
+        if (_filename(code.co_filename), code.co_name) in _IDLE_FRAMES:
+            return None
+        names: List[str] = []
+        while frame is not None and len(names) < self.max_depth:
+            code = frame.f_code
+            names.append(f"{code.co_name} ({_filename(code.co_filename)}:{code.co_firstlineno})")
+            frame = frame.f_back
+        return tuple(reversed(names))
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            stacks = []
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = self._stack(frame)
+                if stack:
+                    stacks.append(stack)
+            with self._lock:
+                self._stacks.update(stacks)
+                self.samples += 1
+
+    def folded(self) -> str:
+        """One `frame;frame;...;leaf count` line per distinct stack, root first."""
+        with self._lock:
+            stacks = list(self._stacks.items())
+        return "".join(f"{';'.join(stack)} {count}\n" for stack, count in sorted(stacks))
+
+    def top(self, n: int = 20) -> Dict[str, object]:
+        """The `n` functions seen most often, by samples at the leaf (self) and anywhere in the stack (total)."""
+        own: Counter = Counter()
+        total: Counter = Counter()
+        with self._lock:
+            stacks = list(self._stacks.items())
+            samples = self.samples
+        for stack, count in stacks:
+            own[stack[-1]] += count
+            for name in set(stack):
+                total[name] += count
+        return {
+            "samples": samples,
+            "interval_ms": self.interval * 1000,
+            "since": self.started_at,
+            "self": [{"function": name, "samples": count} for name, count in own.most_common(n)],
+            "total": [{"function": name, "samples": count} for name, count in total.most_common(n)],
+        }
@@ -0,0 +1,188 @@
+# session_store.py
+
+import os
+import sys
+import json
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+from langchain.schema import AIMessage, BaseMessage, HumanMessage, SystemMessage
+
+
+DEFAULT_SESSION = "default"
+# Rough per-message cost beyond the text itself (message object, list slot)
+MESSAGE_OVERHEAD = 256
+
+_MESSAGE_TYPES = {"human": HumanMessage, "ai": AIMessage, "system": SystemMessage}
+
+
+def _message_bytes(message: BaseMessage) -> int:
+    return sys.getsizeof(message.content) + MESSAGE_OVERHEAD
+
+
+class _Session:
+    __slots__ = ("messages", "size", "last_used")
+
+    def __init__(self, messages: List[BaseMessage], last_used: float):
+        self.messages = messages
+        self.size = sum(_message_bytes(m) for m in messages)
+        self.last_used = last_used
+
+
+class SessionStore:
+    """
+    Conversation histories keyed by session id, bounded in every direction:
+    each session keeps its last `max_messages` messages, sessions idle for longer
+    than `idle_timeout` seconds are dropped, and the least recently used sessions
+    are evicted once there are more than `max_sessions` or their estimated size
+    exceeds `max_memory_mb`. With `persist_path`, histories are also written to a
+    SQLite file, so sessions evicted for memory (or lost to a restart) are
+    reloaded on their next request until they reach the idle timeout.
+    """
+
+    def __init__(
+        self,
+        max_sessions: int = 10000,
+        idle_timeout: float = 3600.0,
+        max_memory_mb: float = 256.0,
+        max_messages: int = 40,
+        persist_path: Optional[str] = None,
+    ):
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.max_bytes = int(max_memory_mb * 1024 * 1024)
+        self.max_messages = max_messages
+        self.persist_path = persist_path
+        self.evictions = 0
+        self.expirations = 0
+        self._sessions: "OrderedDict[str, _Session]" = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self._last_disk_sweep = 0.0
+
+        self._conn = None
+        if persist_path:
+            parent = os.path.dirname(os.path.abspath(persist_path))
+            os.makedirs(parent, exist_ok=True)
+            self._conn = sqlite3.connect(persist_path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                " session_id TEXT PRIMARY KEY, messages TEXT NOT NULL, last_used REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS sessions_last_used ON sessions (last_used)")
+            self._conn.commit()
+
+    def get(self, session_id: str) -> List[BaseMessage]:
+        """A copy of the session's messages (empty for unknown or expired sessions)."""
+        with self._lock:
+            session = self._touch(session_id, create=False)
+            return list(session.messages) if session is not None else []
+
+    def append(self, session_id: str, *messages: BaseMessage):
+        with self._lock:
+            session = self._touch(session_id, create=True)
+            session.messages.extend(messages)
+            self._size -= session.size
+            excess = len(session.messages) - self.max_messages
+            if excess > 0:
+                # A leading summary of older turns outlives the turns after it
+                first = 1 if session.messages[0].type == "system" else 0
+                del session.messages[first:first + excess]
+            session.size = sum(_message_bytes(m) for m in session.messages)
+            self._size += session.size
+            self._save(session_id, session)
+            self._evict()
+
+    def replace(self, session_id: str, messages: List[BaseMessage]):
+        """Overwrite a session's history, e.g. with a compacted version."""
+        with self._lock:
+            session = self._touch(session_id, create=True)
+            self._size -= session.size
+            session.messages = list(messages[-self.max_messages:])
+            session.size = sum(_message_bytes(m) for m in session.messages)
+            self._size += session.size
+            self._save(session_id, session)
+            self._evict()
+
+    def clear(self, session_id: str):
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+            if session is not None:
+                self._size -= session.size
+            if self._conn is not None:
+                self._conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+                self._conn.commit()
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "sessions": len(self._sessions),
+            "memory_bytes": self._size,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+    def _touch(self, session_id: str, create: bool) -> Optional[_Session]:
+        now = time.time()
+        self._expire(now)
+        session = self._sessions.get(session_id)
+        if session is None:
+            session = self._load(session_id, now)
+            if session is None:
+                if not create:
+                    return None
+                session = _Session([], now)
+            self._sessions[session_id] = session
+            self._size += session.size
+        session.last_used = now
+        self._sessions.move_to_end(session_id)
+        return session
+
+    def _expire(self, now: float):
+        # Sessions are in last-used order, so idle ones are all at the front
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if now - session.last_used <= self.idle_timeout:
+                break
+            self._sessions.popitem(last=False)
+            self._size -= session.size
+            self.expirations += 1
+        if self._conn is not None and now - self._last_disk_sweep > 60:
+            self._last_disk_sweep = now
+            self._conn.execute("DELETE FROM sessions WHERE last_used < ?", (now - self.idle_timeout,))
+            self._conn.commit()
+
+    def _evict(self):
+        # Keep the session just used, even if it alone exceeds the budget
+        while len(self._sessions) > 1 and (
+            len(self._sessions) > self.max_sessions or self._size > self.max_bytes
+        ):
+            _, session = self._sessions.popitem(last=False)
+            self._size -= session.size
+            self.evictions += 1
+
+    def _save(self, session_id: str, session: _Session):
+        if self._conn is None:
+            return
+        payload = json.dumps([(m.type, m.content) for m in session.messages])
+        self._conn.execute(
+            "INSERT OR REPLACE INTO sessions (session_id, messages, last_used) VALUES (?, ?, ?)",
+            (session_id, payload, session.last_used),
+        )
+        self._conn.commit()
+
+    def _load(self, session_id: str, now: float) -> Optional[_Session]:
+        if self._conn is None:
+            return None
+        row = self._conn.execute(
+            "SELECT messages, last_used FROM sessions WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        if row is None or now - row[1] > self.idle_timeout:
+            return None
+        turns: List[Tuple[str, str]] = json.loads(row[0])
+        return _Session([_MESSAGE_TYPES.get(t, HumanMessage)(content=c) for t, c in turns], row[1])
@@ -0,0 +1,155 @@
+# sparse_index.py
+
+import re
+import math
+import sqlite3
+import threading
+from collections import Counter
+from typing import Dict, Iterable, List, Tuple
+from langchain.schema import Document
+
+
+# CAS registry numbers (e.g. 50-00-0), formulas with element counts (C6H12O6,
+# H2SO4), and upper-case abbreviations (PMMA, HDPE, PET) are matched as whole tokens.
+CAS_RE = re.compile(r"\b\d{2,7}-\d{2}-\d\b")
+FORMULA_RE = re.compile(r"\b(?:[A-Z][a-z]?\d*){2,}\b")
+ABBREV_RE = re.compile(r"\b[A-Z][A-Z0-9]{1,9}\b")
+TOKEN_RE = re.compile(r"[A-Za-z0-9]+(?:[-.][A-Za-z0-9]+)*")
+
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it its of on or that the this "
+    "to was were what when where which who why with how do does did can about tell me".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Lower-cased tokens for BM25. Hyphenated and dotted tokens such as CAS numbers
+    are kept whole, and their parts are indexed as well.
+    """
+    tokens: List[str] = []
+    for match in TOKEN_RE.finditer(text):
+        token = match.group().lower()
+        if token in STOPWORDS:
+            continue
+        tokens.append(token)
+        if "-" in token or "." in token:
+            tokens.extend(p for p in re.split(r"[-.]", token) if p and p not in STOPWORDS)
+    return tokens
+
+
+def content_tokens(text: str) -> List[str]:
+    """Lower-cased words of `text` other than stopwords, identifiers kept whole."""
+    return [t for t in (m.group().lower() for m in TOKEN_RE.finditer(text)) if t not in STOPWORDS]
+
+
+def identifier_tokens(query: str) -> List[str]:
+    """Exact identifiers in the query: CAS numbers, formulas and abbreviations."""
+    found = set(m.group() for m in CAS_RE.finditer(query))
+    for m in FORMULA_RE.finditer(query):
+        # Require a digit or at least two capitals so ordinary words don't count
+        if any(c.isdigit() for c in m.group()) or sum(c.isupper() for c in m.group()) >= 2:
+            found.add(m.group())
+    found.update(m.group() for m in ABBREV_RE.finditer(query))
+    return sorted(t.lower() for t in found)
+
+
+class SparseIndex:
+    """
+    BM25 inverted index over chunk text, stored in a single SQLite file next to
+    the FAISS index and keyed by the same chunk ids, so it can be updated
+    incrementally alongside it.
+    """
+
+    def __init__(self, path: str, k1: float = 1.5, b: float = 0.75, max_df_ratio: float = 0.5):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self.max_df_ratio = max_df_ratio
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS postings ("
+            " term TEXT NOT NULL, chunk_id TEXT NOT NULL, tf INTEGER NOT NULL,"
+            " PRIMARY KEY (term, chunk_id)) WITHOUT ROWID"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS postings_chunk ON postings (chunk_id)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS chunks (chunk_id TEXT PRIMARY KEY, length INTEGER NOT NULL)"
+        )
+        self._conn.commit()
+        self._load_stats()
+
+    def _load_stats(self):
+        self.n_docs, total = self._conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(length), 0) FROM chunks"
+        ).fetchone()
+        self.avg_len = total / self.n_docs if self.n_docs else 0.0
+
+    def __len__(self) -> int:
+        return self.n_docs
+
+    def add(self, chunks: Iterable[Document]):
+        postings: List[Tuple[str, str, int]] = []
+        lengths: List[Tuple[str, int]] = []
+        for chunk in chunks:
+            chunk_id = chunk.metadata["chunk_id"]
+            counts = Counter(tokenize(chunk.page_content))
+            lengths.append((chunk_id, sum(counts.values())))
+            postings.extend((term, chunk_id, tf) for term, tf in counts.items())
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO chunks (chunk_id, length) VALUES (?, ?)", lengths)
+            self._conn.executemany("INSERT OR REPLACE INTO postings (term, chunk_id, tf) VALUES (?, ?, ?)", postings)
+            self._conn.commit()
+            self._load_stats()
+
+    def delete(self, chunk_ids: List[str]):
+        with self._lock:
+            rows = [(i,) for i in chunk_ids]
+            self._conn.executemany("DELETE FROM postings WHERE chunk_id = ?", rows)
+            self._conn.executemany("DELETE FROM chunks WHERE chunk_id = ?", rows)
+            self._conn.commit()
+            self._load_stats()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM postings")
+            self._conn.execute("DELETE FROM chunks")
+            self._conn.commit()
+            self._load_stats()
+
+    def document_frequency(self, term: str) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM postings WHERE term = ?", (term,)).fetchone()[0]
+
+    def search(self, query: str, k: int) -> List[Tuple[str, float]]:
+        """Top-k (chunk_id, BM25 score) pairs for `query`."""
+        if not self.n_docs:
+            return []
+        scores: Dict[str, float] = {}
+        with self._lock:
+            for term in set(tokenize(query)):
+                rows = self._conn.execute(
+                    "SELECT p.chunk_id, p.tf, c.length FROM postings p "
+                    "JOIN chunks c ON c.chunk_id = p.chunk_id WHERE p.term = ?",
+                    (term,),
+                ).fetchall()
+                df = len(rows)
+                # Very common terms barely move BM25 scores but dominate the cost
+                if not df or (self.n_docs > 100 and df > self.max_df_ratio * self.n_docs):
+                    continue
+                idf = math.log(1 + (self.n_docs - df + 0.5) / (df + 0.5))
+                for chunk_id, tf, length in rows:
+                    norm = self.k1 * (1 - self.b + self.b * length / (self.avg_len or 1.0))
+                    scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+        return sorted(scores.items(), key=lambda kv: kv[1], reverse=True)[:k]
+
+
+def reciprocal_rank_fusion(rankings: List[List[str]], k: int = 60) -> List[str]:
+    """Fuse ranked id lists with RRF: score(d) = sum over lists of 1 / (k + rank)."""
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, start=1):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores, key=lambda d: scores[d], reverse=True)
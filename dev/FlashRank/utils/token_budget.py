@@ -0,0 +1,86 @@
+# token_budget.py
+
+from typing import List, Optional, Tuple
+from langchain.schema import BaseMessage, HumanMessage, SystemMessage
+
+
+SUMMARY_PREFIX = "Summary of the earlier conversation: "
+# Per-message framing tokens in the chat format (role, separators)
+MESSAGE_TOKENS = 4
+
+
+class TokenCounter:
+    """
+    Counts tokens with the tiktoken encoding of `model`. If the encoding cannot be
+    loaded (unknown model, or no network to fetch it), falls back to an estimate
+    of four characters per token.
+    """
+
+    def __init__(self, model: str = "gpt-4o"):
+        self.encoding = None
+        try:
+            import tiktoken
+            try:
+                self.encoding = tiktoken.encoding_for_model(model)
+            except KeyError:
+                self.encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception as e:
+            print(f"Warning: no tokenizer for {model} ({e}); estimating token counts.")
+
+    def count(self, text: str) -> int:
+        if self.encoding is not None:
+            return len(self.encoding.encode(text, disallowed_special=()))
+        return (len(text) + 3) // 4
+
+    def count_messages(self, messages: List[BaseMessage]) -> int:
+        return sum(self.count(m.content) + MESSAGE_TOKENS for m in messages)
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        if self.encoding is not None:
+            tokens = self.encoding.encode(text, disallowed_special=())
+            return text if len(tokens) <= max_tokens else self.encoding.decode(tokens[:max_tokens])
+        return text[:max_tokens * 4]
+
+
+def split_history(
+    history: List[BaseMessage], budget: int, counter: TokenCounter
+) -> Optional[Tuple[List[BaseMessage], List[BaseMessage]]]:
+    """
+    None if `history` fits in `budget` tokens. Otherwise (older, recent), where
+    `recent` is the longest run of whole turns at the end that fits in half the
+    budget, leaving the other half for a summary of `older`.
+    """
+    if counter.count_messages(history) <= budget:
+        return None
+    recent: List[BaseMessage] = []
+    used = 0
+    for message in reversed(history):
+        cost = counter.count_messages([message])
+        if used + cost > budget // 2:
+            break
+        recent.insert(0, message)
+        used += cost
+    # Start on a user turn so no answer is separated from its question
+    while recent and recent[0].type != "human":
+        recent.pop(0)
+    return history[:len(history) - len(recent)], recent
+
+
+def summary_prompt(older: List[BaseMessage], max_tokens: int) -> List[BaseMessage]:
+    """Prompt asking the LLM to fold `older` (possibly starting with a previous summary) into one summary."""
+    transcript = "\n".join(
+        f"{'User' if m.type == 'human' else 'Assistant' if m.type == 'ai' else 'Earlier'}: {m.content}"
+        for m in older
+    )
+    return [
+        SystemMessage(content=(
+            "Summarize the conversation below for use as context in later turns. "
+            "Keep the facts, compound names, numbers and sources discussed and any open questions. "
+            f"Use at most {max_tokens} tokens."
+        )),
+        HumanMessage(content=transcript),
+    ]
+
+
+def summary_message(summary: str, counter: TokenCounter, max_tokens: int) -> SystemMessage:
+    return SystemMessage(content=SUMMARY_PREFIX + counter.truncate(summary.strip(), max_tokens))
@@ -1,7 +1,8 @@
 # File: main.py
 
+import asyncio
 import argparse
-from utils.llama_parser import batch_parse
+from utils.llama_parser import OUTPUT_FORMATS, abatch_parse, batch_parse
 
 def main():
     """
@@ -20,10 +21,43 @@ def main():
         default="parsed_outputs",  # default output root folder name
         help="Root directory where parsed outputs will be stored (default: './parsed_outputs')"
     )
+    parser.add_argument(
+        "--max_in_flight",
+        type=int,
+        default=0,
+        help="Parse up to this many PDFs concurrently with one shared client (default: 0, one at a time)"
+    )
+    parser.add_argument(
+        "--max_retries",
+        type=int,
+        default=3,
+        help="Retries per PDF in concurrent mode, with exponential backoff (default: 3)"
+    )
+    parser.add_argument(
+        "--base_url",
+        default=None,
+        help="LlamaParse API base URL, e.g. http://localhost:8002 for mock_parse_server.py"
+    )
+    parser.add_argument(
+        "--output_format",
+        choices=OUTPUT_FORMATS,
+        default="files",
+        help="'files': per-page Markdown/text/JSON files; 'jsonl': one page-record stream with an offset index (default: files)"
+    )
     args = parser.parse_args()
 
     # Call the batch_parse function from llama_parser
-    batch_parse(args.input_dir, args.output_root)
+    if args.max_in_flight > 0:
+        asyncio.run(abatch_parse(
+            args.input_dir,
+            args.output_root,
+            max_in_flight=args.max_in_flight,
+            max_retries=args.max_retries,
+            base_url=args.base_url,
+            output_format=args.output_format,
+        ))
+    else:
+        batch_parse(args.input_dir, args.output_root, base_url=args.base_url, output_format=args.output_format)
     print(f"Finished parsing all PDFs from '{args.input_dir}' into '{args.output_root}'.")
 
 if __name__ == "__main__":
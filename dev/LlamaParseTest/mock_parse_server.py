@@ -0,0 +1,181 @@
+# mock_parse_server.py
+#
+# Local stand-in for the LlamaParse API, for exercising batch parsing offline.
+# Jobs finish after a configurable delay with deterministic pages derived from
+# the uploaded file; the server can also reject uploads with 429s, fail jobs,
+# and cap how many jobs run at once. /stats reports what happened.
+#
+# Usage:
+#   python mock_parse_server.py --latency-ms 2000 --failure-prob 0.1 --max-concurrency 8
+#   LLAMA_API_KEY=test python main.py --input_dir input_pdfs --output_root parsed_outputs \
+#       --max_in_flight 8 --base_url http://localhost:8002
+
+import time
+import uuid
+import base64
+import random
+import hashlib
+import argparse
+import threading
+from flask import Flask, Response, request, jsonify
+
+app = Flask(__name__)
+
+CONFIG = {
+    "latency_ms": 1000.0,
+    "pages": 3,
+    "failure_prob": 0.0,
+    "rate_limit_prob": 0.0,
+    "max_concurrency": 0,
+}
+STATS = {"uploads": 0, "rate_limited": 0, "failed_jobs": 0, "completed_jobs": 0, "max_running": 0}
+JOBS = {}
+_lock = threading.Lock()
+
+# 1x1 transparent PNG served for every image
+_PNG = base64.b64decode(
+    "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAQAAAC1HAwCAAAAC0lEQVR42mNkYAAAAAYAAjCB0C8AAAAASUVORK5CYII="
+)
+# Both the current and the older API prefixes are answered
+_PREFIXES = ("/api/v1/parsing", "/api/parsing")
+
+
+def _route(rule, **options):
+    def register(view):
+        for prefix in _PREFIXES:
+            app.add_url_rule(prefix + rule, endpoint=prefix + rule, view_func=view, **options)
+        return view
+    return register
+
+
+def _running(now: float) -> int:
+    return sum(1 for job in JOBS.values() if job["ready_at"] > now)
+
+
+def _pages(job_id: str, file_name: str, digest: str) -> list:
+    pages = []
+    for number in range(1, CONFIG["pages"] + 1):
+        heading = f"{file_name} page {number}"
+        body = f"Mock content {digest[:12]} for page {number}."
+        pages.append({
+            "page": number,
+            "text": f"{heading}\n{body}",
+            "md": f"# {heading}\n\n{body}",
+            "width": 612.0,
+            "height": 792.0,
+            "images": [{
+                "name": f"page_{number}.jpg",
+                "height": 792.0, "width": 612.0, "x": 0.0, "y": 0.0,
+                "original_width": 612, "original_height": 792,
+                "type": "full_page_screenshot",
+            }],
+            "items": [
+                {"type": "heading", "lvl": 1, "value": heading, "md": f"# {heading}",
+                 "bBox": {"x": 72.0, "y": 72.0, "w": 468.0, "h": 24.0}},
+                {"type": "text", "value": body, "md": body,
+                 "bBox": {"x": 72.0, "y": 108.0, "w": 468.0, "h": 14.0}},
+            ],
+            "layout": [
+                {"label": "title", "confidence": 0.98, "isLikelyNoise": False,
+                 "bBox": {"x": 72.0, "y": 72.0, "w": 468.0, "h": 24.0}},
+                {"label": "text", "confidence": 0.95, "isLikelyNoise": False,
+                 "bBox": {"x": 72.0, "y": 108.0, "w": 468.0, "h": 14.0}},
+            ],
+            "structuredData": None,
+            "noStructuredContent": False,
+            "noTextContent": False,
+            "links": [],
+            "status": "OK",
+        })
+    return pages
+
+
+@_route("/upload", methods=["POST"])
+def upload():
+    upload = request.files.get("file")
+    if upload is None:
+        return jsonify({"detail": "No file uploaded"}), 400
+    content = upload.read()
+    now = time.monotonic()
+    with _lock:
+        STATS["uploads"] += 1
+        over_capacity = CONFIG["max_concurrency"] and _running(now) >= CONFIG["max_concurrency"]
+        if over_capacity or random.random() < CONFIG["rate_limit_prob"]:
+            STATS["rate_limited"] += 1
+            return jsonify({"detail": "Rate limit exceeded (mock server)"}), 429, {"Retry-After": "1"}
+        job_id = str(uuid.uuid4())
+        JOBS[job_id] = {
+            "file_name": upload.filename or "document.pdf",
+            "digest": hashlib.sha256(content).hexdigest(),
+            "ready_at": now + CONFIG["latency_ms"] / 1000.0,
+            "failed": random.random() < CONFIG["failure_prob"],
+            "counted": False,
+        }
+        STATS["max_running"] = max(STATS["max_running"], _running(now))
+    return jsonify({"id": job_id, "status": "PENDING"})
+
+
+@_route("/job/<job_id>", methods=["GET"])
+def job_status(job_id):
+    with _lock:
+        job = JOBS.get(job_id)
+        if job is None:
+            return jsonify({"detail": "Job not found"}), 404
+        if time.monotonic() < job["ready_at"]:
+            return jsonify({"id": job_id, "status": "PENDING"})
+        if not job["counted"]:
+            job["counted"] = True
+            STATS["failed_jobs" if job["failed"] else "completed_jobs"] += 1
+    if job["failed"]:
+        return jsonify({"id": job_id, "status": "ERROR", "error_code": "MOCK_FAILURE",
+                        "error_message": "Injected failure (mock server)"})
+    return jsonify({"id": job_id, "status": "SUCCESS"})
+
+
+@_route("/job/<job_id>/result/<result_type>", methods=["GET"])
+def job_result(job_id, result_type):
+    job = JOBS.get(job_id)
+    if job is None or job["failed"] or time.monotonic() < job["ready_at"]:
+        return jsonify({"detail": "Result not available"}), 404
+    pages = _pages(job_id, job["file_name"], job["digest"])
+    metadata = {"credits_used": len(pages), "job_pages": len(pages), "job_is_cache_hit": False}
+    if result_type == "json":
+        return jsonify({"pages": pages, "job_metadata": metadata})
+    if result_type == "markdown":
+        return jsonify({"markdown": "\n\n---\n\n".join(p["md"] for p in pages), "job_metadata": metadata})
+    if result_type == "text":
+        return jsonify({"text": "\n\n".join(p["text"] for p in pages), "job_metadata": metadata})
+    return jsonify({"detail": f"Unknown result type {result_type}"}), 404
+
+
+@_route("/job/<job_id>/result/image/<name>", methods=["GET"])
+def job_image(job_id, name):
+    if job_id not in JOBS:
+        return jsonify({"detail": "Job not found"}), 404
+    return Response(_PNG, mimetype="image/png")
+
+
+@app.route("/stats", methods=["GET"])
+def stats():
+    return jsonify(STATS)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mock LlamaParse server with latency, 429 and failure injection")
+    parser.add_argument("--port", type=int, default=8002)
+    parser.add_argument("--latency-ms", type=float, default=1000.0, help="Time each job takes to finish")
+    parser.add_argument("--pages", type=int, default=3, help="Pages in every parsed document")
+    parser.add_argument("--failure-prob", type=float, default=0.0, help="Probability that a job ends in ERROR")
+    parser.add_argument("--rate-limit-prob", type=float, default=0.0, help="Probability of answering an upload with 429")
+    parser.add_argument("--max-concurrency", type=int, default=0,
+                        help="Answer 429 when this many jobs are already running (0 = unlimited)")
+    args = parser.parse_args()
+
+    CONFIG.update(
+        latency_ms=args.latency_ms,
+        pages=args.pages,
+        failure_prob=args.failure_prob,
+        rate_limit_prob=args.rate_limit_prob,
+        max_concurrency=args.max_concurrency,
+    )
+    app.run(host="127.0.0.1", port=args.port, threaded=True)
@@ -1,28 +1,124 @@
 # File: utils/llama_utils.py
 
 import os
+import re
 import json
+import time
+import random
+import shutil
+import asyncio
+import sys
 import dotenv
+from typing import Any, Dict, Optional
 from llama_cloud_services import LlamaParse
+# dev/, for the parse manifest shared with the Docling parser and the ingest daemon
+sys.path.append(os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..")))
+from chemrag_shared.parse_manifest import ParseManifest
 
 dotenv.load_dotenv()
 
-def parse_and_store(pdf_path: str, output_dir: str):
+# Everything that changes the stored outputs; part of the parse manifest key
+PARSER_SETTINGS = {
+    "parser": "llamaparse",
+    "language": "en",
+    "include_screenshot_images": True,
+    "include_object_images": False,
+}
+
+# "files": markdown/, text/, pages/ and images/ per document; "jsonl": one record stream
+OUTPUT_FORMATS = ("files", "jsonl")
+JSONL_NAME = "document.jsonl"
+JSONL_INDEX_NAME = "document.index.json"
+JSONL_VERSION = 1
+IMAGE_DOWNLOAD_CONCURRENCY = 8
+# Full-page screenshots, as opposed to images of objects on the page
+SCREENSHOT_NAME = re.compile(r"page[-_](\d+)\.jpg$")
+
+
+def _settings(output_format: str) -> Dict[str, Any]:
+    # The default format keeps the original settings, so existing manifests stay valid
+    if output_format == "files":
+        return PARSER_SETTINGS
+    return {**PARSER_SETTINGS, "output_format": output_format}
+
+def make_parser(base_url: Optional[str] = None) -> LlamaParse:
     """
-    Parse a single PDF with LlamaParse and store all outputs into the specified output directory.
-    Creates subdirectories for markdown, text, images, and pages.
+    Create a LlamaParse client. One client can be shared by every PDF in a batch.
+    `base_url` points it at another server, e.g. mock_parse_server.py.
     """
     LLAMA_API_KEY = os.environ['LLAMA_API_KEY']
-    parser = LlamaParse(
+    kwargs = {}
+    if base_url:
+        kwargs["base_url"] = base_url
+    return LlamaParse(
         api_key=LLAMA_API_KEY,
         num_workers=4,
         verbose=True,
-        language="en",
+        language=PARSER_SETTINGS["language"],
+        **kwargs,
     )
 
+
+def parse_and_store(
+    pdf_path: str,
+    output_dir: str,
+    parser: Optional[LlamaParse] = None,
+    output_format: str = "files",
+):
+    """
+    Parse a single PDF with LlamaParse and store all outputs into the specified output directory.
+    Creates subdirectories for markdown, text, images, and pages (or, with
+    output_format="jsonl", a single page-record stream; see store_result).
+    """
+    parser = parser or make_parser()
+
     # Parse the PDF
-    result = parser.parse(pdf_path)
+    result = _check_result(parser.parse(pdf_path), pdf_path)
+    store_result(result, output_dir, output_format)
+
+
+def _check_result(result: Any, pdf_path: str) -> Any:
+    # The client reports a failed job as an empty result rather than raising
+    error = getattr(result, "error", None)
+    if error:
+        raise RuntimeError(f"LlamaParse job failed for '{pdf_path}': {error}")
+    return result
+
 
+def store_result(result: Any, output_dir: str, output_format: str = "files"):
+    """
+    Write a LlamaParse result under output_dir, as per-page files ("files": markdown,
+    text, images and per-page data) or as one page-record stream ("jsonl").
+    """
+    if output_format == "jsonl":
+        _store_jsonl(result, output_dir)
+    else:
+        _store_files(result, output_dir)
+
+
+def _download_images(result: Any, images_dir: str) -> Dict[str, str]:
+    """Download the wanted images of a result concurrently; returns {image name: local path}."""
+    names = list(dict.fromkeys(
+        image.name
+        for page in result.pages
+        for image in page.images
+        if PARSER_SETTINGS["include_screenshot_images" if SCREENSHOT_NAME.search(image.name) else "include_object_images"]
+    ))
+    if not names:
+        return {}
+
+    async def fetch_all():
+        slots = asyncio.Semaphore(IMAGE_DOWNLOAD_CONCURRENCY)
+
+        async def fetch(name):
+            async with slots:
+                return name, await result.asave_image(name, images_dir)
+        return dict(await asyncio.gather(*(fetch(name) for name in names)))
+
+    return asyncio.run(fetch_all())
+
+
+def _store_files(result: Any, output_dir: str):
     # Create necessary subdirectories
     markdown_dir = os.path.join(output_dir, "markdown")
     text_dir = os.path.join(output_dir, "text")
@@ -53,24 +149,22 @@ def parse_and_store(pdf_path: str, output_dir: str):
         with open(os.path.join(text_dir, "parsed_text.txt"), "w", encoding="utf-8") as f:
             f.write(txt_content)
 
-    # 3. Download image documents into images_dir
-    image_documents = result.get_image_documents(
-        include_screenshot_images=True,
-        include_object_images=False,
-        image_download_dir=images_dir,
-    )
+    # 3. Download images into images_dir
+    local_paths = _download_images(result, images_dir)
 
     # Save image metadata
     image_metadata = []
-    for img_doc in image_documents:
-        metadata = {
-            "page_number": getattr(img_doc, "page_number", None),
-            "image_type": getattr(img_doc, "type", None),
-            "local_path": getattr(img_doc, "local_path", None),
-            "width": getattr(img_doc, "width", None),
-            "height": getattr(img_doc, "height", None),
-        }
-        image_metadata.append(metadata)
+    for page in result.pages:
+        for img in page.images:
+            if img.name not in local_paths:
+                continue
+            image_metadata.append({
+                "page_number": page.page,
+                "image_type": getattr(img, "type", None),
+                "local_path": local_paths[img.name],
+                "width": getattr(img, "width", None),
+                "height": getattr(img, "height", None),
+            })
 
     with open(os.path.join(output_dir, "image_metadata.json"), "w", encoding="utf-8") as f:
         json.dump(image_metadata, f, indent=2)
@@ -84,7 +178,7 @@ def parse_and_store(pdf_path: str, output_dir: str):
             "images": [
                 {
                     "type": getattr(img, "type", None),
-                    "local_path": getattr(img, "local_path", None),
+                    "local_path": local_paths.get(img.name),
                     "width": getattr(img, "width", None),
                     "height": getattr(img, "height", None),
                 }
@@ -97,27 +191,159 @@ def parse_and_store(pdf_path: str, output_dir: str):
             json.dump(page_data, f, indent=2)
 
 
-def batch_parse(input_dir: str, output_root: str):
+def _store_jsonl(result: Any, output_dir: str):
+    """
+    Write <output_dir>/document.jsonl, one JSON record per page with every field of
+    the page (text, md, items, layout, structuredData, images with their local
+    paths), and <output_dir>/document.index.json with each record's byte offset
+    and length, so any page can be read without scanning the file.
+    """
+    images_dir = os.path.join(output_dir, "images")
+    os.makedirs(images_dir, exist_ok=True)
+    local_paths = _download_images(result, images_dir)
+
+    entries = []
+    with open(os.path.join(output_dir, JSONL_NAME), "wb") as f:
+        for idx, page in enumerate(result.pages, start=1):
+            record = page.model_dump(mode="json")
+            record["page"] = record.get("page") or idx
+            for image in record.get("images") or []:
+                image["local_path"] = local_paths.get(image.get("name"))
+            line = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+            entries.append({"page": record["page"], "offset": f.tell(), "length": len(line)})
+            f.write(line)
+
+    job_metadata = getattr(result, "job_metadata", None)
+    with open(os.path.join(output_dir, JSONL_INDEX_NAME), "w", encoding="utf-8") as f:
+        json.dump({
+            "version": JSONL_VERSION,
+            "file_name": getattr(result, "file_name", None),
+            "job_id": getattr(result, "job_id", None),
+            "job_metadata": job_metadata.model_dump(mode="json") if hasattr(job_metadata, "model_dump") else job_metadata,
+            "pages": entries,
+        }, f, indent=2)
+
+
+def _scan_inputs(input_dir: str, output_root: str, manifest: ParseManifest):
+    pdfs = [
+        (filename, os.path.join(input_dir, filename), os.path.join(output_root, os.path.splitext(filename)[0]))
+        for filename in sorted(os.listdir(input_dir))
+        if filename.lower().endswith(".pdf")
+    ]
+    scan = manifest.scan(pdfs)
+    print(f"Scanned '{input_dir}': {ParseManifest.summary(scan)}.")
+    return scan["pending"]
+
+
+def _reset_output(output_dir: str):
+    # Outputs of an older version or an interrupted run; page files may not line up
+    if os.path.isdir(output_dir):
+        shutil.rmtree(output_dir)
+    os.makedirs(output_dir, exist_ok=True)
+
+
+def batch_parse(
+    input_dir: str,
+    output_root: str,
+    base_url: Optional[str] = None,
+    output_format: str = "files",
+):
     """
     For every PDF in `input_dir`, create a corresponding subdirectory under `output_root`
-    and run `parse_and_store`. Skip any file whose output folder already exists.
+    and run `parse_and_store`. PDFs whose current content was already parsed with the
+    same settings (per <output_root>/parse_manifest.json), including renamed copies,
+    are skipped.
     """
-    for filename in os.listdir(input_dir):
-        if not filename.lower().endswith(".pdf"):
-            continue
-        try:
-            name_without_ext = os.path.splitext(filename)[0]
-            output_dir = os.path.join(output_root, name_without_ext)
+    os.makedirs(output_root, exist_ok=True)
+    manifest = ParseManifest(output_root, _settings(output_format))
+    # Held for the whole run: FlashRank's ingest daemon also updates the manifest
+    with manifest.locked():
+        manifest.load()
+        pending = _scan_inputs(input_dir, output_root, manifest)
+        if not pending:
+            return
+        parser = make_parser(base_url)
 
-            # Skip if we've already created this output folder (i.e., it likely ran before)
-            if os.path.isdir(output_dir) and os.listdir(output_dir):
-                print(f"Skipping '{filename}' (output folder already exists).")
-                continue
+        for filename, pdf_path, output_dir, file_hash in pending:
+            try:
+                _reset_output(output_dir)
+                parse_and_store(pdf_path, output_dir, parser=parser, output_format=output_format)
+                manifest.complete(filename, pdf_path, file_hash, output_dir)
+            except Exception as e:
+                print(f"Error with {filename}:\n{e}")
 
-            os.makedirs(output_dir, exist_ok=True)
-            parse_and_store(os.path.join(input_dir, filename), output_dir)
+
+async def _aparse_with_retry(
+    parser: LlamaParse,
+    pdf_path: str,
+    max_retries: int,
+    backoff: float,
+    max_backoff: float = 60.0,
+) -> Any:
+    """Parse one PDF, retrying failed uploads or jobs with exponential backoff and jitter."""
+    for attempt in range(max_retries + 1):
+        try:
+            return _check_result(await parser.aparse(pdf_path), pdf_path)
         except Exception as e:
-            print(f"Error with {filename}:\n{e}")
+            if attempt == max_retries:
+                raise
+            delay = min(max_backoff, backoff * 2 ** attempt) * random.uniform(0.5, 1.0)
+            print(f"Parsing '{os.path.basename(pdf_path)}' failed ({e}); retry {attempt + 1}/{max_retries} in {delay:.1f}s.")
+            await asyncio.sleep(delay)
+
+
+async def abatch_parse(
+    input_dir: str,
+    output_root: str,
+    max_in_flight: int = 8,
+    max_retries: int = 3,
+    backoff: float = 2.0,
+    base_url: Optional[str] = None,
+    output_format: str = "files",
+):
+    """
+    Async form of `batch_parse`: one shared client keeps up to `max_in_flight` PDFs
+    being parsed at once, retries failures up to `max_retries` times with exponential
+    backoff starting at `backoff` seconds, and stores each result as soon as it
+    arrives (in a thread, so writing and image downloads do not stall submissions).
+    """
+    os.makedirs(output_root, exist_ok=True)
+    manifest = ParseManifest(output_root, _settings(output_format))
+    # Held for the whole run: FlashRank's ingest daemon also updates the manifest
+    with manifest.locked():
+        manifest.load()
+        pending = _scan_inputs(input_dir, output_root, manifest)
+        if not pending:
+            return
+        parser = make_parser(base_url)
+        slots = asyncio.Semaphore(max_in_flight)
+
+        async def parse_one(job):
+            _, pdf_path, output_dir, _ = job
+            try:
+                async with slots:
+                    result = await _aparse_with_retry(parser, pdf_path, max_retries, backoff)
+                await asyncio.to_thread(_reset_output, output_dir)
+                await asyncio.to_thread(store_result, result, output_dir, output_format)
+                return job, None
+            except Exception as e:
+                return job, e
+
+        start = time.monotonic()
+        failed = 0
+        tasks = [asyncio.ensure_future(parse_one(job)) for job in pending]
+        for done, task in enumerate(asyncio.as_completed(tasks), start=1):
+            (filename, pdf_path, output_dir, file_hash), error = await task
+            if error is None:
+                manifest.complete(filename, pdf_path, file_hash, output_dir)
+                status = f"Parsed '{filename}'"
+            else:
+                failed += 1
+                status = f"Error with {filename}: {error}"
+            elapsed = max(time.monotonic() - start, 1e-9)
+            print(f"[{done}/{len(pending)}] {status} ({done / elapsed * 60:.1f} PDFs/min, {elapsed:.0f}s elapsed)")
+        if failed:
+            print(f"{failed} of {len(pending)} PDFs failed to parse.")
 
 # ----------------------------------------------
 # Example usage (if this file is run directly):
@@ -128,7 +354,14 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Batch-parse PDFs using LlamaParse")
     parser.add_argument("--input_dir", required=True, help="Directory containing PDF files to parse")
     parser.add_argument("--output_root", required=True, help="Root directory where outputs will be stored")
+    parser.add_argument("--max_in_flight", type=int, default=0, help="Parse this many PDFs concurrently (async mode)")
+    parser.add_argument("--base_url", default=None, help="LlamaParse server, e.g. a local mock_parse_server.py")
+    parser.add_argument("--output_format", choices=OUTPUT_FORMATS, default="files", help="Per-page files or one JSONL stream")
     args = parser.parse_args()
 
-    batch_parse(args.input_dir, args.output_root)
+    if args.max_in_flight > 0:
+        asyncio.run(abatch_parse(args.input_dir, args.output_root, max_in_flight=args.max_in_flight,
+                                 base_url=args.base_url, output_format=args.output_format))
+    else:
+        batch_parse(args.input_dir, args.output_root, base_url=args.base_url, output_format=args.output_format)
 
@@ -19,6 +19,8 @@ export default function App() {
   const [query, setQuery] = useState('');
   const [messages, setMessages] = useState([]);
   const [loading, setLoading] = useState(false);
+  // Server-side conversation id, assigned by the first /ask response
+  const [sessionId, setSessionId] = useState(null);
 
   const renderContent = (content) => {
     const parts = content.split(/\*\*(.*?)\*\*/g);
@@ -47,8 +49,10 @@ export default function App() {
       const resp = await axios.post('/ask', {
         query: userMsg.content,
         history: newHistory,
+        session_id: sessionId,
       });
-      const { answer, sources } = resp.data;
+      const { answer, sources, session_id } = resp.data;
+      setSessionId(session_id);
       setMessages((prev) => [
         ...prev,
         { role: 'assistant', content: answer, sources },
@@ -0,0 +1,247 @@
+# File: chemrag_shared/parse_manifest.py
+#
+# The parse manifest format, shared by both parsers (DoclingTest, LlamaParseTest)
+# and FlashRank's ingest daemon, which all read and write the same file.
+
+import os
+import json
+import time
+import hashlib
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Tuple
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+MANIFEST_NAME = "parse_manifest.json"
+MANIFEST_VERSION = 1
+# Written into a PDF's output folder only after all of its outputs are in place
+MARKER_NAME = ".parse_complete.json"
+# Held by whoever is updating the manifest (a parser run, or the ingest daemon removing PDFs)
+LOCK_NAME = "parse_manifest.lock"
+
+
+def file_sha256(path: str, block_size: int = 1 << 20) -> str:
+    """
+    Return the hex SHA-256 of a file's contents, reading it in blocks.
+    """
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _lock_file(f):
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        return
+    while True:
+        try:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+            return
+        except OSError:
+            # LK_LOCK gives up after about 10 seconds
+            time.sleep(1)
+
+
+def _unlock_file(f):
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+    else:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def _write_json_atomic(path: str, data: Any):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+class ParseManifest:
+    """
+    Record of parsed PDFs stored as `<output_root>/parse_manifest.json`.
+
+    A parse is identified by the PDF's content hash together with the parser
+    settings, so a PDF is reparsed when its bytes or the settings change, and a
+    renamed copy of an already parsed PDF is not parsed again. A parse only
+    counts as done once its completion marker has been written into the output
+    folder, so a folder left half-written by a crash is parsed again. Hashes are
+    reused while a file's size and mtime are unchanged, which makes a rescan of
+    an unchanged input directory cheap.
+
+    Several processes write the manifest (a parser run and the ingest daemon);
+    each holds `locked()` from its `load()` to its last `save()`.
+    """
+
+    def __init__(self, output_root: str, settings: Optional[Dict[str, Any]] = None):
+        self.output_root = output_root
+        self.path = os.path.join(output_root, MANIFEST_NAME)
+        self.settings = settings
+        self.settings_key = hashlib.sha256(
+            json.dumps(settings, sort_keys=True).encode("utf-8")
+        ).hexdigest()[:16]
+        # filename -> {"hash", "size", "mtime", "output_dir", optional "duplicate_of"}
+        self.files: Dict[str, Dict[str, Any]] = {}
+        # content key -> {"name", "output_dir"} of the parse that produced it
+        self.completed: Dict[str, Dict[str, str]] = {}
+
+    def load(self) -> bool:
+        """Load the manifest from disk; False (and empty) if missing or unreadable."""
+        self.files, self.completed = {}, {}
+        if not os.path.isfile(self.path):
+            return False
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Warning: ignoring unreadable manifest {self.path}: {e}")
+            return False
+        if data.get("version") != MANIFEST_VERSION:
+            return False
+        self.files = data.get("files", {})
+        self.completed = data.get("completed", {})
+        return True
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        _write_json_atomic(self.path, {
+            "version": MANIFEST_VERSION,
+            "files": self.files,
+            "completed": self.completed,
+        })
+
+    @contextmanager
+    def locked(self):
+        """Hold the manifest's lock file, waiting for any other holder to finish."""
+        os.makedirs(self.output_root, exist_ok=True)
+        with open(os.path.join(self.output_root, LOCK_NAME), "a+") as f:
+            _lock_file(f)
+            try:
+                yield self
+            finally:
+                _unlock_file(f)
+
+    def content_key(self, file_hash: str) -> str:
+        return f"{file_hash}:{self.settings_key}"
+
+    def current_hash(self, name: str, pdf_path: str) -> str:
+        """Hash of the PDF now, reusing the recorded one if size and mtime are unchanged."""
+        st = os.stat(pdf_path)
+        entry = self.files.get(name)
+        if entry and entry.get("size") == st.st_size and entry.get("mtime") == st.st_mtime_ns:
+            return entry["hash"]
+        return file_sha256(pdf_path)
+
+    @staticmethod
+    def is_complete(output_dir: str, key: str) -> bool:
+        try:
+            with open(os.path.join(output_dir, MARKER_NAME), "r", encoding="utf-8") as f:
+                return json.load(f).get("key") == key
+        except (OSError, ValueError):
+            return False
+
+    def scan(self, pdfs: List[Tuple[str, str, str]]) -> Dict[str, Any]:
+        """
+        Compare `pdfs`, a list of (filename, pdf_path, output_dir), with the manifest.
+        Returns {"pending": [(filename, pdf_path, output_dir, hash)], "new", "changed",
+        "unchanged", "duplicates", "removed"}, the last five being lists of filenames.
+        Duplicates (same content as a parsed or pending PDF) are recorded right away.
+        """
+        result: Dict[str, Any] = {
+            "pending": [], "new": [], "changed": [], "unchanged": [], "duplicates": [], "removed": [],
+        }
+        # Content keys about to be parsed in this run, so copies within it are parsed once
+        claimed: Dict[str, Tuple[str, str]] = {}
+        for name, pdf_path, output_dir in pdfs:
+            try:
+                file_hash = self.current_hash(name, pdf_path)
+            except OSError as e:
+                print(f"Warning: failed to hash {pdf_path}: {e}")
+                continue
+            key = self.content_key(file_hash)
+            done = self.completed.get(key)
+            if done and not self.is_complete(done["output_dir"], key):
+                # Output deleted or overwritten since; that parse no longer counts
+                del self.completed[key]
+                done = None
+            if done and done["output_dir"] == output_dir:
+                result["unchanged"].append(name)
+                continue
+            original = done
+            if original is None and key in claimed:
+                original = {"name": claimed[key][0], "output_dir": claimed[key][1]}
+            if original and original["name"] != name:
+                self._record(name, pdf_path, file_hash, original["output_dir"], duplicate_of=original["name"])
+                result["duplicates"].append(name)
+                print(f"Skipping '{name}' (same content as '{original['name']}').")
+                continue
+            entry = self.files.get(name)
+            changed = entry and entry["hash"] != file_hash and not entry.get("duplicate_of")
+            result["changed" if changed else "new"].append(name)
+            claimed[key] = (name, output_dir)
+            result["pending"].append((name, pdf_path, output_dir, file_hash))
+
+        present = {name for name, _, _ in pdfs}
+        for name in [n for n in self.files if n not in present]:
+            del self.files[name]
+            result["removed"].append(name)
+        self.save()
+        return result
+
+    def start(self, output_dir: str):
+        """Withdraw the completion marker of an output folder about to be rewritten."""
+        try:
+            os.remove(os.path.join(output_dir, MARKER_NAME))
+        except FileNotFoundError:
+            pass
+
+    def complete(self, name: str, pdf_path: str, file_hash: str, output_dir: str):
+        """Mark a finished parse: write the folder's completion marker, then record it."""
+        key = self.content_key(file_hash)
+        _write_json_atomic(os.path.join(output_dir, MARKER_NAME), {
+            "key": key,
+            "source": name,
+            "settings": self.settings,
+        })
+        self.completed[key] = {"name": name, "output_dir": output_dir}
+        self._record(name, pdf_path, file_hash, output_dir)
+        self.save()
+
+    def remove(self, names: List[str]) -> List[str]:
+        """
+        Forget the PDFs `names` (deleted from the input directory). Returns the output
+        folders no remaining PDF uses, for the caller to delete; parses stored in them
+        no longer count. A name without an entry is taken to have used the usual
+        `<output_root>/<basename>` folder.
+        """
+        candidates = set()
+        for name in names:
+            entry = self.files.pop(name, None) or {}
+            output_dir = entry.get("output_dir") or os.path.join(self.output_root, os.path.splitext(name)[0])
+            candidates.add(os.path.abspath(output_dir))
+        in_use = {os.path.abspath(entry["output_dir"]) for entry in self.files.values() if entry.get("output_dir")}
+        orphaned = sorted(candidates - in_use)
+        self.completed = {
+            key: done for key, done in self.completed.items()
+            if os.path.abspath(done["output_dir"]) not in orphaned
+        }
+        return orphaned
+
+    def _record(self, name: str, pdf_path: str, file_hash: str, output_dir: str, duplicate_of: Optional[str] = None):
+        st = os.stat(pdf_path)
+        entry = {"hash": file_hash, "size": st.st_size, "mtime": st.st_mtime_ns, "output_dir": output_dir}
+        if duplicate_of:
+            entry["duplicate_of"] = duplicate_of
+        self.files[name] = entry
+
+    @staticmethod
+    def summary(result: Dict[str, Any]) -> str:
+        return ", ".join(
+            f"{len(result[k])} {k}" for k in ("new", "changed", "unchanged", "duplicates", "removed")
+        )